@@ -25,33 +25,17 @@ def create_app(config_class=Config):
 
     with app.app_context():
         db.create_all()
+        from app.history_search import init_search_index
+        init_search_index()
 
     @app.context_processor
     def inject_categories():
-        # Provide categories and their tools for navigation
+        # Provide categories and their tools for navigation (cached, see app/nav_cache.py)
         try:
-            from app.models import Category, Tool
-            from sqlalchemy import func
-            from sqlalchemy.orm import selectinload
-            # Only top-level categories (parent_id is NULL), eager-load children and tools
-            cats = Category.query.options(selectinload(Category.children), selectinload(Category.tools))\
-                .filter(Category.parent_id == None)\
-                .order_by(func.lower(func.coalesce(Category.display_name, Category.name)))\
-                .all()
-            # Filter out categories that have no tools and whose children also have no tools
-            visible = []
-            for c in cats:
-                has_tools = bool(c.tools)
-                has_child_tools = any(bool(child.tools) for child in c.children)
-                if has_tools or has_child_tools:
-                    visible.append(c)
-
-            # Also expose unassigned tools (helpful so users can assign a category from Manage Tools and access the tool immediately)
-            unassigned_tools = Tool.query.filter(Tool.category_id == None, Tool.is_active == True).order_by(func.lower(func.coalesce(Tool.display_name, Tool.name))).all()
-
-            return {'nav_categories': visible, 'nav_unassigned_tools': unassigned_tools}
+            from app.nav_cache import nav_context
+            return nav_context()
         except Exception:
-            return {'nav_categories': [], 'nav_unassigned_tools': []}
+            return {'nav_categories': [], 'nav_unassigned_tools': [], 'nav_tools_html': None}
 
     return app
 
@@ -0,0 +1,196 @@
+"""Full-text search over Diff Checker and Rule Card Formatter history.
+
+On SQLite with FTS5, each history table has a contentless FTS5 index (the text is tokenized
+but not stored a second time) whose rowid is the history row id:
+
+    diff_history_fts(names, content)          text1/text2 names; both texts
+    rule_card_history_fts(input, rule_ids)    the card text; the rule IDs found in it
+
+New rows are indexed in the same transaction that inserts them (an after_flush hook), and
+init_db.py backfills rows saved before the index existed. Results are ranked with bm25.
+Other databases, or SQLite without FTS5, fall back to LIKE over the names and the card input,
+newest first.
+
+History rows are never deleted. Removing rows would also need FTS5's 'delete' command, which
+for a contentless table takes the original indexed values.
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import DiffHistory, RuleCardHistory
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_KINDS = ('diff', 'rule_card')
+# bm25 column weights: a hit in the names / rule IDs counts more than one in the text
+DIFF_WEIGHTS = (4.0, 1.0)
+RULE_CARD_WEIGHTS = (1.0, 4.0)
+BACKFILL_BATCH = 200
+
+_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS diff_history_fts USING fts5(names, content, content='')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS rule_card_history_fts USING fts5(input, rule_ids, content='')",
+)
+# engines (by URL) where the FTS5 tables exist
+_fts_engines = set()
+
+
+def init_search_index(engine=None) -> bool:
+    """Create the FTS5 tables if the database supports them; returns whether FTS5 is in use."""
+    engine = engine or db.engine
+    if engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with engine.begin() as conn:
+            for ddl in _FTS_DDL:
+                conn.execute(text(ddl))
+    except Exception:
+        # SQLite built without FTS5
+        return False
+    _fts_engines.add(str(engine.url))
+    return True
+
+
+def fts_enabled(engine=None) -> bool:
+    return str((engine or db.engine).url) in _fts_engines
+
+
+def _rule_ids(card_text: str) -> str:
+    from app.tools.rulecard import tokenize
+    ids = []
+    for tok in tokenize(card_text or ''):
+        if tok.id:
+            ids.append(tok.id)
+        elif tok.segments is not None and tok.path()[1]:
+            ids.append(tok.path()[1])
+    return ' '.join(dict.fromkeys(ids))
+
+
+def _diff_entry(h: DiffHistory) -> Dict[str, Any]:
+    return {'rowid': h.id, 'names': f'{h.text1_name or ""} {h.text2_name or ""}',
+            'content': f'{h.text1_content or ""}\n{h.text2_content or ""}'}
+
+
+def _rule_card_entry(h: RuleCardHistory) -> Dict[str, Any]:
+    return {'rowid': h.id, 'input': h.input_text or '', 'rule_ids': _rule_ids(h.input_text)}
+
+
+_INSERT_DIFF = text('INSERT INTO diff_history_fts (rowid, names, content) VALUES (:rowid, :names, :content)')
+_INSERT_RULE_CARD = text('INSERT INTO rule_card_history_fts (rowid, input, rule_ids) '
+                         'VALUES (:rowid, :input, :rule_ids)')
+
+
+@event.listens_for(Session, 'after_flush')
+def _index_new_rows(session, flush_context):
+    diffs = [obj for obj in session.new if isinstance(obj, DiffHistory)]
+    cards = [obj for obj in session.new if isinstance(obj, RuleCardHistory)]
+    if not diffs and not cards:
+        return
+    conn = session.connection()
+    if not fts_enabled(conn.engine):
+        return
+    with session.no_autoflush:
+        if diffs:
+            conn.execute(_INSERT_DIFF, [_diff_entry(h) for h in diffs])
+        if cards:
+            conn.execute(_INSERT_RULE_CARD, [_rule_card_entry(h) for h in cards])
+
+
+def backfill_search_index(batch_size: int = BACKFILL_BATCH) -> int:
+    """Index history rows that are not in the index yet; returns how many were added."""
+    if not fts_enabled():
+        return 0
+    added = 0
+    for model, table, entry, insert in ((DiffHistory, 'diff_history_fts', _diff_entry, _INSERT_DIFF),
+                                        (RuleCardHistory, 'rule_card_history_fts', _rule_card_entry,
+                                         _INSERT_RULE_CARD)):
+        # not max(rowid): once the after_flush hook has indexed a new row, older unindexed rows sit below it
+        missing = text(f'{model.__tablename__}.id NOT IN (SELECT rowid FROM {table})')
+        while True:
+            rows = model.query.options(db.undefer('*')).filter(missing) \
+                .order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            db.session.execute(insert, [entry(h) for h in rows])
+            db.session.commit()
+            added += len(rows)
+    return added
+
+
+def _match_query(q: str) -> Optional[str]:
+    """User input as an FTS5 query: every word must match, as a prefix, with operators quoted away."""
+    terms = re.findall(r'\w+', q)
+    return ' '.join(f'"{t}"*' for t in terms) or None
+
+
+def _fts_hits(kind: str, user_id: int, match: str, limit: int, offset: int) -> List[Tuple[str, int, float]]:
+    if kind == 'diff':
+        table, base, weights = 'diff_history_fts', 'diff_history', DIFF_WEIGHTS
+    else:
+        table, base, weights = 'rule_card_history_fts', 'rule_card_history', RULE_CARD_WEIGHTS
+    rows = db.session.execute(text(
+        f'SELECT h.id, bm25({table}, {weights[0]}, {weights[1]}) AS score '
+        f'FROM {table} JOIN {base} h ON h.id = {table}.rowid '
+        f'WHERE {table} MATCH :match AND h.user_id = :user_id '
+        f'ORDER BY score, h.id DESC LIMIT :limit OFFSET :offset'),
+        {'match': match, 'user_id': user_id, 'limit': limit, 'offset': offset})
+    return [(kind, row_id, score) for row_id, score in rows]
+
+
+def _like_hits(kind: str, user_id: int, q: str, limit: int, offset: int) -> List[Tuple[str, int, float]]:
+    terms = [t for t in q.split() if t]
+    model = DiffHistory if kind == 'diff' else RuleCardHistory
+    query = db.session.query(model.id, model.timestamp).filter(model.user_id == user_id)
+    for term in terms:
+        pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        if kind == 'diff':
+            query = query.filter(db.or_(DiffHistory.text1_name.ilike(pattern, escape='\\'),
+                                        DiffHistory.text2_name.ilike(pattern, escape='\\')))
+        else:
+            query = query.filter(RuleCardHistory.input_text.ilike(pattern, escape='\\'))
+    rows = query.order_by(model.timestamp.desc(), model.id.desc()).limit(limit).offset(offset).all()
+    # newest first; the timestamp stands in for a score when merging kinds
+    return [(kind, row_id, -(ts.timestamp() if ts else 0)) for row_id, ts in rows]
+
+
+def search_history(user_id: int, q: str, kinds=SEARCH_KINDS, page: int = 1,
+                   per_page: int = SEARCH_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], bool]:
+    """One page of the user's matching history rows, best first, and whether there is a next page.
+
+    Each result is {'kind': 'diff' | 'rule_card', 'row': the history row, 'score': float}.
+    """
+    page = max(page, 1)
+    offset = (page - 1) * per_page
+    use_fts = fts_enabled()
+    match = _match_query(q) if use_fts else None
+    if (use_fts and not match) or not q.strip():
+        return [], False
+    hits = []
+    for kind in kinds:
+        # with several kinds, each contributes up to the end of this page before merging
+        limit, skip = (per_page + 1, offset) if len(kinds) == 1 else (offset + per_page + 1, 0)
+        if use_fts:
+            hits += _fts_hits(kind, user_id, match, limit, skip)
+        else:
+            hits += _like_hits(kind, user_id, q, limit, skip)
+    if len(kinds) > 1:
+        hits.sort(key=lambda h: h[2])
+        hits = hits[offset:]
+    has_more = len(hits) > per_page
+    hits = hits[:per_page]
+
+    rows = {}
+    for kind, model, columns in (
+            ('diff', DiffHistory, (DiffHistory.id, DiffHistory.text1_name, DiffHistory.text2_name,
+                                   DiffHistory.timestamp)),
+            ('rule_card', RuleCardHistory, (RuleCardHistory.id, RuleCardHistory.format_type,
+                                            RuleCardHistory.timestamp))):
+        ids = [row_id for k, row_id, _ in hits if k == kind]
+        if ids:
+            for row in model.query.options(db.load_only(*columns)).filter(model.id.in_(ids)):
+                rows[kind, row.id] = row
+    return [{'kind': kind, 'row': rows[kind, row_id], 'score': score}
+            for kind, row_id, score in hits if (kind, row_id) in rows], has_more
@@ -0,0 +1,19 @@
+from datetime import datetime
+
+import click
+
+from app.main import bp
+from app.usage import rebuild_rollups
+
+
+@bp.cli.command('rollup-usage')
+@click.option('--since', default=None, metavar='YYYY-MM-DD',
+              help='Only recompute days from this date on (default: all days).')
+def rollup_usage(since):
+    """Rebuild the daily tool and user usage rollups from the tool_usage table."""
+    try:
+        day = datetime.strptime(since, '%Y-%m-%d').date() if since else None
+    except ValueError:
+        raise click.BadParameter('expected a date as YYYY-MM-DD', param_hint='--since')
+    counted = rebuild_rollups(day)
+    click.echo(f'Rolled up {counted} usage row(s){f" since {day}" if day else ""}.')
@@ -6,8 +6,9 @@ from sqlalchemy.orm import selectinload
 from datetime import datetime, timedelta
 from app import db
 from app.main import bp
-from app.models import Tool, ToolUsage, User, Category
+from app.models import Tool, ToolUsage, ToolUsageDaily, User, UserUsageDaily, Category
 from app.main.forms import CategoryForm, ToolAssignForm
+from app.nav_cache import bump_nav_version
 
 @bp.route('/')
 def index():
@@ -26,11 +27,11 @@ def dashboard():
         joinedload(ToolUsage.user)
     ).order_by(desc(ToolUsage.timestamp)).limit(10).all()
 
-    # Compute top 10 most used tools (by usage count)
+    # Compute top 10 most used tools (by usage count), from the daily rollups
     results = db.session.query(
         Tool,
-        func.count(ToolUsage.id).label('count')
-    ).join(ToolUsage).group_by(Tool.id).order_by(desc('count')).limit(10).all()
+        func.sum(ToolUsageDaily.count).label('count')
+    ).join(ToolUsageDaily).group_by(Tool.id).order_by(desc('count')).limit(10).all()
     most_used_tools_with_counts = [(r[0], r[1]) for r in results]
     
     return render_template('main/dashboard.html', 
@@ -45,17 +46,21 @@ def dashboard():
 def analytics():
     return render_template('main/analytics.html', title='Analytics')
 
+# Analytics cover the last ANALYTICS_DAYS days and read the daily rollups kept by app/usage.py
+ANALYTICS_DAYS = 30
+
+def _analytics_since():
+    return (datetime.utcnow() - timedelta(days=ANALYTICS_DAYS)).date()
+
 @bp.route('/api/analytics/most-used-tools')
 @login_required
 def api_most_used_tools():
     # Get most used tools in last 30 days
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    
     results = db.session.query(
         Tool.display_name,
-        func.count(ToolUsage.id).label('count')
-    ).join(ToolUsage).filter(
-        ToolUsage.timestamp >= thirty_days_ago
+        func.sum(ToolUsageDaily.count).label('count')
+    ).join(ToolUsageDaily).filter(
+        ToolUsageDaily.day >= _analytics_since()
     ).group_by(Tool.id).order_by(desc('count')).limit(10).all()
     
     return jsonify({
@@ -67,14 +72,12 @@ def api_most_used_tools():
 @login_required
 def api_usage_by_date():
     # Get usage by date for last 30 days
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    
     results = db.session.query(
-        func.date(ToolUsage.timestamp).label('date'),
-        func.count(ToolUsage.id).label('count')
+        ToolUsageDaily.day,
+        func.sum(ToolUsageDaily.count).label('count')
     ).filter(
-        ToolUsage.timestamp >= thirty_days_ago
-    ).group_by(func.date(ToolUsage.timestamp)).order_by('date').all()
+        ToolUsageDaily.day >= _analytics_since()
+    ).group_by(ToolUsageDaily.day).order_by(ToolUsageDaily.day).all()
     
     return jsonify({
         'labels': [str(r[0]) for r in results],
@@ -84,11 +87,13 @@ def api_usage_by_date():
 @bp.route('/api/analytics/usage-by-user')
 @login_required
 def api_usage_by_user():
-    # Get top 10 users by usage
+    # Get top 10 users by usage in last 30 days
     results = db.session.query(
         User.username,
-        func.count(ToolUsage.id).label('count')
-    ).join(ToolUsage).group_by(User.id).order_by(desc('count')).limit(10).all()
+        func.sum(UserUsageDaily.count).label('count')
+    ).join(UserUsageDaily).filter(
+        UserUsageDaily.day >= _analytics_since()
+    ).group_by(User.id).order_by(desc('count')).limit(10).all()
     
     return jsonify({
         'labels': [r[0] for r in results],
@@ -112,6 +117,7 @@ def categories_new():
         cat = Category(name=form.name.data, display_name=form.display_name.data, parent_id=form.parent_id.data or None)
         db.session.add(cat)
         db.session.commit()
+        bump_nav_version()
         flash('Category created', 'success')
         return redirect(url_for('main.categories_list'))
     return render_template('main/category_form.html', title='New Category', form=form)
@@ -128,6 +134,7 @@ def categories_edit(id):
         cat.display_name = form.display_name.data
         cat.parent_id = form.parent_id.data or None
         db.session.commit()
+        bump_nav_version()
         flash('Category updated', 'success')
         return redirect(url_for('main.categories_list'))
     return render_template('main/category_form.html', title='Edit Category', form=form)
@@ -138,6 +145,7 @@ def categories_delete(id):
     cat = Category.query.get_or_404(id)
     db.session.delete(cat)
     db.session.commit()
+    bump_nav_version()
     flash('Category deleted', 'success')
     return redirect(url_for('main.categories_list'))
 
@@ -165,5 +173,6 @@ def tools_assign(id):
     else:
         tool.category_id = None
     db.session.commit()
+    bump_nav_version()
     flash('Tool assignment updated', 'success')
     return redirect(url_for('main.tools_manage'))
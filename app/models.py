@@ -1,8 +1,15 @@
+import hashlib
+import zlib
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from app import db, login_manager
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # zlib is used instead
+
 @login_manager.user_loader
 def load_user(id):
     return User.query.get(int(id))
@@ -71,16 +78,130 @@ class ToolUsage(db.Model):
     def __repr__(self):
         return f'<ToolUsage {self.id}>'
 
+
+# Daily usage counts kept up to date as usage is recorded (app/usage.py); analytics read these
+# instead of aggregating tool_usage
+class ToolUsageDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    tool_id = db.Column(db.Integer, db.ForeignKey('tool.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ToolUsageDaily {self.day} {self.tool_id}>'
+
+
+class UserUsageDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<UserUsageDaily {self.day} {self.user_id}>'
+
+class ContentBlob(db.Model):
+    """Compressed text content stored once per distinct value, keyed by its SHA-256."""
+    hash = db.Column(db.String(64), primary_key=True)
+    codec = db.Column(db.String(8), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def put(text):
+        """Store text (if not already present) and return its hash."""
+        raw = (text or '').encode('utf-8')
+        digest = hashlib.sha256(raw).hexdigest()
+        if db.session.get(ContentBlob, digest) is None:
+            if zstandard is not None:
+                codec, data = 'zstd', zstandard.ZstdCompressor(level=10).compress(raw)
+            else:
+                codec, data = 'zlib', zlib.compress(raw, 9)
+            db.session.add(ContentBlob(hash=digest, codec=codec, size=len(raw), data=data))
+        return digest
+
+    @staticmethod
+    def put_file(path, chunk_chars=1 << 20):
+        """Store a UTF-8 text file like put(open(path).read()) without holding the text in memory.
+
+        The file is decoded with universal newlines and invalid bytes replaced, read once to hash it
+        and, if the blob is new, once more to compress it.
+        """
+        def chunks():
+            with open(path, encoding='utf-8', errors='replace', newline=None) as f:
+                for text in iter(lambda: f.read(chunk_chars), ''):
+                    yield text.encode('utf-8')
+
+        sha, size = hashlib.sha256(), 0
+        for raw in chunks():
+            sha.update(raw)
+            size += len(raw)
+        digest = sha.hexdigest()
+        if db.session.get(ContentBlob, digest) is None:
+            if zstandard is not None:
+                # the content size goes in the frame header so text() can decompress in one call
+                codec, comp = 'zstd', zstandard.ZstdCompressor(level=10).compressobj(size=size)
+            else:
+                codec, comp = 'zlib', zlib.compressobj(9)
+            data = b''.join(comp.compress(raw) for raw in chunks()) + comp.flush()
+            db.session.add(ContentBlob(hash=digest, codec=codec, size=size, data=data))
+        return digest
+
+    @staticmethod
+    def get_text(digest):
+        blob = db.session.get(ContentBlob, digest)
+        if blob is None:
+            return None
+        return blob.text()
+
+    def text(self):
+        if self.codec == 'zstd':
+            raw = zstandard.ZstdDecompressor().decompress(self.data)
+        else:
+            raw = zlib.decompress(self.data)
+        return raw.decode('utf-8')
+
+    def __repr__(self):
+        return f'<ContentBlob {self.hash[:12]}>'
+
 class DiffHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     text1_name = db.Column(db.String(128))
     text2_name = db.Column(db.String(128))
-    text1_content = db.Column(db.Text)
-    text2_content = db.Column(db.Text)
-    diff_result = db.Column(db.Text)
+    # Contents live in ContentBlob; the inline columns are only read for rows not yet migrated
+    text1_blob_id = db.Column(db.String(64), db.ForeignKey('content_blob.hash'))
+    text2_blob_id = db.Column(db.String(64), db.ForeignKey('content_blob.hash'))
+    legacy_text1_content = db.deferred(db.Column('text1_content', db.Text))
+    legacy_text2_content = db.deferred(db.Column('text2_content', db.Text))
+    # Rendered HTML is no longer stored; views re-render it from the contents
+    legacy_diff_result = db.deferred(db.Column('diff_result', db.Text))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    
+
+    # Backs the per-user history listing (newest first, keyset paginated)
+    __table_args__ = (db.Index('ix_diff_history_user_timestamp', 'user_id', 'timestamp'),)
+
+    @property
+    def text1_content(self):
+        if self.text1_blob_id:
+            return ContentBlob.get_text(self.text1_blob_id)
+        return self.legacy_text1_content
+
+    @text1_content.setter
+    def text1_content(self, value):
+        self.text1_blob_id = ContentBlob.put(value)
+        self.legacy_text1_content = None
+
+    @property
+    def text2_content(self):
+        if self.text2_blob_id:
+            return ContentBlob.get_text(self.text2_blob_id)
+        return self.legacy_text2_content
+
+    @text2_content.setter
+    def text2_content(self, value):
+        self.text2_blob_id = ContentBlob.put(value)
+        self.legacy_text2_content = None
+
     def __repr__(self):
         return f'<DiffHistory {self.id}>'
 
@@ -89,9 +210,39 @@ class RuleCardHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     format_type = db.Column(db.String(64))
-    input_text = db.Column(db.Text)
-    result_text = db.Column(db.Text)
+    # Large columns load only when accessed (detail view); listings use result_preview instead
+    input_text = db.deferred(db.Column(db.Text))
+    result_text = db.deferred(db.Column(db.Text))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Populated per query with with_expression(), e.g. a prefix of result_text
+    result_preview = db.query_expression()
+
+    __table_args__ = (db.Index('ix_rule_card_history_user_timestamp', 'user_id', 'timestamp'),)
 
     def __repr__(self):
         return f'<RuleCardHistory {self.id}>'
+
+
+def migrate_diff_history_blobs(batch_size=200):
+    """Move inline DiffHistory contents into ContentBlob rows and drop stored diff HTML.
+
+    Safe to run repeatedly; returns the number of rows migrated.
+    """
+    migrated = 0
+    while True:
+        rows = DiffHistory.query.options(db.undefer('*')).filter(
+            db.or_(DiffHistory.legacy_text1_content != None, DiffHistory.legacy_text2_content != None,
+                   DiffHistory.legacy_diff_result != None)
+        ).limit(batch_size).all()
+        if not rows:
+            return migrated
+        for h in rows:
+            if h.text1_blob_id is None:
+                h.text1_content = h.legacy_text1_content
+            if h.text2_blob_id is None:
+                h.text2_content = h.legacy_text2_content
+            h.legacy_text1_content = None
+            h.legacy_text2_content = None
+            h.legacy_diff_result = None
+        db.session.commit()
+        migrated += len(rows)
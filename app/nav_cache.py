@@ -0,0 +1,109 @@
+"""Navigation menu data, built once and kept until categories or tool assignments change.
+
+The inject_categories context processor used to query the category tree and the unassigned
+tools for every rendered page. The tree is now loaded once into plain tuples (no ORM objects
+outliving their session), and, when NAV_FRAGMENT_CACHE is on, the Tools dropdown is rendered
+once to HTML as well.
+
+Routes that change what the menu shows call bump_nav_version() after committing. The version is
+a stamp file in the instance folder, replaced on every bump, so each worker process notices the
+change with one stat() per page and rebuilds on its next render.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from flask import current_app
+from markupsafe import Markup
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+
+NAV_VERSION_FILE = 'nav_version'
+NAV_FRAGMENT_TEMPLATE = '_nav_tools.html'
+
+
+class NavTool(NamedTuple):
+    display_name: str
+    route: str
+
+
+class NavCategory(NamedTuple):
+    name: str
+    display_name: Optional[str]
+    tools: List[NavTool]
+    children: List['NavCategory']
+
+
+def _cache() -> Dict[str, Any]:
+    # per app: the stamp the cached menu was built for, the menu itself and its rendered HTML
+    return current_app.extensions.setdefault('nav_cache', {'lock': threading.Lock(), 'stamp': None,
+                                                           'nav': None, 'html': None})
+
+
+def _stamp_path() -> str:
+    return os.path.join(current_app.instance_path, NAV_VERSION_FILE)
+
+
+def _read_stamp() -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(_stamp_path())
+    except OSError:
+        return None
+    # the file is replaced on every bump, so the inode changes even when mtime is coarse
+    return st.st_ino, st.st_mtime_ns
+
+
+def bump_nav_version() -> None:
+    """Mark the cached menu stale in every process; call after committing category/tool changes."""
+    path = _stamp_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}'
+    with open(tmp, 'w') as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp, path)
+    cache = _cache()
+    with cache['lock']:
+        cache['stamp'] = cache['nav'] = cache['html'] = None
+
+
+def _tools(tools) -> List[NavTool]:
+    return [NavTool(t.display_name, t.route) for t in tools]
+
+
+def load_nav() -> Dict[str, List]:
+    """The menu from the database: top-level categories that have tools (directly or in a child
+    category), A-Z, and the active tools without a category."""
+    from app.models import Category, Tool
+    cats = Category.query.options(selectinload(Category.children).selectinload(Category.tools),
+                                  selectinload(Category.tools))\
+        .filter(Category.parent_id == None)\
+        .order_by(func.lower(func.coalesce(Category.display_name, Category.name)))\
+        .all()
+    visible = []
+    for c in cats:
+        if c.tools or any(child.tools for child in c.children):
+            children = [NavCategory(child.name, child.display_name, _tools(child.tools), []) for child in c.children]
+            visible.append(NavCategory(c.name, c.display_name, _tools(c.tools), children))
+    # unassigned tools are listed so they are reachable before a category is assigned in Manage Tools
+    unassigned = Tool.query.filter(Tool.category_id == None, Tool.is_active == True)\
+        .order_by(func.lower(func.coalesce(Tool.display_name, Tool.name))).all()
+    return {'nav_categories': visible, 'nav_unassigned_tools': _tools(unassigned)}
+
+
+def nav_context() -> Dict[str, Any]:
+    """Template variables for the menu: nav_categories, nav_unassigned_tools and nav_tools_html
+    (the rendered Tools dropdown, or None when NAV_FRAGMENT_CACHE is off)."""
+    cache = _cache()
+    stamp = _read_stamp()
+    with cache['lock']:
+        if cache['nav'] is not None and cache['stamp'] == stamp:
+            return dict(cache['nav'], nav_tools_html=cache['html'])
+    nav = load_nav()
+    html = None
+    if current_app.config.get('NAV_FRAGMENT_CACHE', True):
+        # rendered straight from the Jinja environment: render_template would run the context processors again
+        html = Markup(current_app.jinja_env.get_template(NAV_FRAGMENT_TEMPLATE).render(**nav))
+    with cache['lock']:
+        cache.update(stamp=stamp, nav=nav, html=html)
+    return dict(nav, nav_tools_html=html)
@@ -0,0 +1,86 @@
+// Diff Checker client-side behaviour.
+// Long changed line pairs are rendered without word highlights; clicking one fetches them.
+(function () {
+    const output = document.querySelector('.diff-output[data-intraline-url]');
+    if (!output) return;
+    const url = output.dataset.intralineUrl;
+
+    output.addEventListener('click', async (e) => {
+        const line = e.target.closest('.diff-line[data-pair]');
+        if (!line) return;
+        const pair = output.querySelectorAll(`.diff-line[data-pair="${line.dataset.pair}"]`);
+        const removed = Array.from(pair).find(el => el.classList.contains('diff-remove'));
+        const added = Array.from(pair).find(el => el.classList.contains('diff-add'));
+        if (!removed || !added) return;
+        const res = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                a: removed.querySelector('.diff-content').textContent,
+                b: added.querySelector('.diff-content').textContent
+            })
+        });
+        const j = await res.json();
+        if (j.ok) {
+            removed.querySelector('.diff-content').innerHTML = j.a;
+            added.querySelector('.diff-content').innerHTML = j.b;
+            removed.removeAttribute('data-pair');
+            added.removeAttribute('data-pair');
+        }
+    });
+})();
+
+// Large diffs: only the chunks of rows around the visible window are kept in the page.
+(function () {
+    const output = document.querySelector('.diff-output[data-rows-url]');
+    if (!output) return;
+    const url = output.dataset.rowsUrl;
+    const total = parseInt(output.dataset.total, 10);
+    const chunkRows = parseInt(output.dataset.chunk, 10);
+    const spacer = output.querySelector('.diff-virtual-spacer');
+    const chunks = new Map();  // chunk index -> element, or null while loading
+    let rowHeight = 0;
+
+    async function load(index) {
+        chunks.set(index, null);
+        const res = await fetch(`${url}?start=${index * chunkRows}&count=${chunkRows}`);
+        const j = await res.json();
+        if (!j.ok || !chunks.has(index)) return;
+        const el = document.createElement('div');
+        el.className = 'diff-virtual-chunk';
+        el.innerHTML = j.rows.join('');
+        el.querySelectorAll('.diff-content').forEach(c => { c.title = c.textContent; });
+        output.appendChild(el);
+        if (!rowHeight) {
+            rowHeight = el.firstElementChild.getBoundingClientRect().height;
+            spacer.style.height = `${total * rowHeight}px`;
+        }
+        el.style.top = `${index * chunkRows * rowHeight}px`;
+        chunks.set(index, el);
+    }
+
+    function update() {
+        const span = chunkRows * (rowHeight || 1);
+        const first = Math.max(Math.floor(output.scrollTop / span) - 1, 0);
+        const last = Math.min(Math.floor((output.scrollTop + output.clientHeight) / span) + 1,
+                              Math.ceil(total / chunkRows) - 1);
+        for (const [index, el] of chunks) {
+            if (index < first || index > last) {
+                if (el) el.remove();
+                chunks.delete(index);
+            }
+        }
+        for (let i = first; i <= last; i++) {
+            if (!chunks.has(i)) load(i);
+        }
+    }
+
+    let pending = false;
+    output.addEventListener('scroll', () => {
+        if (pending) return;
+        pending = true;
+        requestAnimationFrame(() => { pending = false; update(); });
+    });
+    // the first chunk fixes the row height; the rest is positioned from it
+    load(0).then(update);
+})();
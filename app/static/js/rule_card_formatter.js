@@ -1,2 +1,110 @@
-// minimal client-side enhancements can be added later
-console.log('rule_card_formatter loaded');
+// Live preview for the Rule Card Formatter: while typing, only the changed lines are sent to
+// the preview endpoint, which keeps the rest of the card from the previous request.
+(function () {
+    const preview = document.getElementById('live-preview');
+    const input = document.querySelector('textarea[name="input_text"]');
+    if (!preview || !input) return;
+
+    const url = preview.dataset.url;
+    const status = document.getElementById('live-preview-status');
+    const DEBOUNCE_MS = 150;
+
+    let session = null;
+    let version = null;
+    let sentLines = null;  // the text the server has, as lines
+    let inFlight = false;
+    let pending = false;
+    let timer = null;
+
+    function currentFormat() {
+        const checked = document.querySelector('input[name="format_type"]:checked');
+        const fmt = checked ? checked.value : 'hierarchical';
+        // the preview shows one format; 'all' previews the hierarchical one
+        return fmt === 'all' ? 'hierarchical' : fmt;
+    }
+
+    // One edit replacing the lines between the common prefix and the common suffix
+    function lineEdit(oldLines, newLines) {
+        let start = 0;
+        const max = Math.min(oldLines.length, newLines.length);
+        while (start < max && oldLines[start] === newLines[start]) start++;
+        let oldEnd = oldLines.length;
+        let newEnd = newLines.length;
+        while (oldEnd > start && newEnd > start && oldLines[oldEnd - 1] === newLines[newEnd - 1]) {
+            oldEnd--;
+            newEnd--;
+        }
+        return { start: start, end: oldEnd, lines: newLines.slice(start, newEnd) };
+    }
+
+    function show(data) {
+        if (data.format === 'jira_html') {
+            preview.innerHTML = data.output;
+        } else {
+            preview.textContent = data.output;
+        }
+        if (status) {
+            status.textContent = data.boards === null ? data.elapsed_ms + ' ms'
+                : data.changed.length + ' of ' + data.boards + ' boards updated, ' + data.elapsed_ms + ' ms';
+        }
+    }
+
+    function send(resync) {
+        if (inFlight) {
+            pending = true;
+            return;
+        }
+        const lines = input.value.replace(/\r/g, '').split('\n');
+        const body = { format: currentFormat(), session: session };
+        if (resync || session === null) {
+            body.text = lines.join('\n');
+        } else {
+            body.version = version;
+            body.edits = [lineEdit(sentLines, lines)];
+        }
+        inFlight = true;
+        fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body),
+        }).then(function (resp) {
+            return resp.json().then(function (data) { return { status: resp.status, data: data }; });
+        }).then(function (res) {
+            inFlight = false;
+            if (res.status === 409 && res.data.resync) {
+                session = null;
+                send(true);
+                return;
+            }
+            if (!res.data.ok) {
+                if (status) status.textContent = res.data.error || 'Preview failed';
+                session = null;
+                return;
+            }
+            session = res.data.session;
+            version = res.data.version;
+            sentLines = lines;
+            show(res.data);
+            if (pending) {
+                pending = false;
+                send(false);
+            }
+        }).catch(function (err) {
+            inFlight = false;
+            session = null;
+            if (status) status.textContent = 'Preview unavailable';
+            console.error('Rule card preview failed', err);
+        });
+    }
+
+    function schedule() {
+        clearTimeout(timer);
+        timer = setTimeout(function () { send(false); }, DEBOUNCE_MS);
+    }
+
+    input.addEventListener('input', schedule);
+    document.querySelectorAll('input[name="format_type"]').forEach(function (radio) {
+        radio.addEventListener('change', function () { send(false); });
+    });
+    if (input.value) send(true);
+})();
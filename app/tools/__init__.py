@@ -2,4 +2,4 @@ from flask import Blueprint
 
 bp = Blueprint('tools', __name__)
 
-from app.tools import routes
+from app.tools import routes, commands
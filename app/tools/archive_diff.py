@@ -0,0 +1,270 @@
+"""Compare two zip or tar archives file by file.
+
+Both archives are unpacked (safely) into a session directory while every member is hashed. Files
+are matched by path below the archive's common top-level folder, so theme-1.2/ and theme-1.3/
+line up. Files with equal hashes are never read again; changed text files get line counts from
+the diff engine, split across the shared process pool for large archives. Full per-file diffs
+are rendered only when requested (see app.tools.routes.diff_archive_file). Old session
+directories are pruned whenever a new compare starts (see prune_sessions).
+"""
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import tarfile
+import time
+import uuid
+import zipfile
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import current_app
+
+from app.tools.diff_engine import get_opcodes
+from app.tools.diff_files import BINARY_SNIFF_BYTES
+from app.tools.process_pool import get_process_pool
+
+ARCHIVE_MAX_MEMBERS = 20000
+ARCHIVE_MAX_TOTAL_BYTES = 512 << 20
+# Changed files larger than this are reported as changed without line counts or a diff
+ARCHIVE_MAX_DIFF_BYTES = 4 << 20
+# Below this many changed files the line counts are computed in-process
+ARCHIVE_POOL_MIN_FILES = 20
+ARCHIVE_CHUNK_FILES = 50
+# Unpacked sessions are deleted after ARCHIVE_SESSION_MAX_AGE seconds, and each user keeps at most
+# ARCHIVE_SESSIONS_PER_USER of them (newest first); both are enforced when a new compare starts
+ARCHIVE_SESSION_MAX_AGE = 24 * 3600
+ARCHIVE_SESSIONS_PER_USER = 10
+_OWNER_FILE = 'owner'
+_COPY_CHUNK = 1 << 20
+
+
+def _sessions_dir() -> str:
+    return os.path.join(current_app.instance_path, 'diff_archive_sessions')
+
+
+def session_dir(session_id: str) -> str:
+    return os.path.join(_sessions_dir(), session_id)
+
+
+def prune_sessions(user_id: int) -> int:
+    """Delete expired sessions, and this user's oldest beyond the per-user cap less one to make room
+    for a new compare; returns how many were deleted."""
+    base = _sessions_dir()
+    try:
+        entries = list(os.scandir(base))
+    except FileNotFoundError:
+        return 0
+    now = time.time()
+    owned = []
+    removed = 0
+    for entry in entries:
+        try:
+            mtime = entry.stat().st_mtime
+        except OSError:
+            continue
+        if now - mtime > ARCHIVE_SESSION_MAX_AGE:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+            continue
+        try:
+            with open(os.path.join(entry.path, _OWNER_FILE), encoding='ascii') as f:
+                owner = f.read().strip()
+        except OSError:
+            continue
+        if owner == str(user_id):
+            owned.append((mtime, entry.path))
+    owned.sort(reverse=True)
+    for _, path in owned[max(ARCHIVE_SESSIONS_PER_USER - 1, 0):]:
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    return removed
+
+
+def _safe_relpath(name: str) -> Optional[str]:
+    """Archive member name as a relative POSIX path, or None if it would escape the target directory."""
+    path = posixpath.normpath(name.replace('\\', '/')).lstrip('/')
+    if not path or path == '.' or path.startswith('../') or path == '..':
+        return None
+    return path
+
+
+def iter_members(path: str):
+    """Yield (name, size, fileobj) for each regular file in a zip or tar archive."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    with zf.open(info) as f:
+                        yield info.filename, info.file_size, f
+        return
+    if tarfile.is_tarfile(path):
+        with tarfile.open(path) as tf:
+            for member in tf:
+                if member.isfile():
+                    f = tf.extractfile(member)
+                    if f is not None:
+                        yield member.name, member.size, f
+        return
+    raise ValueError(f'{os.path.basename(path)} is not a zip or tar archive')
+
+
+def unpack(path: str, target: str) -> Dict[str, Dict[str, Any]]:
+    """Unpack an archive into target; returns {relative path: {size, sha256, binary}} for its files."""
+    manifest: Dict[str, Dict[str, Any]] = {}
+    total = 0
+    for name, size, src in iter_members(path):
+        rel = _safe_relpath(name)
+        if rel is None:
+            continue
+        if len(manifest) >= ARCHIVE_MAX_MEMBERS:
+            raise ValueError(f'Archives with more than {ARCHIVE_MAX_MEMBERS} files are not supported')
+        out_path = os.path.join(target, *rel.split('/'))
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        digest = hashlib.sha256()
+        head = b''
+        with open(out_path, 'wb') as out:
+            # sizes in archive headers can lie, so count what is actually written
+            for chunk in iter(lambda: src.read(_COPY_CHUNK), b''):
+                total += len(chunk)
+                if total > ARCHIVE_MAX_TOTAL_BYTES:
+                    raise ValueError(f'Archive contents exceed {ARCHIVE_MAX_TOTAL_BYTES >> 20} MB')
+                if len(head) < BINARY_SNIFF_BYTES:
+                    head += chunk[:BINARY_SNIFF_BYTES - len(head)]
+                digest.update(chunk)
+                out.write(chunk)
+        manifest[rel] = {'size': os.path.getsize(out_path), 'sha256': digest.hexdigest(), 'binary': b'\0' in head}
+    return manifest
+
+
+def _common_root(paths) -> str:
+    """The single top-level folder all paths share ('' when there is none)."""
+    roots = {p.split('/', 1)[0] for p in paths}
+    if len(roots) == 1 and all('/' in p for p in paths):
+        return roots.pop() + '/'
+    return ''
+
+
+def _read_lines(path: str) -> List[str]:
+    with open(path, encoding='utf-8', errors='replace', newline=None) as f:
+        return f.read().splitlines()
+
+
+def _line_counts(pairs: List[Tuple[str, str]]) -> List[Tuple[int, int]]:
+    """(added, removed) line counts for each (file A, file B) pair; runs in pool workers."""
+    out = []
+    for path_a, path_b in pairs:
+        a, b = _read_lines(path_a), _read_lines(path_b)
+        added = removed = 0
+        for tag, i1, i2, j1, j2 in get_opcodes(a, b):
+            if tag != 'equal':
+                removed += i2 - i1
+                added += j2 - j1
+        out.append((added, removed))
+    return out
+
+
+def _count_changes(pairs: List[Tuple[str, str]]) -> List[Tuple[int, int]]:
+    if len(pairs) < ARCHIVE_POOL_MIN_FILES:
+        return _line_counts(pairs)
+    chunks = [pairs[i:i + ARCHIVE_CHUNK_FILES] for i in range(0, len(pairs), ARCHIVE_CHUNK_FILES)]
+    return [counts for chunk in get_process_pool().map(_line_counts, chunks) for counts in chunk]
+
+
+def compare_archives(path_a: str, path_b: str, name_a: str, name_b: str, user_id: int) -> Dict[str, Any]:
+    """Unpack and compare two archives; returns the saved session dict."""
+    prune_sessions(user_id)
+    session_id = str(uuid.uuid4())
+    root = session_dir(session_id)
+    os.makedirs(root)
+    with open(os.path.join(root, _OWNER_FILE), 'w', encoding='ascii') as f:
+        f.write(str(user_id))
+    try:
+        manifests = [unpack(path_a, os.path.join(root, 'a')), unpack(path_b, os.path.join(root, 'b'))]
+    except (zipfile.BadZipFile, tarfile.TarError, OSError, EOFError) as e:
+        shutil.rmtree(root, ignore_errors=True)
+        raise ValueError(f'Could not read archive: {e}') from e
+    except ValueError:
+        shutil.rmtree(root, ignore_errors=True)
+        raise
+    prefixes = [_common_root(m) for m in manifests]
+    # match by path below each archive's own top-level folder
+    keyed = [{rel[len(prefix):]: rel for rel in m} for m, prefix in zip(manifests, prefixes)]
+
+    files = []
+    same = 0
+    to_count = []
+    for path in sorted(set(keyed[0]) | set(keyed[1])):
+        rel_a, rel_b = keyed[0].get(path), keyed[1].get(path)
+        fa = manifests[0][rel_a] if rel_a else None
+        fb = manifests[1][rel_b] if rel_b else None
+        if fa and fb and fa['sha256'] == fb['sha256']:
+            same += 1
+            continue
+        entry = {'path': path, 'a': rel_a, 'b': rel_b,
+                 'status': 'changed' if fa and fb else ('removed' if fa else 'added'),
+                 'size_a': fa['size'] if fa else None, 'size_b': fb['size'] if fb else None,
+                 'sha_a': fa['sha256'] if fa else None, 'sha_b': fb['sha256'] if fb else None,
+                 'binary': bool((fa and fa['binary']) or (fb and fb['binary'])),
+                 'added_lines': None, 'removed_lines': None}
+        files.append(entry)
+        if entry['status'] == 'changed' and not entry['binary'] \
+                and max(fa['size'], fb['size']) <= ARCHIVE_MAX_DIFF_BYTES:
+            to_count.append(entry)
+
+    counts = _count_changes([(member_path(session_id, 'a', e['a']), member_path(session_id, 'b', e['b']))
+                             for e in to_count])
+    for entry, (added, removed) in zip(to_count, counts):
+        entry['added_lines'], entry['removed_lines'] = added, removed
+
+    session = {
+        'id': session_id,
+        'user_id': user_id,
+        'created_at': datetime.utcnow().isoformat(),
+        'names': [name_a, name_b],
+        'roots': prefixes,
+        'counts': {
+            'same': same,
+            'changed': sum(1 for f in files if f['status'] == 'changed'),
+            'added': sum(1 for f in files if f['status'] == 'added'),
+            'removed': sum(1 for f in files if f['status'] == 'removed'),
+        },
+        'files': files,
+    }
+    with open(os.path.join(root, 'session.json'), 'w', encoding='utf-8') as f:
+        json.dump(session, f)
+    return session
+
+
+def load_session(session_id: str) -> Dict[str, Any]:
+    path = os.path.join(session_dir(os.path.basename(session_id)), 'session.json')
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def member_path(session_id: str, side: str, rel: str) -> str:
+    return os.path.join(session_dir(session_id), side, *rel.split('/'))
+
+
+def read_member(session_id: str, side: str, rel: Optional[str]) -> str:
+    if not rel:
+        return ''
+    with open(member_path(session_id, side, rel), encoding='utf-8', errors='replace', newline=None) as f:
+        return f.read()
+
+
+def build_tree(files: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Nest the file entries by directory: {'dirs': {name: subtree}, 'files': [...], 'counts': {...}}."""
+    tree = {'dirs': {}, 'files': [], 'counts': {'changed': 0, 'added': 0, 'removed': 0}}
+    for entry in files:
+        node = tree
+        node['counts'][entry['status']] += 1
+        for part in entry['path'].split('/')[:-1]:
+            node = node['dirs'].setdefault(part, {'dirs': {}, 'files': [],
+                                                  'counts': {'changed': 0, 'added': 0, 'removed': 0}})
+            node['counts'][entry['status']] += 1
+        node['files'].append(entry)
+    return tree
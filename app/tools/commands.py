@@ -0,0 +1,32 @@
+import sys
+
+import click
+
+from app.tools import bp
+from app.tools.rulecard_bulk import FORMATS, BulkStats, format_cards, iter_ndjson, iter_path_cards, write_zip
+
+
+@bp.cli.command('format-rulecards')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('-f', '--format', 'fmt', default='hierarchical', show_default=True,
+              type=click.Choice(FORMATS))
+@click.option('-o', '--output', default='-', show_default=True,
+              help='A .zip gets one output file per card; anything else (or - for stdout) gets NDJSON.')
+@click.option('-j', '--workers', type=int, default=None, help='Worker processes (default: the shared pool, one per CPU up to 8).')
+def format_rulecards(paths, fmt, output, workers):
+    """Format rule card files, directories of them, or zip/tar archives of them, one card per file."""
+    stats = BulkStats()
+    results = format_cards(iter_path_cards(paths), fmt, workers)
+    if output.lower().endswith('.zip'):
+        with open(output, 'wb') as f:
+            write_zip(results, f, fmt, stats)
+    else:
+        out = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8')
+        try:
+            for line in iter_ndjson(results, fmt, stats):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    click.echo(f'{stats.cards} cards ({stats.errors} failed) in {stats.seconds:.2f}s, '
+               f'{stats.cards_per_second:.0f} cards/s', err=True)
@@ -0,0 +1,48 @@
+"""Many text pairs diffed in one call, for the batch JSON API (/tools/diff/api/batch)."""
+from typing import Any, Dict, List
+
+from app.tools.diff_engine import structured_diff
+from app.tools.process_pool import POOL_MAX_WORKERS, get_process_pool
+
+BATCH_MAX_PAIRS = 500
+BATCH_MAX_BYTES = 32 << 20
+# Smaller batches are diffed in-process: starting worker processes costs more than it saves
+BATCH_POOL_MIN_PAIRS = 8
+BATCH_POOL_MIN_BYTES = 256 << 10
+
+
+def _diff_pairs(pairs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [structured_diff(p['a'], p['b'], p['context']) for p in pairs]
+
+
+def run_batch(pairs: List[Dict[str, Any]], context: int = 3) -> List[Dict[str, Any]]:
+    """structured_diff() for each {'a', 'b'} pair, in input order; large batches use the shared process pool."""
+    jobs = [{'a': p['a'], 'b': p['b'], 'context': context} for p in pairs]
+    size = sum(len(p['a']) + len(p['b']) for p in jobs)
+    if len(jobs) < BATCH_POOL_MIN_PAIRS or size < BATCH_POOL_MIN_BYTES:
+        return _diff_pairs(jobs)
+    workers = min(len(jobs), POOL_MAX_WORKERS)
+    # a few chunks per worker keeps the load even when pair sizes differ a lot
+    step = max(1, len(jobs) // (workers * 4))
+    chunks = [jobs[i:i + step] for i in range(0, len(jobs), step)]
+    return [result for chunk in get_process_pool().map(_diff_pairs, chunks) for result in chunk]
+
+
+def validate_batch(data: Any) -> List[Dict[str, Any]]:
+    """The request's pairs with names filled in; raises ValueError describing the first problem."""
+    if not isinstance(data, dict) or not isinstance(data.get('pairs'), list):
+        raise ValueError("Body must be a JSON object with a 'pairs' list")
+    pairs = data['pairs']
+    if len(pairs) > BATCH_MAX_PAIRS:
+        raise ValueError(f'At most {BATCH_MAX_PAIRS} pairs per request')
+    out = []
+    total = 0
+    for i, p in enumerate(pairs):
+        if not isinstance(p, dict) or not isinstance(p.get('a'), str) or not isinstance(p.get('b'), str):
+            raise ValueError(f"pairs[{i}] must have string fields 'a' and 'b'")
+        total += len(p['a']) + len(p['b'])
+        if total > BATCH_MAX_BYTES:
+            raise ValueError(f'Batch texts exceed {BATCH_MAX_BYTES >> 20} MB')
+        out.append({'id': p.get('id', i), 'a': p['a'], 'b': p['b'],
+                    'name_a': str(p.get('name_a') or 'Text 1'), 'name_b': str(p.get('name_b') or 'Text 2')})
+    return out
@@ -0,0 +1,424 @@
+import difflib
+import re
+from bisect import bisect_left
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Pluggable line diff engines.
+# An engine takes two sequences of hashable lines and returns difflib-style opcodes
+# [(tag, i1, i2, j1, j2), ...]; everything downstream (hunks, unified output, HTML) is engine-agnostic.
+
+Opcode = Tuple[str, int, int, int, int]
+
+# Inputs with more lines than this (both sides together) use the patience engine
+AUTO_ENGINE_THRESHOLD = 5000
+# Edit distance at which the Myers fallback gives up and reports a region as replaced
+MYERS_MAX_D = 1000
+# Upper bound on the steps (diagonals visited plus snake moves) spent in one Myers fallback
+MYERS_BUDGET = 5_000_000
+
+
+# Tokens for intra-line diffs: words, runs of whitespace, single punctuation characters
+_WORD_RE = re.compile(r'\w+|\s+|[^\w\s]')
+
+
+def intern_lines(a: Sequence[str], b: Sequence[str]) -> Tuple[List[int], List[int]]:
+    """Map each distinct line to a small int so the engines compare and hash ints, not strings."""
+    table: Dict[str, int] = {}
+    ia = [table.setdefault(ln, len(table)) for ln in a]
+    ib = [table.setdefault(ln, len(table)) for ln in b]
+    return ia, ib
+
+
+def difflib_opcodes(a: Sequence, b: Sequence) -> List[Opcode]:
+    return difflib.SequenceMatcher(None, a, b).get_opcodes()
+
+
+def _myers_matches(a, b, alo, ahi, blo, bhi, max_d: int = MYERS_MAX_D,
+                   budget: int = MYERS_BUDGET) -> Optional[List[Tuple[int, int]]]:
+    """Matched (i, j) line pairs of a shortest edit script, or None when it needs more than max_d
+    edits or more than `budget` steps.
+
+    Greedy forward Myers O(ND); each step keeps only the diagonals it touched, so the trace is O(D^2).
+    """
+    n, m = ahi - alo, bhi - blo
+    v = {1: 0}
+    trace = []
+    work = 0
+    for d in range(min(n + m, max_d) + 1):
+        vd = {}
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v.get(k - 1, -1) < v.get(k + 1, -1)):
+                x = v.get(k + 1, 0)
+            else:
+                x = v.get(k - 1, 0) + 1
+            y = x - k
+            x0 = x
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            work += 1 + x - x0
+            vd[k] = x
+            if x >= n and y >= m:
+                trace.append(vd)
+                return _myers_backtrack(trace, n, m, alo, blo)
+        trace.append(vd)
+        v = vd
+        if work > budget:
+            return None
+    return None
+
+
+def _myers_backtrack(trace, n, m, alo, blo) -> List[Tuple[int, int]]:
+    matches = []
+    x, y = n, m
+    for d in range(len(trace) - 1, 0, -1):
+        prev = trace[d - 1]
+        k = x - y
+        if k == -d or (k != d and prev.get(k - 1, -1) < prev.get(k + 1, -1)):
+            prev_k = k + 1
+            mid_x = prev[prev_k]
+        else:
+            prev_k = k - 1
+            mid_x = prev[prev_k] + 1
+        mid_y = mid_x - k
+        while x > mid_x and y > mid_y:
+            x -= 1
+            y -= 1
+            matches.append((alo + x, blo + y))
+        x = prev[prev_k]
+        y = x - prev_k
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        matches.append((alo + x, blo + y))
+    matches.reverse()
+    return matches
+
+
+def _unique_anchors(a, b, alo, ahi, blo, bhi) -> List[Tuple[int, int]]:
+    """Lines occurring exactly once on each side, as (i, j) pairs forming the longest increasing run in j."""
+    pos_a: Dict[int, int] = {}  # line -> index, or -1 when repeated
+    for i in range(alo, ahi):
+        pos_a[a[i]] = -1 if a[i] in pos_a else i
+    pos_b: Dict[int, int] = {}
+    for j in range(blo, bhi):
+        if pos_a.get(b[j], -1) >= 0:
+            pos_b[b[j]] = -1 if b[j] in pos_b else j
+    pairs = sorted((pos_a[line], j) for line, j in pos_b.items() if j >= 0)
+    # longest increasing subsequence on j (patience sorting)
+    tails: List[int] = []
+    tail_idx: List[int] = []
+    back: List[int] = [-1] * len(pairs)
+    for idx, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(idx)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = idx
+        back[idx] = tail_idx[pos - 1] if pos else -1
+    out = []
+    idx = tail_idx[-1] if tail_idx else -1
+    while idx >= 0:
+        out.append(pairs[idx])
+        idx = back[idx]
+    out.reverse()
+    return out
+
+
+def patience_matches(a: Sequence[int], b: Sequence[int], max_d: int = MYERS_MAX_D) -> List[Tuple[int, int]]:
+    """Matched (i, j) line pairs using patience diff, falling back to bounded Myers where no unique lines exist.
+
+    Common prefixes/suffixes are peeled off each region, unique lines shared by both sides anchor
+    the alignment, and the gaps between anchors are processed the same way. Uses an explicit work
+    list rather than recursion so large inputs cannot hit the recursion limit.
+    """
+    matches: List[Tuple[int, int]] = []
+    regions = [(0, len(a), 0, len(b))]
+    while regions:
+        alo, ahi, blo, bhi = regions.pop()
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+        anchors = _unique_anchors(a, b, alo, ahi, blo, bhi)
+        if not anchors:
+            matches.extend(_myers_matches(a, b, alo, ahi, blo, bhi, max_d) or [])
+            continue
+        i0, j0 = alo, blo
+        for i, j in anchors:
+            regions.append((i0, i, j0, j))
+            matches.append((i, j))
+            i0, j0 = i + 1, j + 1
+        regions.append((i0, ahi, j0, bhi))
+    matches.sort()
+    return matches
+
+
+def matches_to_opcodes(matches: List[Tuple[int, int]], n: int, m: int) -> List[Opcode]:
+    codes: List[Opcode] = []
+    i = j = 0
+
+    def gap(i2, j2):
+        if i < i2 and j < j2:
+            codes.append(('replace', i, i2, j, j2))
+        elif i < i2:
+            codes.append(('delete', i, i2, j, j2))
+        elif j < j2:
+            codes.append(('insert', i, i2, j, j2))
+
+    for mi, mj in matches + [(n, m)]:
+        if mi != i or mj != j:
+            gap(mi, mj)
+            i, j = mi, mj
+        if mi == n and mj == m:
+            break
+        if codes and codes[-1][0] == 'equal' and codes[-1][2] == mi:
+            tag, i1, _, j1, _ = codes[-1]
+            codes[-1] = (tag, i1, mi + 1, j1, mj + 1)
+        else:
+            codes.append(('equal', mi, mi + 1, mj, mj + 1))
+        i, j = mi + 1, mj + 1
+    return codes
+
+
+def patience_opcodes(a: Sequence, b: Sequence) -> List[Opcode]:
+    ia, ib = intern_lines(a, b)
+    return matches_to_opcodes(patience_matches(ia, ib), len(a), len(b))
+
+
+ENGINES: Dict[str, Callable[[Sequence, Sequence], List[Opcode]]] = {
+    'difflib': difflib_opcodes,
+    'patience': patience_opcodes,
+}
+
+
+def register_engine(name: str, fn: Callable[[Sequence, Sequence], List[Opcode]]) -> None:
+    ENGINES[name] = fn
+
+
+def choose_engine(a: Sequence, b: Sequence) -> str:
+    """difflib gives the most familiar output on small inputs; patience stays near-linear on large ones."""
+    return 'difflib' if len(a) + len(b) <= AUTO_ENGINE_THRESHOLD else 'patience'
+
+
+def common_affixes(a: Sequence, b: Sequence) -> Tuple[int, int]:
+    """Lengths of the common prefix and (non-overlapping) common suffix of two sequences."""
+    n = min(len(a), len(b))
+    prefix = 0
+    while prefix < n and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and a[len(a) - 1 - suffix] == b[len(b) - 1 - suffix]:
+        suffix += 1
+    return prefix, suffix
+
+
+def get_opcodes(a: Sequence, b: Sequence, engine: Optional[str] = None) -> List[Opcode]:
+    """Opcodes from the chosen engine, which only sees the part between the common prefix and suffix."""
+    prefix, suffix = common_affixes(a, b)
+    if not prefix and not suffix:
+        return ENGINES[engine or choose_engine(a, b)](a, b)
+    ma, mb = a[prefix:len(a) - suffix], b[prefix:len(b) - suffix]
+    codes: List[Opcode] = [('equal', 0, prefix, 0, prefix)] if prefix else []
+    if ma or mb:
+        middle = ENGINES[engine or choose_engine(ma, mb)](ma, mb) if ma and mb else \
+            [('delete' if ma else 'insert', 0, len(ma), 0, len(mb))]
+        codes.extend((tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix) for tag, i1, i2, j1, j2 in middle)
+    if suffix:
+        codes.append(('equal', len(a) - suffix, len(a), len(b) - suffix, len(b)))
+    return codes
+
+
+def group_opcodes(codes: List[Opcode], n: int = 3) -> Iterator[List[Opcode]]:
+    """Group opcodes into hunks with n lines of context (same rules as SequenceMatcher.get_grouped_opcodes)."""
+    codes = list(codes) or [('equal', 0, 1, 0, 1)]
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+    nn = n + n
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > nn:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def _format_range(start: int, stop: int) -> str:
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return f'{beginning},{length}'
+
+
+def unified_diff(a: Sequence[str], b: Sequence[str], fromfile: str = '', tofile: str = '',
+                 n: int = 3, engine: Optional[str] = None) -> Iterator[str]:
+    """Drop-in for difflib.unified_diff(..., lineterm='') with a selectable engine."""
+    started = False
+    for group in group_opcodes(get_opcodes(a, b, engine), n):
+        if not started:
+            started = True
+            yield f'--- {fromfile}'
+            yield f'+++ {tofile}'
+        first, last = group[0], group[-1]
+        yield f'@@ -{_format_range(first[1], last[2])} +{_format_range(first[3], last[4])} @@'
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in a[i1:i2]:
+                    yield ' ' + line
+                continue
+            if tag in ('replace', 'delete'):
+                for line in a[i1:i2]:
+                    yield '-' + line
+            if tag in ('replace', 'insert'):
+                for line in b[j1:j2]:
+                    yield '+' + line
+
+
+def word_opcodes(a: str, b: str) -> Tuple[List[str], List[str], List[Opcode]]:
+    """Token-level opcodes for one changed line pair, as (a_tokens, b_tokens, opcodes)."""
+    ta = _WORD_RE.findall(a)
+    tb = _WORD_RE.findall(b)
+    return ta, tb, difflib.SequenceMatcher(None, ta, tb, autojunk=False).get_opcodes()
+
+
+class DiffRows:
+    """Row-addressable view of a unified diff, so any window of output rows can be produced on its own.
+
+    Row r is one line of unified output: the two file headers, then per hunk a range header and its
+    lines. Only the grouped opcodes and each hunk's first row are kept, so a window costs
+    O(log hunks + window) regardless of how large the diff is.
+
+    rows() yields (row, kind, from_ln, to_ln, text, pair) where kind is one of 'header', 'range',
+    'context', 'remove', 'add'; line numbers are 1-based ('' when the line is absent on that side)
+    and pair is (pair_id, other_text) for a removed/added line replaced by a line on the other side.
+
+    `groups` takes the .groups of an earlier DiffRows of the same a and b (and n), skipping the diff.
+    """
+
+    def __init__(self, a: Sequence[str], b: Sequence[str], fromfile: str = '', tofile: str = '',
+                 n: int = 3, engine: Optional[str] = None, offset_a: int = 0, offset_b: int = 0,
+                 groups: Optional[List] = None):
+        self.a, self.b = a, b
+        self.fromfile, self.tofile = fromfile, tofile
+        # a and b may be slices of larger files starting at these line indexes (see diff_files.trimmed_diff_rows)
+        self.offset_a, self.offset_b = offset_a, offset_b
+        self.groups = groups if groups is not None else list(group_opcodes(get_opcodes(a, b, engine), n))
+        self.starts: List[int] = []
+        row = 2 if self.groups else 0
+        for group in self.groups:
+            self.starts.append(row)
+            row += 1 + sum(_opcode_rows(code) for code in group)
+        self.total = row
+
+    def __len__(self) -> int:
+        return self.total
+
+    def rows(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple]:
+        stop = self.total if stop is None else min(stop, self.total)
+        if start < 2 and start < stop:
+            if start == 0:
+                yield 0, 'header', '', '', f'--- {self.fromfile}', None
+            if stop > 1:
+                yield 1, 'header', '', '', f'+++ {self.tofile}', None
+        gi = max(bisect_left(self.starts, start + 1) - 1, 0)
+        while gi < len(self.groups) and self.starts[gi] < stop:
+            yield from self._group_rows(gi, start, stop)
+            gi += 1
+
+    def hunks(self) -> Iterator[List[Tuple]]:
+        """Rows grouped per hunk; the file headers come with the first hunk."""
+        for gi, first in enumerate(self.starts):
+            end = self.starts[gi + 1] if gi + 1 < len(self.starts) else self.total
+            yield list(self.rows(0 if gi == 0 else first, end))
+
+    def _group_rows(self, gi: int, start: int, stop: int) -> Iterator[Tuple]:
+        group = self.groups[gi]
+        row = self.starts[gi]
+        if start <= row < stop:
+            first, last = group[0], group[-1]
+            oa, ob = self.offset_a, self.offset_b
+            yield (row, 'range', '', '',
+                   f'@@ -{_format_range(first[1] + oa, last[2] + oa)} +{_format_range(first[3] + ob, last[4] + ob)} @@',
+                   None)
+        row += 1
+        a, b = self.a, self.b
+        oa, ob = self.offset_a + 1, self.offset_b + 1
+        for code in group:
+            count = _opcode_rows(code)
+            if row + count <= start:
+                row += count
+                continue
+            if row >= stop:
+                return
+            tag, i1, i2, j1, j2 = code
+            lo, hi = max(start - row, 0), min(stop - row, count)
+            if tag == 'equal':
+                for k in range(lo, hi):
+                    yield row + k, 'context', i1 + k + oa, j1 + k + ob, a[i1 + k], None
+            else:
+                removed = i2 - i1
+                for k in range(lo, hi):
+                    if k < removed:
+                        pair = (row + k, b[j1 + k]) if k < j2 - j1 else None
+                        yield row + k, 'remove', i1 + k + oa, '', a[i1 + k], pair
+                    else:
+                        m = k - removed
+                        pair = (row + m, a[i1 + m]) if m < removed else None
+                        yield row + k, 'add', '', j1 + m + ob, b[j1 + m], pair
+            row += count
+
+
+def _opcode_rows(code: Opcode) -> int:
+    tag, i1, i2, j1, j2 = code
+    return i2 - i1 if tag == 'equal' else (i2 - i1) + (j2 - j1)
+
+
+def structured_diff(a: str, b: str, n: int = 3, engine: Optional[str] = None) -> Dict:
+    """JSON-ready diff of two texts: line counts plus hunks with their ranges and lines.
+
+    Ranges are 1-based starts and line counts as in unified diff headers; each line is
+    {'op': ' ' | '-' | '+', 'text': ...}.
+    """
+    la, lb = a.splitlines(), b.splitlines()
+    codes = get_opcodes(la, lb, engine)
+    added = removed = 0
+    for tag, i1, i2, j1, j2 in codes:
+        if tag != 'equal':
+            removed += i2 - i1
+            added += j2 - j1
+    hunks = []
+    for group in group_opcodes(codes, n):
+        first, last = group[0], group[-1]
+        lines = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                lines.extend({'op': ' ', 'text': line} for line in la[i1:i2])
+                continue
+            lines.extend({'op': '-', 'text': line} for line in la[i1:i2])
+            lines.extend({'op': '+', 'text': line} for line in lb[j1:j2])
+        a_count, b_count = last[2] - first[1], last[4] - first[3]
+        hunks.append({
+            'a_start': first[1] + 1 if a_count else first[1], 'a_count': a_count,
+            'b_start': first[3] + 1 if b_count else first[3], 'b_count': b_count,
+            'lines': lines,
+        })
+    return {'identical': not hunks, 'added': added, 'removed': removed, 'hunks': hunks}
@@ -0,0 +1,122 @@
+"""Uploaded files for the Diff Checker.
+
+Uploads are copied to disk in chunks (hashing and sniffing them on the way) instead of being held
+in memory. Before diffing, every line is reduced to its hash; the common prefix and suffix are
+found on the hashes and only the differing middle, plus context, is read back as text.
+"""
+import hashlib
+import os
+import uuid
+from itertools import islice
+from typing import List
+
+from flask import current_app
+
+from app.tools.diff_engine import DiffRows, common_affixes
+
+SPOOL_CHUNK = 1 << 20
+# Like git: a NUL byte in the first 8000 bytes marks the file as binary
+BINARY_SNIFF_BYTES = 8000
+MAX_UPLOAD_BYTES = 64 << 20
+# Every character str.splitlines() ends a line at
+LINE_BREAKS = '\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029'
+
+
+class SpooledFile:
+    """One side of a comparison, stored under instance/diff_uploads until remove() is called."""
+
+    def __init__(self, path: str, name: str, size: int, sha256: str, binary: bool):
+        self.path = path
+        self.name = name
+        self.size = size
+        self.sha256 = sha256
+        self.binary = binary
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _spool_dir() -> str:
+    path = os.path.join(current_app.instance_path, 'diff_uploads')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _spool(chunks, name: str) -> SpooledFile:
+    path = os.path.join(_spool_dir(), uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    try:
+        with open(path, 'wb') as out:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise ValueError(f'{name} is larger than {MAX_UPLOAD_BYTES // (1 << 20)} MB')
+                if len(head) < BINARY_SNIFF_BYTES:
+                    head += chunk[:BINARY_SNIFF_BYTES - len(head)]
+                digest.update(chunk)
+                out.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return SpooledFile(path, name, size, digest.hexdigest(), b'\0' in head)
+
+
+def spool_upload(storage, name: str = None) -> SpooledFile:
+    """Copy an uploaded werkzeug FileStorage to disk."""
+    stream = storage.stream
+    return _spool(iter(lambda: stream.read(SPOOL_CHUNK), b''), name or storage.filename or 'upload')
+
+
+def spool_text(text: str, name: str) -> SpooledFile:
+    """Store pasted text the same way as an upload, so both sides go through one code path."""
+    data = text.encode('utf-8')
+    return _spool((data[i:i + SPOOL_CHUNK] for i in range(0, len(data), SPOOL_CHUNK)), name)
+
+
+def _iter_lines(path: str):
+    """Yield the file's lines with their line break, split exactly like str.splitlines(keepends=True)
+    on the decoded text, so row numbers match diffs of the stored contents.
+
+    Universal newlines turn CRLF and CR into LF first, so every line ends in a single break character.
+    """
+    with open(path, encoding='utf-8', errors='replace', newline=None) as f:
+        rest = ''
+        for chunk in iter(lambda: f.read(SPOOL_CHUNK), ''):
+            lines = (rest + chunk).splitlines(keepends=True)
+            rest = lines.pop() if lines[-1][-1] not in LINE_BREAKS else ''
+            yield from lines
+        if rest:
+            yield rest
+
+
+def line_hashes(path: str) -> List[int]:
+    """hash() of every line, line break included; only compared within this process, so str hashing is enough.
+
+    A last line without its line break hashes differently from the same line with one, which at worst
+    leaves that line to the diff engine.
+    """
+    return [hash(line) for line in _iter_lines(path)]
+
+
+def read_lines(path: str, start: int, stop: int) -> List[str]:
+    return [line[:-1] if line[-1] in LINE_BREAKS else line for line in islice(_iter_lines(path), start, stop)]
+
+
+def trimmed_diff_rows(fa: SpooledFile, fb: SpooledFile, n: int = 3) -> DiffRows:
+    """The diff of two spooled text files, loading only the lines between their common prefix and suffix.
+
+    n lines of the prefix/suffix are kept as hunk context; the row output is the same as diffing
+    the whole files.
+    """
+    ha, hb = line_hashes(fa.path), line_hashes(fb.path)
+    prefix, suffix = common_affixes(ha, hb)
+    lo = max(prefix - n, 0)
+    skip = max(suffix - n, 0)
+    a = read_lines(fa.path, lo, len(ha) - skip)
+    b = read_lines(fb.path, lo, len(hb) - skip)
+    return DiffRows(a, b, fa.name, fb.name, n=n, offset_a=lo, offset_b=lo)
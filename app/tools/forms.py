@@ -1,20 +1,39 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired
 from wtforms import TextAreaField, StringField, SubmitField, RadioField
-from wtforms.validators import DataRequired
+from wtforms.validators import DataRequired, ValidationError
 
 class DiffForm(FlaskForm):
     text1_name = StringField('Text 1 Name', default='Text 1')
-    text1 = TextAreaField('Text 1', validators=[DataRequired()])
+    text1 = TextAreaField('Text 1')
+    file1 = FileField('Or upload a file')
     text2_name = StringField('Text 2 Name', default='Text 2')
-    text2 = TextAreaField('Text 2', validators=[DataRequired()])
+    text2 = TextAreaField('Text 2')
+    file2 = FileField('Or upload a file')
     submit = SubmitField('Compare')
 
+    def validate_text1(self, field):
+        if not field.data and not self.file1.data:
+            raise ValidationError('Enter text or upload a file.')
+
+    def validate_text2(self, field):
+        if not field.data and not self.file2.data:
+            raise ValidationError('Enter text or upload a file.')
+
+class ArchiveDiffForm(FlaskForm):
+    archive_a = FileField('Archive A (.zip, .tar, .tar.gz)', validators=[FileRequired()])
+    archive_b = FileField('Archive B (.zip, .tar, .tar.gz)', validators=[FileRequired()])
+    submit = SubmitField('Compare archives')
+
 class RuleCardForm(FlaskForm):
     input_text = TextAreaField('Rule card text', validators=[DataRequired()])
     format_type = RadioField('Format', choices=[
         ('bulleted', 'Bulleted format'),
         ('hierarchical', 'Hierarchical format'),
-        ('jira_html', 'Jira HTML (IDs bold)')
+        ('jira_html', 'Jira HTML (IDs bold)'),
+        ('markdown', 'Markdown'),
+        ('json', 'JSON'),
+        ('all', 'All formats')
     ], default='bulleted')
     submit = SubmitField('Format')
 
@@ -24,4 +43,17 @@ class MongoCompareForm(FlaskForm):
     db_name = StringField('Database name', validators=[DataRequired()])
     collections = StringField('Collections (comma-separated or leave empty for all)')
     doc_limit = StringField('Document limit per collection', default='1000')
+    partitions = StringField('Parallel _id partitions for large collections (limit 0 only)', default='1')
+    mode = RadioField('Mode', choices=[
+        ('full', 'Exhaustive compare'),
+        ('sample', 'Sampling estimate')
+    ], default='full')
+    sample_size = StringField('Sample size per collection', default='1000')
+    base_session = StringField('Incremental: previous session id (optional)')
+    watermark_field = StringField('Watermark field', default='_id')
+    full_every_hours = StringField('Full reconciliation every (hours)', default='24')
+    query_filter = TextAreaField('Filter for all collections (Mongo extended JSON)')
+    collection_filters = TextAreaField('Per-collection filters (JSON object keyed by collection)')
+    include_fields = StringField('Only compare fields (comma-separated)')
+    exclude_fields = StringField('Ignore fields (comma-separated)')
     submit = SubmitField('Compare')
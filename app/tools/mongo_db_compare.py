@@ -1,31 +1,158 @@
 import json
+import lzma
+import math
 import os
-from typing import List, Dict, Any
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from statistics import NormalDist
+from typing import List, Dict, Any, Tuple, Optional, Iterable, Iterator
 from flask import current_app
 
+from app.tools.process_pool import get_process_pool
+
 try:
-    from pymongo import MongoClient
+    from pymongo import MongoClient, InsertOne, ReplaceOne, UpdateOne, DeleteOne
+    from pymongo.errors import BulkWriteError
+    import bson
     from bson import ObjectId
-    from bson.json_util import dumps as bson_dumps
+    from bson.json_util import CANONICAL_JSON_OPTIONS, dumps as bson_dumps, loads as bson_loads
 except Exception:
     MongoClient = None  # handled in callers
 
+try:
+    from deepdiff import DeepDiff
+except Exception:
+    DeepDiff = None  # fall back to a top-level field comparison
+
+# Bounds for the field-level diffs stored for modified documents
+DIFF_MAX_DEPTH = 6
+DIFF_MAX_CHANGES = 100
+DIFF_MAX_VALUE_BYTES = 2048
+MODIFIED_SAMPLE_SIZE = 50
+
+# Parallel _id range partitioning of large collections
+PARTITION_MIN_DOCS = 100000
+PARTITION_SAMPLES = 100
+
+# Default number of operations per bulk_write batch in generated sync plans
+PLAN_BATCH_SIZE = 500
+
+# Marker for a field that is absent on one side of a diff
+_MISSING = object()
+
+# Binary session file layout: magic, 4-byte codec name, 4-byte header length, compressed BSON header,
+# then one compressed BSON section per collection
+_SESSION_MAGIC = b'MCS1'
+_SECTION_KEYS = ('added', 'removed', 'modified', 'added_ids', 'removed_ids', 'modified_ids')
+_CODECS = {
+    'zlib': (lambda b: zlib.compress(b, 6), zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+SESSION_CODEC = 'zlib'
+
+# Source URIs per compare session, kept in process memory only so credentials never reach disk.
+# Entries expire after SOURCES_TTL_SECONDS and at most SOURCES_MAX are kept (oldest dropped first);
+# document fetches and sync plans for a session need its entry.
+SOURCES_TTL_SECONDS = 3600
+SOURCES_MAX = 200
+_SESSION_SOURCES: 'OrderedDict[str, Tuple[float, str, str]]' = OrderedDict()
+_SOURCES_LOCK = threading.Lock()
 
-def save_session(session_id: str, session: Dict[str, Any]) -> str:
-    path = os.path.join(current_app.instance_path, 'mongo_compare_sessions')
-    os.makedirs(path, exist_ok=True)
-    fn = os.path.join(path, f'{session_id}.json')
-    with open(fn, 'w', encoding='utf-8') as f:
-        json.dump(session, f, default=str, indent=2)
+
+def _session_path(session_id: str, ext: str) -> str:
+    return os.path.join(current_app.instance_path, 'mongo_compare_sessions', f'{session_id}.{ext}')
+
+
+def save_session(session_id: str, session: Dict[str, Any], codec: str = SESSION_CODEC) -> str:
+    """Write a session as a binary file: a compressed BSON header followed by one compressed
+    BSON section per collection.
+
+    The header carries the session fields, per-collection summaries (everything except the
+    document lists) and an index of (offset, length) per section, so a single collection can
+    be read without decoding the others. BSON keeps ObjectId, datetime and other types intact.
+    """
+    compress = _CODECS[codec][0]
+    sections = []
+    index = {}
+    summaries = {}
+    offset = 0
+    for coll, info in session.get('collections', {}).items():
+        blob = compress(bson.encode(info))
+        index[coll] = [offset, len(blob)]
+        offset += len(blob)
+        sections.append(blob)
+        summaries[coll] = {k: v for k, v in info.items() if k not in _SECTION_KEYS}
+    header_session = dict(session, collections=summaries)
+    header = compress(bson.encode({'session': header_session, 'index': index}))
+
+    fn = _session_path(session_id, 'mcs')
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp = fn + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_SESSION_MAGIC)
+        f.write(codec.encode('ascii'))
+        f.write(struct.pack('>I', len(header)))
+        f.write(header)
+        for blob in sections:
+            f.write(blob)
+    os.replace(tmp, fn)
     return fn
 
 
-def load_session(session_id: str) -> Dict[str, Any]:
-    fn = os.path.join(current_app.instance_path, 'mongo_compare_sessions', f'{session_id}.json')
-    with open(fn, 'r', encoding='utf-8') as f:
+def _read_header(f):
+    """Return (header, decompress, data_start) for an open session file."""
+    if f.read(len(_SESSION_MAGIC)) != _SESSION_MAGIC:
+        raise ValueError('Not a Mongo compare session file')
+    decompress = _CODECS[f.read(4).decode('ascii')][1]
+    (length,) = struct.unpack('>I', f.read(4))
+    header = bson.decode(decompress(f.read(length)))
+    return header, decompress, len(_SESSION_MAGIC) + 8 + length
+
+
+def _load_legacy_session(session_id: str) -> Dict[str, Any]:
+    with open(_session_path(session_id, 'json'), 'r', encoding='utf-8') as f:
         return json.load(f)
 
 
+def load_session(session_id: str, summary_only: bool = False) -> Dict[str, Any]:
+    """Load a session. With summary_only, collections hold only their counts and estimates
+    and no section is decoded."""
+    fn = _session_path(session_id, 'mcs')
+    if not os.path.exists(fn):
+        return _load_legacy_session(session_id)
+    with open(fn, 'rb') as f:
+        header, decompress, data_start = _read_header(f)
+        session = header['session']
+        if summary_only:
+            return session
+        for coll, (offset, length) in header['index'].items():
+            f.seek(data_start + offset)
+            session['collections'][coll] = bson.decode(decompress(f.read(length)))
+    return session
+
+
+def load_collection(session_id: str, coll: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Return (session summary, full collection entry) decoding only that collection's section.
+
+    Raises KeyError when the collection is not part of the session.
+    """
+    fn = _session_path(session_id, 'mcs')
+    if not os.path.exists(fn):
+        session = _load_legacy_session(session_id)
+        return session, session['collections'][coll]
+    with open(fn, 'rb') as f:
+        header, decompress, data_start = _read_header(f)
+        offset, length = header['index'][coll]
+        f.seek(data_start + offset)
+        info = bson.decode(decompress(f.read(length)))
+    return header['session'], info
+
+
 def connect(uri: str, timeout_ms: int = 5000):
     if MongoClient is None:
         raise RuntimeError('pymongo is not installed')
@@ -45,9 +172,147 @@ def list_collections(client, db_name: str) -> List[str]:
     return sorted(db.list_collection_names())
 
 
-def _load_docs_indexed(client, db_name: str, coll: str, limit: int = 1000) -> Dict[str, Any]:
+def _expire_sources(now: float) -> None:
+    # entries are in insertion order, so the expired ones are at the front
+    while _SESSION_SOURCES:
+        session_id, (stored, _, _) = next(iter(_SESSION_SOURCES.items()))
+        if now - stored < SOURCES_TTL_SECONDS and len(_SESSION_SOURCES) <= SOURCES_MAX:
+            break
+        del _SESSION_SOURCES[session_id]
+
+
+def remember_sources(session_id: str, uri_a: str, uri_b: str) -> None:
+    now = time.monotonic()
+    with _SOURCES_LOCK:
+        _SESSION_SOURCES.pop(session_id, None)
+        _SESSION_SOURCES[session_id] = (now, uri_a, uri_b)
+        _expire_sources(now)
+
+
+def fetch_documents(session_id: str, session: Dict[str, Any], coll: str, id_ext: str) -> Dict[str, Any]:
+    """Fetch the full A and B documents for one modified entry of a session.
+
+    Raises KeyError when the session's sources are no longer known to this process.
+    """
+    uri_a, uri_b = get_sources(session_id)
+    doc_id = bson_loads(id_ext)
+    with connect(uri_a) as client_a, connect(uri_b) as client_b:
+        da = client_a[session['db_a']][coll].find_one({'_id': doc_id})
+        dbb = client_b[session['db_b']][coll].find_one({'_id': doc_id})
+    return {'a': json.loads(bson_dumps(da)), 'b': json.loads(bson_dumps(dbb))}
+
+
+def _format_path(parts) -> str:
+    out = ''
+    for p in parts:
+        if isinstance(p, int):
+            out += f'[{p}]'
+        else:
+            out += ('.' if out else '') + str(p)
+    return out
+
+
+def _resolve_path(doc, parts):
+    cur = doc
+    for p in parts:
+        try:
+            cur = cur[p]
+        except (KeyError, IndexError, TypeError):
+            return _MISSING
+    return cur
+
+
+def _bounded_value(value, max_bytes: int) -> Tuple[Any, bool]:
+    """Return a value for storage, replacing oversized values with a truncated extended JSON preview."""
+    if value is _MISSING:
+        return None, False
+    if len(bson.encode({'v': value})) <= max_bytes:
+        return value, False
+    return bson_dumps(value)[:max_bytes] + '...', True
+
+
+def diff_documents(da: Dict[str, Any], dbb: Dict[str, Any], max_depth: int = DIFF_MAX_DEPTH,
+                   max_changes: int = DIFF_MAX_CHANGES, max_value_bytes: int = DIFF_MAX_VALUE_BYTES):
+    """Return (changes, truncated) describing the field paths that differ between two documents.
+
+    Each change is {'path', 'op', 'a', 'b'} where op is 'changed', 'only_a' or 'only_b'.
+    Paths deeper than max_depth are collapsed onto their ancestor at max_depth, at most
+    max_changes entries are returned and values larger than max_value_bytes are truncated.
+    """
+    candidates = []
+    truncated = False
+    if DeepDiff is None:
+        for key in sorted(set(da) | set(dbb), key=str):
+            va, vb = da.get(key, _MISSING), dbb.get(key, _MISSING)
+            if va != vb:
+                candidates.append([key])
+    else:
+        tree = DeepDiff(da, dbb, view='tree', max_diffs=max_changes + 1)
+        for levels in tree.values():
+            for level in levels:
+                candidates.append(level.path(output_format='list'))
+        truncated = len(candidates) > max_changes
+
+    changes = []
+    seen = set()
+    for parts in candidates:
+        parts = parts[:max_depth]
+        path = _format_path(parts)
+        if path in seen:
+            continue
+        seen.add(path)
+        if len(changes) >= max_changes:
+            truncated = True
+            break
+        va, vb = _resolve_path(da, parts), _resolve_path(dbb, parts)
+        if va is _MISSING:
+            op = 'only_b'
+        elif vb is _MISSING:
+            op = 'only_a'
+        else:
+            op = 'changed'
+        a_val, a_cut = _bounded_value(va, max_value_bytes)
+        b_val, b_cut = _bounded_value(vb, max_value_bytes)
+        changes.append({'path': path, 'op': op, 'a': a_val, 'b': b_val, 'value_truncated': a_cut or b_cut})
+    changes.sort(key=lambda c: c['path'])
+    return changes, truncated
+
+
+def parse_filter(text: str) -> Dict[str, Any]:
+    """Parse a Mongo extended JSON filter document; empty input means no filter."""
+    if not text or not text.strip():
+        return {}
+    try:
+        value = bson_loads(text)
+    except Exception as e:
+        raise ValueError(f'Invalid filter JSON: {e}')
+    if not isinstance(value, dict):
+        raise ValueError('Filter must be a JSON object')
+    return value
+
+
+def build_projection(include: List[str], exclude: List[str]) -> Optional[Dict[str, int]]:
+    """Build a find() projection from field include/exclude lists.
+
+    Mongo cannot mix inclusion and exclusion, so when both are given the excluded fields are
+    dropped from the include list. `_id` is always kept since documents are matched on it.
+    """
+    include = [f for f in include if f and f != '_id' and f not in exclude]
+    exclude = [f for f in exclude if f and f != '_id']
+    if include:
+        return dict({f: 1 for f in include}, _id=1)
+    if exclude:
+        return {f: 0 for f in exclude}
+    return None
+
+
+def _load_docs_indexed(client, db_name: str, coll: str, limit: int = 1000,
+                       query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
     db = client[db_name]
-    cursor = db[coll].find({}, limit=limit)
+    cursor = db[coll].find(query or {}, dict(projection) if projection else None, limit=limit)
+    if limit:
+        # a capped scan takes the lowest _ids on both sides, so the two caps cover the same range
+        cursor = cursor.sort('_id', 1)
     out = {}
     for d in cursor:
         key = str(d.get('_id'))
@@ -55,43 +320,534 @@ def _load_docs_indexed(client, db_name: str, coll: str, limit: int = 1000) -> Di
     return out
 
 
-def compare_collections(client_a, client_b, db_name_a: str, db_name_b: str, collections: List[str], limit: int = 1000):
+def _diff_indexed(a_docs: Dict[str, Any], b_docs: Dict[str, Any]) -> Dict[str, Any]:
+    """Compare two `_id`-indexed document maps and return the collection entry stored in a session."""
+    a_keys = set(a_docs.keys())
+    b_keys = set(b_docs.keys())
+    added = sorted(list(a_keys - b_keys))
+    removed = sorted(list(b_keys - a_keys))
+    common = sorted(list(a_keys & b_keys))
+
+    modified = []
+    modified_ids = []
+    modified_count = 0
+    for k in common:
+        da = a_docs.get(k)
+        dbb = b_docs.get(k)
+        if da != dbb:
+            modified_count += 1
+            modified_ids.append(da.get('_id'))
+            if len(modified) < MODIFIED_SAMPLE_SIZE:
+                # store changed field paths only; full documents are fetched on demand
+                changes, truncated = diff_documents(da, dbb)
+                modified.append({'_id': k, 'id_ext': bson_dumps(da.get('_id')),
+                                 'changes': changes, 'truncated': truncated})
+
+    return {
+        'added_count': len(added),
+        'removed_count': len(removed),
+        'modified_count': modified_count,
+        'added': added[:50],
+        'removed': removed[:50],
+        'modified': modified,
+        # raw _id values (types preserved) for every difference, used to build sync plans
+        'added_ids': [a_docs[k].get('_id') for k in added],
+        'removed_ids': [b_docs[k].get('_id') for k in removed],
+        'modified_ids': modified_ids
+    }
+
+
+def _max_value(client, db_name: str, coll: str, field: str):
+    doc = client[db_name][coll].find_one({field: {'$exists': True}}, {field: 1}, sort=[(field, -1)])
+    return doc.get(field) if doc else None
+
+
+def _watermark(client_a, client_b, db_name_a: str, db_name_b: str, coll: str, field: str) -> Dict[str, Any]:
+    """Return the highest value of `field` across both sides, taken before the scan so that
+    documents written during it are picked up again by the next incremental run."""
+    values = [v for v in (_max_value(client_a, db_name_a, coll, field), _max_value(client_b, db_name_b, coll, field))
+              if v is not None]
+    return {'field': field, 'value': max(values) if values else None}
+
+
+def _bson_type_alias(value) -> Optional[str]:
+    if isinstance(value, ObjectId):
+        return 'objectId'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return 'number'
+    if isinstance(value, datetime):
+        return 'date'
+    return None
+
+
+def _split_points(client, db_name: str, coll: str, partitions: int, query=None) -> List[Any]:
+    """Pick `_id` split points from a random sample, bucketed server-side so BSON ordering applies.
+
+    Returns an empty list when the sampled ids do not share one comparable BSON type.
+    """
+    pipeline = [{'$match': query}] if query else []
+    pipeline += [{'$sample': {'size': partitions * PARTITION_SAMPLES}},
+                 {'$bucketAuto': {'groupBy': '$_id', 'buckets': partitions}}]
+    buckets = list(client[db_name][coll].aggregate(pipeline, allowDiskUse=True))
+    points = [b['_id']['min'] for b in buckets[1:]]
+    aliases = {_bson_type_alias(p) for p in points}
+    if len(aliases) != 1 or None in aliases:
+        return []
+    return points
+
+
+def _range_queries(points: List[Any]) -> List[Dict[str, Any]]:
+    """Turn split points into `_id` range queries covering the whole collection.
+
+    Range comparisons only match ids of the split points' BSON type, so a last query picks up
+    ids of every other type.
+    """
+    bounds = [None] + points + [None]
+    queries = []
+    for lo, hi in zip(bounds, bounds[1:]):
+        cond = {}
+        if lo is not None:
+            cond['$gte'] = lo
+        if hi is not None:
+            cond['$lt'] = hi
+        queries.append({'_id': cond})
+    queries.append({'_id': {'$not': {'$type': _bson_type_alias(points[0])}}})
+    return queries
+
+
+def _compare_range(src_a, src_b, db_name_a: str, db_name_b: str, coll: str, query, projection) -> Dict[str, Any]:
+    """Compare one `_id` range. Sources are clients (thread workers) or URIs (process workers,
+    which open their own connections and close them when done, as the worker outlives the call)."""
+    client_a = connect(src_a) if isinstance(src_a, str) else src_a
+    try:
+        client_b = connect(src_b) if isinstance(src_b, str) else src_b
+        try:
+            a_docs = _load_docs_indexed(client_a, db_name_a, coll, 0, query, projection)
+            b_docs = _load_docs_indexed(client_b, db_name_b, coll, 0, query, projection)
+        finally:
+            if client_b is not src_b:
+                client_b.close()
+    finally:
+        if client_a is not src_a:
+            client_a.close()
+    return _diff_indexed(a_docs, b_docs)
+
+
+def _merge_infos(infos: List[Dict[str, Any]]) -> Dict[str, Any]:
+    merged = {
+        'added_count': sum(i['added_count'] for i in infos),
+        'removed_count': sum(i['removed_count'] for i in infos),
+        'modified_count': sum(i['modified_count'] for i in infos),
+        'added': sorted(k for i in infos for k in i['added'])[:50],
+        'removed': sorted(k for i in infos for k in i['removed'])[:50],
+        'modified': [m for i in infos for m in i['modified']][:MODIFIED_SAMPLE_SIZE],
+    }
+    for key in ('added_ids', 'removed_ids', 'modified_ids'):
+        merged[key] = [x for i in infos for x in i[key]]
+    merged['partitions'] = len(infos)
+    merged['scan_truncated'] = False
+    return merged
+
+
+def _compare_partitioned(client_a, client_b, db_name_a: str, db_name_b: str, coll: str, partitions: int,
+                         query, projection, sources: Optional[Tuple[str, str]]) -> Optional[Dict[str, Any]]:
+    """Compare one collection as parallel `_id` ranges; returns None when it cannot be split.
+
+    With `sources` (URIs) the ranges run on the shared process pool (app.tools.process_pool), each
+    with its own connections, so the diffing uses several cores; otherwise ranges run on threads
+    sharing the clients' pools.
+    """
+    points = _split_points(client_a, db_name_a, coll, partitions, query)
+    if not points:
+        return None
+    queries = [{'$and': [query, q]} if query else q for q in _range_queries(points)]
+    if sources:
+        pool = get_process_pool()
+        futures = [pool.submit(_compare_range, sources[0], sources[1], db_name_a, db_name_b, coll, q, projection)
+                   for q in queries]
+        return _merge_infos([f.result() for f in futures])
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        futures = [pool.submit(_compare_range, client_a, client_b, db_name_a, db_name_b, coll, q, projection)
+                   for q in queries]
+        return _merge_infos([f.result() for f in futures])
+
+
+def compare_collections(client_a, client_b, db_name_a: str, db_name_b: str, collections: List[str], limit: int = 1000,
+                        filters: Optional[Dict[str, Dict[str, Any]]] = None,
+                        projections: Optional[Dict[str, Dict[str, int]]] = None, watermark_field: str = '_id',
+                        partitions: int = 1, sources: Optional[Tuple[str, str]] = None):
     """Return a session dict with per-collection added/removed/modified counts and sample diffs.
 
     This is a lightweight implementation suitable for preview only. Accepts separate db names for A and B.
+    `filters` and `projections` map collection names to a query and projection that are pushed down
+    to both servers, so only matching documents and fields are transferred and diffed.
+    A watermark on `watermark_field` is recorded per collection for later incremental runs.
+    Unlimited compares (`limit=0`) of collections with at least PARTITION_MIN_DOCS documents are
+    split into `partitions` parallel `_id` ranges when `partitions` > 1.
     """
-    session = {'id': None, 'db_a': db_name_a, 'db_b': db_name_b, 'collections': {}}
+    filters = filters or {}
+    projections = projections or {}
+    session = {'id': None, 'db_a': db_name_a, 'db_b': db_name_b, 'collections': {},
+               'watermarks': {}, 'last_full_at': datetime.utcnow()}
     for coll in collections:
+        query = filters.get(coll)
+        projection = projections.get(coll)
+        try:
+            mark = _watermark(client_a, client_b, db_name_a, db_name_b, coll, watermark_field)
+        except Exception:
+            mark = None
+        if partitions > 1 and not limit:
+            try:
+                info = None
+                if client_a[db_name_a][coll].estimated_document_count() >= PARTITION_MIN_DOCS:
+                    info = _compare_partitioned(client_a, client_b, db_name_a, db_name_b, coll, partitions,
+                                                query, projection, sources)
+            except Exception:
+                info = None
+            if info is not None:
+                session['collections'][coll] = info
+                if mark:
+                    session['watermarks'][coll] = mark
+                continue
+        errors = []
         try:
-            a_docs = _load_docs_indexed(client_a, db_name_a, coll, limit)
+            a_docs = _load_docs_indexed(client_a, db_name_a, coll, limit, query, projection)
         except Exception as e:
             a_docs = {}
+            errors.append(f'A: {e}')
         try:
-            b_docs = _load_docs_indexed(client_b, db_name_b, coll, limit)
+            b_docs = _load_docs_indexed(client_b, db_name_b, coll, limit, query, projection)
         except Exception as e:
             b_docs = {}
+            errors.append(f'B: {e}')
+
+        info = _diff_indexed(a_docs, b_docs)
+        # A scan cut short by the limit has not seen every document: its added/removed sets are partly
+        # artefacts of the cap, so it can neither seed incremental runs nor back a sync plan
+        info['scan_truncated'] = bool(limit and (len(a_docs) >= limit or len(b_docs) >= limit))
+        if errors:
+            info['scan_error'] = '; '.join(errors)
+        session['collections'][coll] = info
+        if mark and not info['scan_truncated'] and not errors:
+            session['watermarks'][coll] = mark
+    return session
+
+
+def _merge_ids(previous: List[Any], scanned: set, current: List[Any]) -> List[Any]:
+    return [x for x in previous if str(x) not in scanned] + current
+
+
+def incremental_compare(client_a, client_b, base: Dict[str, Any], collections: List[str], limit: int = 1000,
+                        filters: Optional[Dict[str, Dict[str, Any]]] = None,
+                        projections: Optional[Dict[str, Dict[str, int]]] = None):
+    """Re-compare only documents past each collection's watermark and merge into a previous session.
+
+    `base` is the fully loaded previous session. Documents whose watermark field moved past the
+    recorded value are loaded from both sides (plus their counterparts by `_id`), re-classified
+    and merged into the previous id lists. Deletions are not visible to a watermark scan, so a
+    periodic full compare is still needed. Collections without a watermark are compared in full
+    (honouring `limit`); the watermark scans themselves are not limited.
+    """
+    filters = filters or {}
+    projections = projections or {}
+    db_name_a, db_name_b = base['db_a'], base['db_b']
+    session = {'id': None, 'db_a': db_name_a, 'db_b': db_name_b, 'collections': {},
+               'watermarks': {}, 'last_full_at': base.get('last_full_at'), 'base_session': base.get('id')}
+    for coll in collections:
+        prev = base.get('collections', {}).get(coll)
+        mark = (base.get('watermarks') or {}).get(coll)
+        query = filters.get(coll) or {}
+        projection = projections.get(coll)
+        if prev is None or not mark or mark.get('value') is None or 'added_ids' not in prev:
+            full = compare_collections(client_a, client_b, db_name_a, db_name_b, [coll], limit=limit, filters=filters,
+                                       projections=projections, watermark_field=(mark or {}).get('field', '_id'))
+            session['collections'][coll] = full['collections'][coll]
+            session['watermarks'].update(full['watermarks'])
+            continue
+
+        field = mark['field']
+        session['watermarks'][coll] = _watermark(client_a, client_b, db_name_a, db_name_b, coll, field)
+        past = {'$and': [query, {field: {'$gt': mark['value']}}]} if query else {field: {'$gt': mark['value']}}
+        a_docs = _load_docs_indexed(client_a, db_name_a, coll, 0, past, projection)
+        b_docs = _load_docs_indexed(client_b, db_name_b, coll, 0, past, projection)
+        # a document may only have moved on one side; fetch its counterpart so it is not misread as added/removed
+        a_docs.update(_lookup_by_ids(client_a, db_name_a, coll, [d['_id'] for k, d in b_docs.items() if k not in a_docs], projection))
+        b_docs.update(_lookup_by_ids(client_b, db_name_b, coll, [d['_id'] for k, d in a_docs.items() if k not in b_docs], projection))
+        scanned = set(a_docs) | set(b_docs)
+        delta = _diff_indexed(a_docs, b_docs)
+
+        added_ids = _merge_ids(prev.get('added_ids', []), scanned, delta['added_ids'])
+        removed_ids = _merge_ids(prev.get('removed_ids', []), scanned, delta['removed_ids'])
+        modified_ids = _merge_ids(prev.get('modified_ids', []), scanned, delta['modified_ids'])
+        kept_samples = [m for m in prev.get('modified', []) if m['_id'] not in scanned]
+        session['collections'][coll] = {
+            'added_count': len(added_ids),
+            'removed_count': len(removed_ids),
+            'modified_count': len(modified_ids),
+            'added': sorted(str(x) for x in added_ids)[:50],
+            'removed': sorted(str(x) for x in removed_ids)[:50],
+            'modified': (delta['modified'] + kept_samples)[:MODIFIED_SAMPLE_SIZE],
+            'added_ids': added_ids,
+            'removed_ids': removed_ids,
+            'modified_ids': modified_ids,
+            'incremental_scanned': len(scanned),
+            'scan_truncated': bool(prev.get('scan_truncated'))
+        }
+    return session
+
+
+def _wilson_interval(hits: int, n: int, confidence: float) -> Tuple[float, float]:
+    """Wilson score interval for a binomial proportion."""
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = hits / n
+    denom = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+def _estimate(hits: int, n: int, total: int, confidence: float) -> Dict[str, Any]:
+    lo, hi = _wilson_interval(hits, n, confidence)
+    rate = hits / n if n else 0.0
+    return {'rate': rate, 'ci': [lo, hi], 'count': round(rate * total), 'count_ci': [math.floor(lo * total), math.ceil(hi * total)]}
+
+
+def _sample_docs(client, db_name: str, coll: str, size: int, query=None, projection=None) -> Dict[str, Any]:
+    pipeline = []
+    if query:
+        pipeline.append({'$match': query})
+    pipeline.append({'$sample': {'size': size}})
+    if projection:
+        pipeline.append({'$project': dict(projection)})
+    out = {}
+    for d in client[db_name][coll].aggregate(pipeline, allowDiskUse=True):
+        out[str(d.get('_id'))] = d
+    return out
+
+
+def _lookup_by_ids(client, db_name: str, coll: str, ids: List[Any], projection=None, batch_size: int = 1000) -> Dict[str, Any]:
+    out = {}
+    for i in range(0, len(ids), batch_size):
+        cursor = client[db_name][coll].find({'_id': {'$in': ids[i:i + batch_size]}}, dict(projection) if projection else None)
+        for d in cursor:
+            out[str(d.get('_id'))] = d
+    return out
 
-        a_keys = set(a_docs.keys())
-        b_keys = set(b_docs.keys())
-        added = sorted(list(a_keys - b_keys))
-        removed = sorted(list(b_keys - a_keys))
-        common = sorted(list(a_keys & b_keys))
 
+def _count(client, db_name: str, coll: str, query=None) -> int:
+    col = client[db_name][coll]
+    # metadata count is O(1); an exact count is only needed when a filter narrows the collection
+    return col.count_documents(query) if query else col.estimated_document_count()
+
+
+def sample_collections(client_a, client_b, db_name_a: str, db_name_b: str, collections: List[str], sample_size: int = 1000,
+                       filters: Optional[Dict[str, Dict[str, Any]]] = None,
+                       projections: Optional[Dict[str, Dict[str, int]]] = None, confidence: float = 0.95):
+    """Estimate per-collection added/removed/modified rates from random samples.
+
+    Draws a `$sample` from A and looks the sampled `_id`s up on B (added and modified rates),
+    and does the same from B to A for the removed rate, so cost depends on the sample size and
+    not on collection size. Rates come with Wilson confidence intervals and are extrapolated to
+    counts using each side's document count.
+
+    That holds for unfiltered collections only: with a filter, `$match` runs before `$sample`,
+    which rules out the server's random-cursor path, so each side scans every matching document.
+    The sample stays uniform over the filtered set, so the estimates remain valid.
+    """
+    filters = filters or {}
+    projections = projections or {}
+    session = {'id': None, 'db_a': db_name_a, 'db_b': db_name_b, 'mode': 'sample', 'confidence': confidence, 'collections': {}}
+    for coll in collections:
+        query = filters.get(coll)
+        projection = projections.get(coll)
+        try:
+            count_a = _count(client_a, db_name_a, coll, query)
+            count_b = _count(client_b, db_name_b, coll, query)
+            a_docs = _sample_docs(client_a, db_name_a, coll, sample_size, query, projection)
+            b_match = _lookup_by_ids(client_b, db_name_b, coll, [d['_id'] for d in a_docs.values()], projection)
+            b_docs = _sample_docs(client_b, db_name_b, coll, sample_size, query, projection)
+            a_match = _lookup_by_ids(client_a, db_name_a, coll, [d['_id'] for d in b_docs.values()], projection)
+        except Exception as e:
+            session['collections'][coll] = {'error': str(e), 'added_count': 0, 'removed_count': 0, 'modified_count': 0,
+                                            'added': [], 'removed': [], 'modified': []}
+            continue
+
+        added = sorted(k for k in a_docs if k not in b_match)
+        removed = sorted(k for k in b_docs if k not in a_match)
         modified = []
-        # simple field-level diff: show which top-level keys differ
-        for k in common:
-            da = a_docs.get(k)
-            dbb = b_docs.get(k)
-            if da != dbb:
-                # prepare a small diff object: show both docs using bson json util
-                modified.append({'_id': k, 'a': json.loads(bson_dumps(da)), 'b': json.loads(bson_dumps(dbb))})
+        modified_hits = 0
+        for k, da in a_docs.items():
+            dbb = b_match.get(k)
+            if dbb is not None and da != dbb:
+                modified_hits += 1
+                if len(modified) < MODIFIED_SAMPLE_SIZE:
+                    changes, truncated = diff_documents(da, dbb)
+                    modified.append({'_id': k, 'id_ext': bson_dumps(da.get('_id')),
+                                     'changes': changes, 'truncated': truncated})
 
+        est_added = _estimate(len(added), len(a_docs), count_a, confidence)
+        est_removed = _estimate(len(removed), len(b_docs), count_b, confidence)
+        est_modified = _estimate(modified_hits, len(a_docs), count_a, confidence)
         session['collections'][coll] = {
-            'added_count': len(added),
-            'removed_count': len(removed),
-            'modified_count': len(modified),
+            'count_a': count_a,
+            'count_b': count_b,
+            'sampled_a': len(a_docs),
+            'sampled_b': len(b_docs),
+            'estimates': {'added': est_added, 'removed': est_removed, 'modified': est_modified},
+            'added_count': est_added['count'],
+            'removed_count': est_removed['count'],
+            'modified_count': est_modified['count'],
             'added': added[:50],
             'removed': removed[:50],
-            'modified': modified[:50]
+            'modified': modified
         }
     return session
+
+
+def get_sources(session_id: str) -> Tuple[str, str]:
+    """Return the (uri_a, uri_b) remembered for a session; raises KeyError when unknown or expired."""
+    with _SOURCES_LOCK:
+        _expire_sources(time.monotonic())
+        _, uri_a, uri_b = _SESSION_SOURCES[session_id]
+    return uri_a, uri_b
+
+
+def incomplete_collections(session: Dict[str, Any], infos: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Collections whose compare did not see every document (capped by the limit or failed to read).
+
+    Sessions saved before scans recorded this are judged by the limit: a capped scan never got a watermark.
+    """
+    limit = (session.get('meta') or {}).get('limit')
+    watermarks = session.get('watermarks') or {}
+    out = []
+    for coll, info in infos.items():
+        truncated = info.get('scan_truncated')
+        if truncated is None:
+            truncated = bool(limit) and coll not in watermarks and not info.get('partitions')
+        if truncated or info.get('scan_error') or 'added_ids' not in info:
+            out.append(coll)
+    return out
+
+
+def _set_update(da: Dict[str, Any], dbb: Dict[str, Any]) -> Dict[str, Any]:
+    update = {}
+    set_fields = {k: v for k, v in da.items() if k != '_id' and dbb.get(k, _MISSING) != v}
+    unset_fields = {k: '' for k in dbb if k != '_id' and k not in da}
+    if set_fields:
+        update['$set'] = set_fields
+    if unset_fields:
+        update['$unset'] = unset_fields
+    return update
+
+
+def iter_plan(client_a, client_b, session: Dict[str, Any], infos: Dict[str, Dict[str, Any]],
+              batch_size: int = PLAN_BATCH_SIZE, ordered: bool = False, update_mode: str = 'replace') -> Iterator[Dict[str, Any]]:
+    """Yield bulk_write batches that make B match A for the given collection entries.
+
+    Documents only in A become InsertOne, documents only in B become DeleteOne and modified
+    documents become ReplaceOne, or UpdateOne with top-level $set/$unset when update_mode is
+    'set' (restricted to the compare's projection, so ignored fields are left alone).
+    Documents are fetched from the sources one batch at a time.
+    Each batch is {'collection', 'ordered', 'ops': [{'op', ...}, ...]}.
+    """
+    db_a, db_b = session['db_a'], session['db_b']
+    projection = (session.get('meta') or {}).get('projection') if update_mode == 'set' else None
+    for coll, info in infos.items():
+        for i in range(0, len(info.get('added_ids', [])), batch_size):
+            ids = info['added_ids'][i:i + batch_size]
+            docs = _lookup_by_ids(client_a, db_a, coll, ids)
+            ops = [{'op': 'insert_one', 'document': d} for d in docs.values()]
+            if ops:
+                yield {'collection': coll, 'ordered': ordered, 'ops': ops}
+        for i in range(0, len(info.get('modified_ids', [])), batch_size):
+            ids = info['modified_ids'][i:i + batch_size]
+            docs_a = _lookup_by_ids(client_a, db_a, coll, ids, projection)
+            ops = []
+            if update_mode == 'set':
+                docs_b = _lookup_by_ids(client_b, db_b, coll, ids, projection)
+                for k, da in docs_a.items():
+                    update = _set_update(da, docs_b.get(k, {}))
+                    if update:
+                        ops.append({'op': 'update_one', 'filter': {'_id': da['_id']}, 'update': update})
+            else:
+                ops = [{'op': 'replace_one', 'filter': {'_id': d['_id']}, 'replacement': d} for d in docs_a.values()]
+            if ops:
+                yield {'collection': coll, 'ordered': ordered, 'ops': ops}
+        for i in range(0, len(info.get('removed_ids', [])), batch_size):
+            ids = info['removed_ids'][i:i + batch_size]
+            yield {'collection': coll, 'ordered': ordered, 'ops': [{'op': 'delete_one', 'filter': {'_id': x}} for x in ids]}
+
+
+def _canonical(value) -> str:
+    # canonical mode keeps Int64, dates and decimals exact; relaxed mode would turn them into plain JSON numbers
+    return bson_dumps(value, json_options=CANONICAL_JSON_OPTIONS)
+
+
+def render_plan_ndjson(batches: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """One canonical extended JSON line per batch (types such as Int64, dates and decimals are exact)."""
+    for batch in batches:
+        yield _canonical(batch) + '\n'
+
+
+def render_plan_script(batches: Iterable[Dict[str, Any]], session: Dict[str, Any]) -> Iterator[str]:
+    """Render batches as a standalone pymongo script reading TARGET_URI / TARGET_DB from the environment."""
+    yield '# Generated sync plan: make {} match {}\n'.format(session.get('db_b'), session.get('db_a'))
+    yield 'import os\n'
+    yield 'from bson.json_util import loads\n'
+    yield 'from pymongo import MongoClient, InsertOne, ReplaceOne, UpdateOne, DeleteOne\n\n'
+    yield 'client = MongoClient(os.environ["TARGET_URI"])\n'
+    yield 'db = client[os.environ.get("TARGET_DB", {!r})]\n'.format(session.get('db_b'))
+    for batch in batches:
+        yield '\nops = [\n'
+        for op in batch['ops']:
+            if op['op'] == 'insert_one':
+                line = 'InsertOne(loads({!r}))'.format(_canonical(op['document']))
+            elif op['op'] == 'replace_one':
+                line = 'ReplaceOne(loads({!r}), loads({!r}))'.format(_canonical(op['filter']), _canonical(op['replacement']))
+            elif op['op'] == 'update_one':
+                line = 'UpdateOne(loads({!r}), loads({!r}))'.format(_canonical(op['filter']), _canonical(op['update']))
+            else:
+                line = 'DeleteOne(loads({!r}))'.format(_canonical(op['filter']))
+            yield '    ' + line + ',\n'
+        yield ']\n'
+        yield 'print(db[{!r}].bulk_write(ops, ordered={!r}).bulk_api_result)\n'.format(batch['collection'], batch['ordered'])
+
+
+def _to_pymongo_op(op: Dict[str, Any]):
+    if op['op'] == 'insert_one':
+        return InsertOne(op['document'])
+    if op['op'] == 'replace_one':
+        return ReplaceOne(op['filter'], op['replacement'])
+    if op['op'] == 'update_one':
+        return UpdateOne(op['filter'], op['update'])
+    return DeleteOne(op['filter'])
+
+
+def execute_plan(client, db_name: str, batches: Iterable[Dict[str, Any]], dry_run: bool = True) -> Dict[str, Any]:
+    """Apply plan batches to a target database and report counts and throughput.
+
+    With dry_run the operations are built and validated but nothing is written.
+    """
+    stats = {'dry_run': dry_run, 'batches': 0, 'ops': 0, 'inserted': 0, 'modified': 0, 'deleted': 0, 'errors': []}
+    started = time.perf_counter()
+    for batch in batches:
+        ops = [_to_pymongo_op(op) for op in batch['ops']]
+        stats['batches'] += 1
+        stats['ops'] += len(ops)
+        if dry_run:
+            continue
+        try:
+            result = client[db_name][batch['collection']].bulk_write(ops, ordered=batch['ordered'])
+        except BulkWriteError as e:
+            stats['errors'].append({'collection': batch['collection'], 'error': str(e.details.get('writeErrors', [])[:5])})
+            continue
+        stats['inserted'] += result.inserted_count
+        stats['modified'] += result.modified_count
+        stats['deleted'] += result.deleted_count
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['ops_per_sec'] = round(stats['ops'] / stats['seconds'], 1) if stats['seconds'] else None
+    return stats
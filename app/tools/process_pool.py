@@ -0,0 +1,34 @@
+"""One process pool shared by the tools that spread CPU-bound work over several cores.
+
+Web workers serve requests on threads, and a child forked from a threaded process can inherit
+locks other threads were holding, so the pool starts its workers with 'spawn'. It is created on
+first use and kept for the life of the process (a forked server worker creates its own). At most
+POOL_MAX_WORKERS processes run, so concurrent requests queue for the same workers instead of
+each starting a pool of cpu_count() processes.
+
+Work submitted to the pool must be picklable module-level functions and arguments.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+POOL_MAX_WORKERS = min(os.cpu_count() or 1, 8)
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """The shared pool; a new one replaces a pool that broke (a worker died) or was inherited by fork.
+
+    Do not shut it down or use it as a context manager.
+    """
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid() or getattr(_pool, '_broken', False):
+            _pool = ProcessPoolExecutor(max_workers=POOL_MAX_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+        return _pool
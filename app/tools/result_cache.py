@@ -0,0 +1,188 @@
+"""Tool result cache keyed by a hash of the tool name, its inputs and its options.
+
+Two tiers: an in-process LRU bounded by the total size of the cached values, and an optional
+directory of zlib-compressed files (RESULT_CACHE_DIR) shared by all workers, bounded the same
+way. Values are strings (rendered HTML or formatted text).
+"""
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from flask import current_app
+
+# A single value larger than this fraction of the memory budget is not kept in memory
+MAX_ENTRY_FRACTION = 0.25
+
+
+def cache_key(tool: str, inputs: Iterable[str], options: Optional[Dict[str, Any]] = None) -> str:
+    """sha256 over the tool name, the inputs with line endings normalised, and the sorted options."""
+    h = hashlib.sha256(tool.encode('utf-8'))
+    for value in inputs:
+        data = (value or '').replace('\r\n', '\n').encode('utf-8')
+        # length prefix so ('ab', 'c') and ('a', 'bc') hash differently
+        h.update(len(data).to_bytes(8, 'big'))
+        h.update(data)
+    h.update(json.dumps(options or {}, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: 'OrderedDict[str, str]' = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._disk_bytes = None  # measured on first disk write
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_evictions': 0}
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return value
+        value = self._disk_get(key)
+        with self._lock:
+            self.counters['disk_hits' if value is not None else 'misses'] += 1
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        self._remember(key, value)
+        self._disk_put(key, value)
+
+    def get_or_compute(self, key: str, compute: Callable[[], str]) -> str:
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['disk_hits'] + self.counters['misses']
+            return dict(self.counters, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes,
+                        disk_bytes=self._disk_bytes, hit_rate=(lookups - self.counters['misses']) / lookups
+                        if lookups else None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def _remember(self, key: str, value: str) -> None:
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes * MAX_ENTRY_FRACTION:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._sizes[key]
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                old, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(old)
+                self.counters['evictions'] += 1
+
+    # Disk tier: one file per key under <dir>/<key[:2]>/, evicted oldest-mtime first
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = zlib.decompress(f.read()).decode('utf-8')
+            os.utime(path)  # keeps recently used files from being evicted first
+            return value
+        except (OSError, zlib.error, UnicodeDecodeError):
+            return None
+
+    def _disk_put(self, key: str, value: str) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        data = zlib.compress(value.encode('utf-8'), 6)
+        if len(data) > self.disk_max_bytes * MAX_ENTRY_FRACTION:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # per process and thread: two threads may store the same key at once
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, _, size in self._disk_files())
+            else:
+                self._disk_bytes += len(data)
+            over = self._disk_bytes > self.disk_max_bytes
+        if over:
+            self._disk_evict()
+
+    def _disk_files(self):
+        # another worker may remove files (or a whole subdirectory) while this one scans
+        try:
+            subs = list(os.scandir(self.disk_dir))
+        except OSError:
+            return
+        for sub in subs:
+            try:
+                entries = list(os.scandir(sub.path)) if sub.is_dir() else []
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, st.st_mtime, st.st_size
+
+    def _disk_evict(self) -> None:
+        # other workers share the directory, so re-measure and trim to 90% of the budget
+        files = sorted(self._disk_files(), key=lambda f: f[1])
+        total = sum(size for _, _, size in files)
+        target = self.disk_max_bytes * 0.9
+        removed = 0
+        for path, _, size in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._disk_bytes = total
+            self.counters['disk_evictions'] += removed
+
+
+def get_result_cache() -> ResultCache:
+    """The app's ResultCache, created from RESULT_CACHE_* config on first use."""
+    cache = current_app.extensions.get('result_cache')
+    if cache is None:
+        config = current_app.config
+        cache = current_app.extensions.setdefault('result_cache', ResultCache(
+            config.get('RESULT_CACHE_MAX_BYTES', 32 << 20),
+            config.get('RESULT_CACHE_DIR'),
+            config.get('RESULT_CACHE_DISK_MAX_BYTES', 512 << 20)))
+    return cache
@@ -1,155 +1,462 @@
-from flask import render_template, redirect, url_for, flash, request, send_file, current_app, jsonify
+from flask import render_template, redirect, url_for, flash, request, send_file, current_app, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 from app import db
 from app.tools import bp
 from app.tools.forms import DiffForm
-from app.models import Tool, ToolUsage, DiffHistory
-import difflib
+from app.models import DiffHistory, ContentBlob
 import html
+import json
 import re
 import os
+import time
 import uuid
+from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 from app.tools.wp_db_compare import parse_sql_inserts, compare_tables, save_session, load_session, detect_tables_in_dump
-from app.tools.rulecard import format_rulecard
+from app.tools.rulecard import format_rulecard, format_rulecard_all
+from app.tools.diff_engine import DiffRows, word_opcodes
+from app.tools.result_cache import cache_key, get_result_cache
 from app.tools.forms import RuleCardForm
+from app.usage import get_usage_recorder, record_tool_usage
 
-def record_tool_usage(tool_name):
-    """Record that a tool was used"""
-    tool = Tool.query.filter_by(name=tool_name).first()
-    if tool:
-        usage = ToolUsage(user_id=current_user.id, tool_id=tool.id)
-        db.session.add(usage)
-        db.session.commit()
+@bp.app_template_filter('ejson')
+def ejson_filter(value):
+    """Render a value as Mongo extended JSON (keeps ObjectId, dates and other BSON types readable)."""
+    from bson.json_util import dumps as bson_dumps
+    return bson_dumps(value)
+
+# Changed line pairs are highlighted word by word while rendering only when both lines are at most
+# INTRALINE_MAX_CHARS long and fewer than INTRALINE_MAX_PAIRS pairs were done; the rest on demand.
+INTRALINE_MAX_CHARS = 400
+INTRALINE_MAX_PAIRS = 2000
+
+def intraline_html(text1, text2):
+    """Return escaped HTML for a removed/added line pair with changed words wrapped in spans."""
+    ta, tb, codes = word_opcodes(text1, text2)
+    out_a = []
+    out_b = []
+    for tag, i1, i2, j1, j2 in codes:
+        seg_a = html.escape(''.join(ta[i1:i2]))
+        seg_b = html.escape(''.join(tb[j1:j2]))
+        if tag == 'equal':
+            out_a.append(seg_a)
+            out_b.append(seg_b)
+            continue
+        if seg_a:
+            out_a.append(f'<span class="diff-word-remove">{seg_a}</span>')
+        if seg_b:
+            out_b.append(f'<span class="diff-word-add">{seg_b}</span>')
+    return ''.join(out_a), ''.join(out_b)
+
+def _diff_line_html(cls, ln_from, ln_to, sign, content, attrs=''):
+    # Render a line with two line-number columns and the content
+    return (
+        f'<div class="diff-line {cls}"{attrs}>' +
+        f'<span class="ln ln-from">{ln_from}</span>' +
+        f'<span class="ln ln-to">{ln_to}</span>' +
+        f'<span class="diff-marker">{html.escape(sign)}</span>' +
+        f'<pre class="diff-content">{content}</pre>' +
+        '</div>'
+    )
+
+def render_diff_rows(rows, state=None):
+    """Yield the HTML for each row produced by DiffRows.rows().
+
+    Removed/added line pairs are highlighted word by word within the INTRALINE_* limits; `state`
+    carries the highlight budget across calls. Pairs over the limits get data-pair="<pair id>" so
+    the page can request the highlight when one of the lines is clicked.
+    """
+    state = state if state is not None else {'pairs': 0}
+    highlighted = {}
+    for row, kind, ln_from, ln_to, text, pair in rows:
+        if kind == 'header':
+            yield f'<div class="diff-header">{html.escape(text)}</div>'
+            continue
+        if kind == 'range':
+            yield f'<div class="diff-range">{html.escape(text)}</div>'
+            continue
+        if kind == 'context':
+            yield _diff_line_html('diff-context', ln_from, ln_to, ' ', html.escape(text))
+            continue
+        content = None
+        attrs = ''
+        if pair and pair[1] != text:
+            pair_id, other = pair
+            if pair_id in highlighted:
+                content = highlighted.pop(pair_id)
+            elif (state['pairs'] < INTRALINE_MAX_PAIRS and len(text) <= INTRALINE_MAX_CHARS
+                    and len(other) <= INTRALINE_MAX_CHARS):
+                content, highlighted[pair_id] = intraline_html(text, other)
+                state['pairs'] += 1
+            else:
+                # too large to highlight now; the page requests it when the line is clicked
+                attrs = f' data-pair="{pair_id}"'
+        if content is None:
+            content = html.escape(text)
+        if kind == 'remove':
+            yield _diff_line_html('diff-remove', ln_from, '', '-', content, attrs)
+        else:
+            yield _diff_line_html('diff-add', '', ln_to, '+', content, attrs)
+
+def iter_diff_html(diff):
+    """Yield the rendered diff one hunk at a time (the file headers come with the first hunk)."""
+    state = {'pairs': 0}
+    for hunk in diff.hunks():
+        yield '\n'.join(render_diff_rows(hunk, state))
 
 def generate_diff_html(text1, text2, text1_name='Text 1', text2_name='Text 2'):
     """Generate HTML diff between two texts with line numbers for both files.
 
-    Uses unified_diff output, parses hunk headers to track line numbers
-    and renders each diff line with left/right line numbers and content.
+    The diff engine is picked by input size (see app.tools.diff_engine); replaced
+    lines are paired up for word-level highlighting. Diffs too large to embed in
+    a page are served in row windows instead (see diff_history_rows).
     """
     # Split without keeping line endings to simplify numbering
-    text1_lines = text1.splitlines()
-    text2_lines = text2.splitlines()
+    diff = DiffRows(text1.splitlines(), text2.splitlines(), text1_name, text2_name)
+    return '\n'.join(iter_diff_html(diff))
 
-    diff = difflib.unified_diff(text1_lines, text2_lines,
-                                fromfile=text1_name,
-                                tofile=text2_name,
-                                lineterm='')
+# Diffs with more output rows than this are not embedded in the page; the page fetches
+# DIFF_ROWS_CHUNK-row windows from diff_history_rows as they scroll into view.
+DIFF_INLINE_MAX_ROWS = 5000
+DIFF_ROWS_CHUNK = 200
 
-    html_lines = []
-    from_ln = 0
-    to_ln = 0
+def _history_diff_rows(history):
+    names = (history.text1_name or 'Text 1', history.text2_name or 'Text 2')
+    if not (history.text1_blob_id and history.text2_blob_id):
+        # row not migrated yet
+        return DiffRows((history.text1_content or '').splitlines(), (history.text2_content or '').splitlines(),
+                        *names)
+    # Blobs are immutable, so the hunk layout is cached by their hashes, within the result cache's
+    # byte budget; the texts themselves are read back for each request rather than kept in memory.
+    cache = get_result_cache()
+    key = cache_key('diff_layout', (history.text1_blob_id, history.text2_blob_id))
+    layout = cache.get(key)
+    diff = DiffRows((ContentBlob.get_text(history.text1_blob_id) or '').splitlines(),
+                    (ContentBlob.get_text(history.text2_blob_id) or '').splitlines(),
+                    *names, groups=json.loads(layout) if layout is not None else None)
+    if layout is None:
+        cache.put(key, json.dumps(diff.groups, separators=(',', ':')))
+    return diff
 
-    hunk_re = re.compile(r"@@ -(?P<from_start>\d+)(?:,\d+)? \+(?P<to_start>\d+)(?:,\d+)? @@")
-
-    for raw in diff:
-        # raw is a line from unified diff (no trailing newline)
-        if raw.startswith('+++') or raw.startswith('---'):
-            html_lines.append(f'<div class="diff-header">{html.escape(raw)}</div>')
-            continue
+def _diff_view(history, make_rows=None):
+    """(inline html, virtual view settings): exactly one of them is set for a non-empty diff.
 
-        if raw.startswith('@@'):
-            m = hunk_re.search(raw)
-            if m:
-                from_ln = int(m.group('from_start'))
-                to_ln = int(m.group('to_start'))
-            html_lines.append(f'<div class="diff-range">{html.escape(raw)}</div>')
-            continue
-
-        # Prepare display numbers and content
-        line_type = raw[:1]
-        content = html.escape(raw[1:]) if len(raw) > 1 else ''
-
-        if line_type == '+':
-            # Added line: show right-side number
-            ln_from = ''
-            ln_to = to_ln
-            to_ln += 1
-            cls = 'diff-add'
-            sign = '+'
-        elif line_type == '-':
-            # Removed line: show left-side number
-            ln_from = from_ln
-            ln_to = ''
-            from_ln += 1
-            cls = 'diff-remove'
-            sign = '-'
-        else:
-            # Context line (also covers lines that don't start with +/-/ )
-            ln_from = from_ln
-            ln_to = to_ln
-            from_ln += 1
-            to_ln += 1
-            cls = 'diff-context'
-            sign = ' '
-
-        # Render a line with two line-number columns and the content
-        html_lines.append(
-            '<div class="diff-line {cls}">'.format(cls=cls) +
-            f'<span class="ln ln-from">{ln_from}</span>' +
-            f'<span class="ln ln-to">{ln_to}</span>' +
-            f'<span class="diff-marker">{html.escape(sign)}</span>' +
-            f'<pre class="diff-content">{content}</pre>' +
-            '</div>'
-        )
-
-    return '\n'.join(html_lines)
+    Inline HTML goes through the result cache, keyed by the content hashes of both sides and their
+    names, so re-submitting or re-opening the same comparison skips the diff. make_rows builds the
+    DiffRows on a cache miss (default: from the history's stored contents).
+    """
+    cache = get_result_cache()
+    key = None
+    if history.text1_blob_id and history.text2_blob_id:
+        key = cache_key('diff_checker', (history.text1_blob_id, history.text2_blob_id),
+                        {'names': [history.text1_name, history.text2_name]})
+        diff_html = cache.get(key)
+        if diff_html is not None:
+            return diff_html, None
+    diff = make_rows() if make_rows else _history_diff_rows(history)
+    if len(diff) <= DIFF_INLINE_MAX_ROWS:
+        diff_html = '\n'.join(iter_diff_html(diff))
+        if key:
+            cache.put(key, diff_html)
+        return diff_html, None
+    return None, {'url': url_for('tools.diff_history_rows', id=history.id),
+                  'total': len(diff), 'chunk': DIFF_ROWS_CHUNK}
 
 @bp.route('/diff', methods=['GET', 'POST'])
 @login_required
 def diff_checker():
     form = DiffForm()
-    diff_result = None
+    diff_result = virtual_diff = None
     
-    if form.validate_on_submit():
+    if form.file1.data or form.file2.data:
+        if form.validate_on_submit():
+            diff_result, virtual_diff = _diff_uploads(form)
+    elif form.validate_on_submit():
         text1 = form.text1.data
         text2 = form.text2.data
         text1_name = form.text1_name.data or 'Text 1'
         text2_name = form.text2_name.data or 'Text 2'
         
-        # Generate diff
-        diff_result = generate_diff_html(text1, text2, text1_name, text2_name)
-        
-        # Save to history
+        # Save to history (contents go to the deduplicated blob store; the HTML is re-rendered on view)
         history = DiffHistory(
             user_id=current_user.id,
             text1_name=text1_name,
             text2_name=text2_name,
             text1_content=text1,
-            text2_content=text2,
-            diff_result=diff_result
+            text2_content=text2
         )
         db.session.add(history)
-        
-        # Record tool usage
-        record_tool_usage('diff_checker')
-        
         db.session.commit()
+
+        # Record tool usage (after the commit: a synchronous recorder writes in its own transaction)
+        record_tool_usage('diff_checker')
+
+        # Generate diff
+        diff_result, virtual_diff = _diff_view(history)
         flash('Diff generated successfully!', 'success')
     
     return render_template('tools/diff_checker.html', 
                          title='Diff Checker', 
                          form=form,
-                         diff_result=diff_result)
+                         diff_result=diff_result,
+                         virtual_diff=virtual_diff)
+
+def _upload_name(upload, name, default):
+    # an uploaded file is shown under its file name unless the user renamed the side
+    if upload and (not name or name == default):
+        return os.path.basename(upload.filename or '') or default
+    return name or default
+
+def _diff_uploads(form):
+    """Diff Checker with at least one uploaded file; returns (diff_result, virtual_diff).
+
+    Both sides are spooled to disk. Identical files are detected from their hashes and binary files
+    are not diffed; otherwise only the lines between the common prefix and suffix are loaded.
+    """
+    from app.tools.diff_files import spool_upload, spool_text, trimmed_diff_rows
+    sides = []
+    try:
+        for upload, text, name, default in ((form.file1.data, form.text1.data, form.text1_name.data, 'Text 1'),
+                                            (form.file2.data, form.text2.data, form.text2_name.data, 'Text 2')):
+            name = _upload_name(upload, name, default)
+            sides.append(spool_upload(upload, name) if upload else spool_text(text or '', name))
+    except ValueError as e:
+        for f in sides:
+            f.remove()
+        flash(str(e), 'danger')
+        return None, None
+
+    fa, fb = sides
+    try:
+        if fa.sha256 == fb.sha256:
+            flash(f'{fa.name} and {fb.name} are identical.', 'info')
+            return None, None
+        binary = [f.name for f in sides if f.binary]
+        if binary:
+            flash(f'{", ".join(binary)} looks like a binary file, so no line diff is shown. '
+                  f'The files differ ({fa.size} vs {fb.size} bytes).', 'warning')
+            return None, None
+
+        history = DiffHistory(
+            user_id=current_user.id,
+            text1_name=fa.name,
+            text2_name=fb.name,
+            text1_blob_id=ContentBlob.put_file(fa.path),
+            text2_blob_id=ContentBlob.put_file(fb.path)
+        )
+        db.session.add(history)
+        db.session.commit()
+        record_tool_usage('diff_checker')
+        view = _diff_view(history, make_rows=lambda: trimmed_diff_rows(fa, fb))
+    finally:
+        for f in sides:
+            f.remove()
+
+    flash('Diff generated successfully!', 'success')
+    return view
+
+@bp.route('/diff/archive', methods=['GET', 'POST'])
+@login_required
+def diff_archive():
+    """Compare two zip/tar archives file by file."""
+    from app.tools.forms import ArchiveDiffForm
+    from app.tools.archive_diff import compare_archives
+    from app.tools.diff_files import spool_upload
+    form = ArchiveDiffForm()
+    if form.validate_on_submit():
+        sides = []
+        try:
+            for upload in (form.archive_a.data, form.archive_b.data):
+                sides.append(spool_upload(upload, os.path.basename(upload.filename or '') or 'archive'))
+            session = compare_archives(sides[0].path, sides[1].path, sides[0].name, sides[1].name,
+                                       current_user.id)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return render_template('tools/diff_archive.html', title='Archive Diff', form=form)
+        finally:
+            for f in sides:
+                f.remove()
+        record_tool_usage('diff_checker')
+        return redirect(url_for('tools.diff_archive_result', session_id=session['id']))
+    return render_template('tools/diff_archive.html', title='Archive Diff', form=form)
+
+def _archive_session(session_id):
+    from app.tools.archive_diff import load_session
+    try:
+        session = load_session(session_id)
+    except FileNotFoundError:
+        return None
+    return session if session.get('user_id') == current_user.id else None
+
+@bp.route('/diff/archive/<session_id>')
+@login_required
+def diff_archive_result(session_id):
+    from app.tools.archive_diff import build_tree
+    session = _archive_session(session_id)
+    if not session:
+        flash('Archive comparison not found', 'danger')
+        return redirect(url_for('tools.diff_archive'))
+    return render_template('tools/diff_archive_result.html', title='Archive Diff', session=session,
+                           tree=build_tree(session['files']))
+
+@bp.route('/diff/archive/<session_id>/file')
+@login_required
+def diff_archive_file(session_id):
+    """Rendered diff of one file of an archive comparison (?path=), as JSON."""
+    from app.tools.archive_diff import read_member, ARCHIVE_MAX_DIFF_BYTES
+    session = _archive_session(session_id)
+    if not session:
+        return jsonify({'ok': False, 'error': 'Archive comparison not found'}), 404
+    entry = next((f for f in session['files'] if f['path'] == request.args.get('path')), None)
+    if not entry:
+        return jsonify({'ok': False, 'error': 'File not found in this comparison'}), 404
+    if entry['binary']:
+        return jsonify({'ok': False, 'error': 'Binary file; no line diff available'}), 200
+    if max(entry['size_a'] or 0, entry['size_b'] or 0) > ARCHIVE_MAX_DIFF_BYTES:
+        return jsonify({'ok': False, 'error': 'File too large to diff here'}), 200
+    name_a = f"{session['names'][0]}:{entry['path']}"
+    name_b = f"{session['names'][1]}:{entry['path']}"
+    diff_html = get_result_cache().get_or_compute(
+        cache_key('diff_archive_file', (entry['sha_a'] or '', entry['sha_b'] or ''), {'names': [name_a, name_b]}),
+        lambda: generate_diff_html(read_member(session_id, 'a', entry['a']), read_member(session_id, 'b', entry['b']),
+                                   name_a, name_b))
+    return jsonify({'ok': True, 'html': diff_html}), 200
+
+@bp.route('/diff/api/batch', methods=['POST'])
+@login_required
+def diff_api_batch():
+    """Diff many text pairs in one request and return structured hunks as JSON.
+
+    Body: {"pairs": [{"a", "b", "id"?, "name_a"?, "name_b"?}, ...], "context"?: 3, "record_history"?: false}.
+    With record_history, all pairs are saved in one transaction with a single usage record.
+    """
+    from app.tools.diff_batch import run_batch, validate_batch
+    data = request.get_json(silent=True)
+    try:
+        pairs = validate_batch(data)
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    try:
+        context = int(data.get('context', 3))
+    except (TypeError, ValueError):
+        context = -1
+    if not 0 <= context <= 100:
+        return jsonify({'ok': False, 'error': 'context must be an integer between 0 and 100'}), 400
+    if not pairs:
+        # nothing was diffed, so nothing is recorded
+        return jsonify({'ok': True, 'results': []}), 200
+
+    results = run_batch(pairs, context)
+    history_ids = None
+    if data.get('record_history'):
+        rows = [DiffHistory(user_id=current_user.id, text1_name=p['name_a'], text2_name=p['name_b'],
+                            text1_content=p['a'], text2_content=p['b']) for p in pairs]
+        db.session.add_all(rows)
+        db.session.commit()
+    record_tool_usage('diff_checker')
+    if data.get('record_history'):
+        history_ids = [h.id for h in rows]
+    return jsonify({
+        'ok': True,
+        'results': [dict(r, id=p['id'], name_a=p['name_a'], name_b=p['name_b'],
+                         **({'history_id': history_ids[i]} if history_ids else {}))
+                    for i, (p, r) in enumerate(zip(pairs, results))],
+    }), 200
+
+@bp.route('/diff/intraline', methods=['POST'])
+@login_required
+def diff_intraline():
+    """Word-level highlighting for one removed/added line pair (POST body: {a, b})."""
+    data = request.json or {}
+    a_html, b_html = intraline_html(data.get('a', ''), data.get('b', ''))
+    return jsonify({'ok': True, 'a': a_html, 'b': b_html}), 200
+
+@bp.route('/result-cache/stats')
+@login_required
+def result_cache_stats():
+    """Hit/miss counters and sizes of this worker's tool result cache."""
+    return jsonify({'ok': True, 'stats': get_result_cache().stats()}), 200
+
+@bp.route('/usage-recorder/stats')
+@login_required
+def usage_recorder_stats():
+    """Queue depth, dropped events and flush latency of this worker's tool usage recorder."""
+    return jsonify({'ok': True, 'stats': get_usage_recorder().stats()}), 200
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_PREVIEW_CHARS = 500
+
+def _history_page(query, model, before=None, after=None, per_page=HISTORY_PAGE_SIZE):
+    """One page of a user's history, newest first, plus (newer, older) cursors.
+
+    Keyset pagination: a cursor is the id of the first/last row shown, and the next page continues
+    from that row's (timestamp, id) instead of an OFFSET, so deep pages cost the same as the first
+    one and rows inserted meanwhile do not shift the listing.
+    """
+    anchor_id = after or before
+    anchor_ts = None
+    if anchor_id:
+        anchor_ts = query.with_entities(model.timestamp).filter(model.id == anchor_id).scalar()
+    if anchor_ts is None:
+        after = before = None
+    if after:
+        query = query.filter(db.or_(model.timestamp > anchor_ts,
+                                    db.and_(model.timestamp == anchor_ts, model.id > anchor_id)))\
+            .order_by(model.timestamp.asc(), model.id.asc())
+    else:
+        if before:
+            query = query.filter(db.or_(model.timestamp < anchor_ts,
+                                        db.and_(model.timestamp == anchor_ts, model.id < anchor_id)))
+        query = query.order_by(model.timestamp.desc(), model.id.desc())
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if after:
+        rows.reverse()
+        newer = rows[0].id if has_more else None
+        older = rows[-1].id if rows else None
+    else:
+        newer = rows[0].id if before and rows else None
+        older = rows[-1].id if has_more else None
+    return rows, newer, older
 
 @bp.route('/diff/history')
 @login_required
 def diff_history():
-    history = DiffHistory.query.filter_by(user_id=current_user.id)\
-        .order_by(DiffHistory.timestamp.desc())\
-        .all()
+    query = DiffHistory.query.filter_by(user_id=current_user.id)\
+        .options(db.load_only(DiffHistory.id, DiffHistory.text1_name, DiffHistory.text2_name, DiffHistory.timestamp))
+    history, newer, older = _history_page(query, DiffHistory,
+                                          before=request.args.get('before', type=int),
+                                          after=request.args.get('after', type=int))
     return render_template('tools/diff_history.html', 
                          title='Diff History',
-                         history=history)
+                         history=history,
+                         newer=newer,
+                         older=older)
 
 @bp.route('/diff/history/<int:id>')
 @login_required
 def diff_history_detail(id):
     history = DiffHistory.query.filter_by(id=id, user_id=current_user.id).first_or_404()
+    diff_html, virtual_diff = _diff_view(history)
     return render_template('tools/diff_history_detail.html',
                          title='Diff History Detail',
-                         history=history)
+                         history=history,
+                         diff_html=diff_html,
+                         virtual_diff=virtual_diff)
+
+@bp.route('/diff/history/<int:id>/rows')
+@login_required
+def diff_history_rows(id):
+    """Rendered diff rows [start, start + count) as JSON, for pages showing large diffs in windows."""
+    history = DiffHistory.query.filter_by(id=id, user_id=current_user.id).first()
+    if not history:
+        return jsonify({'ok': False, 'error': 'History entry not found'}), 404
+    start = max(request.args.get('start', 0, type=int), 0)
+    count = min(max(request.args.get('count', DIFF_ROWS_CHUNK, type=int), 0), 5 * DIFF_ROWS_CHUNK)
+    diff = _history_diff_rows(history)
+    rows = list(render_diff_rows(diff.rows(start, start + count)))
+    return jsonify({'ok': True, 'total': len(diff), 'start': start, 'rows': rows}), 200
 
 @bp.route('/wp-db-compare')
 @login_required
@@ -199,15 +506,7 @@ def wp_db_compare_compare():
             'modified': [ {'key': k, 'a': a, 'b': b, 'diffs': diffs} for (k,a,b,diffs) in modified ]
         }
     save_session(session_id, session)
-    # record tool usage if available
-    try:
-        tool = Tool.query.filter_by(name='wp_db_compare').first()
-        if tool:
-            usage = ToolUsage(user_id=current_user.id, tool_id=tool.id)
-            db.session.add(usage)
-            db.session.commit()
-    except Exception:
-        pass
+    record_tool_usage('wp_db_compare')
     return redirect(url_for('tools.wp_db_compare_result', session_id=session_id))
 
 
@@ -351,20 +650,22 @@ def rule_card_formatter():
     form = RuleCardForm()
     result = None
     result_fmt = None
+    results = None
     if form.validate_on_submit():
         text = form.input_text.data or ''
         fmt = form.format_type.data or 'bulleted'
-        result = format_rulecard(text, fmt)
+        if fmt == 'all':
+            # one parse, every format; kept as JSON in the cache and in history
+            result = get_result_cache().get_or_compute(
+                cache_key('rule_card_formatter', (text,), {'format': fmt}),
+                lambda: json.dumps(format_rulecard_all(text)))
+            results = json.loads(result)
+        else:
+            result = get_result_cache().get_or_compute(
+                cache_key('rule_card_formatter', (text,), {'format': fmt}),
+                lambda: format_rulecard(text, fmt))
         result_fmt = fmt
-        # record usage
-        try:
-            tool = Tool.query.filter_by(name='rule_card_formatter').first()
-            if tool:
-                usage = ToolUsage(user_id=current_user.id, tool_id=tool.id)
-                db.session.add(usage)
-                db.session.commit()
-        except Exception:
-            pass
+        record_tool_usage('rule_card_formatter')
         # Save history for this formatted input
         try:
             from app.models import RuleCardHistory
@@ -373,21 +674,121 @@ def rule_card_formatter():
             db.session.commit()
         except Exception:
             pass
-    return render_template('tools/rule_card_formatter.html', form=form, result=result, result_fmt=result_fmt)
+    return render_template('tools/rule_card_formatter.html', form=form, result=result, result_fmt=result_fmt,
+                           results=results)
+
+@bp.route('/rule-card-formatter/preview', methods=['POST'])
+@login_required
+def rule_card_preview():
+    """Format while typing. Nothing is recorded: no usage, no history, no result cache.
+
+    Body: {"format", "text"} starts a preview session; {"format", "session", "version", "edits":
+    [{"start", "end", "lines"}]} replaces lines[start:end] of that session's text. A session this
+    worker does not have, or a version other than its current one, gets 409 with resync.
+    """
+    from app.tools.rulecard import RENDERERS
+    from app.tools.rulecard_preview import get_session, new_session
+    data = request.get_json(silent=True) or {}
+    fmt = data.get('format') or 'hierarchical'
+    if fmt not in RENDERERS:
+        return jsonify({'ok': False, 'error': f'Unknown format: {fmt}'}), 400
+    started = time.perf_counter()
+    session = get_session(str(data.get('session') or ''), current_user.id)
+    try:
+        if 'text' in data:
+            if not isinstance(data['text'], str):
+                raise ValueError('text must be a string')
+            if session is None:
+                session = new_session(current_user.id, data['text'])
+            else:
+                with session.lock:
+                    session.reset(data['text'])
+        elif session is None or data.get('version') != session.version:
+            return jsonify({'ok': False, 'resync': True}), 409
+        else:
+            with session.lock:
+                session.apply(data.get('edits') or [])
+        with session.lock:
+            result = session.render(fmt)
+            version = session.version
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    return jsonify(dict(result, ok=True, session=session.id, version=version, format=fmt,
+                        elapsed_ms=round((time.perf_counter() - started) * 1000, 2))), 200
+
+@bp.route('/rule-card-formatter/bulk', methods=['POST'])
+@login_required
+def rule_card_bulk():
+    """Format many cards in one request: one card per uploaded file, zip/tar archives are expanded.
+
+    Form fields: files (repeatable), format, output. output=ndjson (the default) streams one JSON
+    line per card and a final summary line; output=zip returns one output file per card. Both
+    report cards per second (the summary line, or X-Cards-* response headers).
+    """
+    import tempfile
+    from app.tools.rulecard_bulk import FORMATS, BulkStats, format_cards, iter_ndjson, iter_upload_cards, write_zip
+    uploads = [f for f in request.files.getlist('files') if f and f.filename]
+    fmt = request.form.get('format') or 'hierarchical'
+    output = request.form.get('output') or 'ndjson'
+    if not uploads:
+        return jsonify({'ok': False, 'error': 'Upload one or more card files or archives as "files"'}), 400
+    if fmt not in FORMATS:
+        return jsonify({'ok': False, 'error': f'Unknown format: {fmt}'}), 400
+    if output not in ('ndjson', 'zip'):
+        return jsonify({'ok': False, 'error': 'output must be ndjson or zip'}), 400
+    record_tool_usage('rule_card_formatter')
+
+    stats = BulkStats()
+    results = format_cards(iter_upload_cards(uploads), fmt)
+    if output == 'zip':
+        buf = tempfile.TemporaryFile()
+        write_zip(results, buf, fmt, stats)
+        buf.seek(0)
+        resp = send_file(buf, mimetype='application/zip', as_attachment=True, download_name=f'rulecards-{fmt}.zip')
+        resp.headers['X-Cards'] = str(stats.cards)
+        resp.headers['X-Cards-Failed'] = str(stats.errors)
+        resp.headers['X-Cards-Per-Second'] = f'{stats.cards_per_second:.1f}'
+        return resp
+    return Response(stream_with_context(iter_ndjson(results, fmt, stats)), mimetype='application/x-ndjson')
 
 @bp.route('/rule-card-formatter/history')
 @login_required
 def rule_card_history():
     from app.models import RuleCardHistory
-    history = RuleCardHistory.query.filter_by(user_id=current_user.id).order_by(RuleCardHistory.timestamp.desc()).all()
-    return render_template('tools/rule_card_history.html', title='Rule Card History', history=history)
+    query = RuleCardHistory.query.filter_by(user_id=current_user.id).options(
+        db.with_expression(RuleCardHistory.result_preview,
+                           db.func.substr(RuleCardHistory.result_text, 1, HISTORY_PREVIEW_CHARS)))
+    history, newer, older = _history_page(query, RuleCardHistory,
+                                          before=request.args.get('before', type=int),
+                                          after=request.args.get('after', type=int))
+    return render_template('tools/rule_card_history.html', title='Rule Card History', history=history,
+                           newer=newer, older=older)
 
 @bp.route('/rule-card-formatter/history/<int:id>')
 @login_required
 def rule_card_history_detail(id):
     from app.models import RuleCardHistory
-    h = RuleCardHistory.query.filter_by(id=id, user_id=current_user.id).first_or_404()
-    return render_template('tools/rule_card_history_detail.html', title='Rule Card History Detail', history=h)
+    h = RuleCardHistory.query.filter_by(id=id, user_id=current_user.id).options(db.undefer('*')).first_or_404()
+    results = json.loads(h.result_text) if h.format_type == 'all' else None
+    return render_template('tools/rule_card_history_detail.html', title='Rule Card History Detail', history=h,
+                           results=results)
+
+@bp.route('/history/search')
+@login_required
+def history_search():
+    """Search the user's diff and rule card history; ?q=&kind=all|diff|rule_card&page="""
+    from app.history_search import SEARCH_KINDS, fts_enabled, search_history
+    q = request.args.get('q', '').strip()
+    kind = request.args.get('kind', 'all')
+    if kind not in SEARCH_KINDS:
+        kind = 'all'
+    page = max(request.args.get('page', 1, type=int), 1)
+    started = time.perf_counter()
+    results, has_more = search_history(current_user.id, q, SEARCH_KINDS if kind == 'all' else (kind,), page) \
+        if q else ([], False)
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    return render_template('tools/history_search.html', title='Search History', q=q, kind=kind, page=page,
+                           results=results, has_more=has_more, elapsed_ms=elapsed_ms, ranked=fts_enabled())
 
 @bp.route('/mongo-db-compare')
 @login_required
@@ -437,7 +838,9 @@ def mongo_db_compare_collections():
 @login_required
 def mongo_db_compare_compare():
     from app.tools.forms import MongoCompareForm
-    from app.tools.mongo_db_compare import connect, list_collections, compare_collections, save_session
+    from app.tools.mongo_db_compare import connect, list_collections, compare_collections, save_session, remember_sources, \
+        parse_filter, build_projection, sample_collections, incremental_compare, load_session
+    from bson.json_util import dumps as bson_dumps
     form = MongoCompareForm()
     # form now expected to provide uri_a, uri_b, db_a, db_b, collections string
     if not form.validate_on_submit():
@@ -453,9 +856,52 @@ def mongo_db_compare_compare():
         limit = int(form.doc_limit.data)
     except Exception:
         limit = 1000
+    mode = form.mode.data or 'full'
+    try:
+        sample_size = max(1, int(form.sample_size.data))
+    except Exception:
+        sample_size = 1000
+    watermark_field = (form.watermark_field.data or '').strip() or '_id'
+    try:
+        partitions = max(1, int(form.partitions.data))
+    except Exception:
+        partitions = 1
+    try:
+        full_every = float(form.full_every_hours.data)
+    except Exception:
+        full_every = 24.0
+
+    # Incremental re-compare against a previous session
+    base = None
+    base_id = (form.base_session.data or '').strip()
+    if base_id and mode != 'sample':
+        try:
+            base = load_session(base_id)
+        except FileNotFoundError:
+            flash('Previous session not found', 'danger')
+            return redirect(url_for('tools.mongo_db_compare_index'))
+        db_a, db_b = base['db_a'], base['db_b']
+        last_full = base.get('last_full_at')
+        # a scheduled full reconciliation catches deletes that watermarks cannot see
+        if not isinstance(last_full, datetime) or datetime.utcnow() - last_full > timedelta(hours=full_every):
+            base = None
 
     collections = [c.strip() for c in coll_input.split(',') if c.strip()] if coll_input else None
 
+    # Optional query filter and field projection, pushed down to both servers
+    try:
+        common_filter = parse_filter(form.query_filter.data)
+        per_coll_filters = parse_filter(form.collection_filters.data)
+        for name, flt in per_coll_filters.items():
+            if not isinstance(flt, dict):
+                raise ValueError(f'Filter for collection {name} must be a JSON object')
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('tools.mongo_db_compare_index'))
+    include = [f.strip() for f in (form.include_fields.data or '').split(',') if f.strip()]
+    exclude = [f.strip() for f in (form.exclude_fields.data or '').split(',') if f.strip()]
+    projection = build_projection(include, exclude)
+
     # Connect to both
     try:
         client_a = connect(uri_a)
@@ -474,22 +920,28 @@ def mongo_db_compare_compare():
         cols_b = set(list_collections(client_b, db_b))
         collections = sorted(list(cols_a & cols_b))
 
-    session = compare_collections(client_a, client_b, db_a, db_b, collections, limit=limit)
+    filters = {c: per_coll_filters.get(c, common_filter) for c in collections}
+    projections = {c: projection for c in collections}
+    if mode == 'sample':
+        session = sample_collections(client_a, client_b, db_a, db_b, collections, sample_size=sample_size,
+                                     filters=filters, projections=projections)
+    elif base is not None:
+        session = incremental_compare(client_a, client_b, base, collections, limit=limit,
+                                      filters=filters, projections=projections)
+    else:
+        session = compare_collections(client_a, client_b, db_a, db_b, collections, limit=limit,
+                                      filters=filters, projections=projections, watermark_field=watermark_field,
+                                      partitions=partitions, sources=(uri_a, uri_b))
     import uuid
     session_id = str(uuid.uuid4())
     session['id'] = session_id
-    session['meta'] = {'db_a': db_a, 'db_b': db_b, 'collections': collections, 'limit': limit}
+    session['meta'] = {'db_a': db_a, 'db_b': db_b, 'collections': collections, 'limit': limit,
+                       'mode': mode, 'sample_size': sample_size, 'incremental': base is not None,
+                       'filters': {c: bson_dumps(f) for c, f in filters.items() if f}, 'projection': projection}
     save_session(session_id, session)
+    remember_sources(session_id, uri_a, uri_b)
 
-    # record usage if tool exists
-    try:
-        tool = Tool.query.filter_by(name='mongo_db_compare').first()
-        if tool:
-            usage = ToolUsage(user_id=current_user.id, tool_id=tool.id)
-            db.session.add(usage)
-            db.session.commit()
-    except Exception:
-        pass
+    record_tool_usage('mongo_db_compare')
 
     return redirect(url_for('tools.mongo_db_compare_result', session_id=session_id))
 
@@ -499,7 +951,7 @@ def mongo_db_compare_compare():
 def mongo_db_compare_result(session_id):
     from app.tools.mongo_db_compare import load_session
     try:
-        session = load_session(session_id)
+        session = load_session(session_id, summary_only=True)
     except FileNotFoundError:
         flash('Session not found', 'danger')
         return redirect(url_for('tools.mongo_db_compare_index'))
@@ -510,10 +962,127 @@ def mongo_db_compare_result(session_id):
 @login_required
 def mongo_db_compare_preview(session_id):
     # Simple preview endpoint that returns generated pymongo bulk op code for download or inspection
-    from app.tools.mongo_db_compare import load_session
+    from app.tools.mongo_db_compare import load_session, load_collection
+    coll = request.args.get('coll')
     try:
-        session = load_session(session_id)
+        if coll:
+            # decode only the requested collection's section
+            session, info = load_collection(session_id, coll)
+            session['collections'] = {coll: info}
+        else:
+            session = load_session(session_id)
     except FileNotFoundError:
         return jsonify({'error': 'session not found'}), 404
+    except KeyError:
+        return jsonify({'error': 'collection not found in session'}), 404
     # For now return JSON of session (preview shown in template)
     return render_template('tools/mongo_db_compare/preview.html', session=session)
+
+
+@bp.route('/mongo-db-compare/document/<session_id>/<coll>/<path:doc_id>')
+@login_required
+def mongo_db_compare_document(session_id, coll, doc_id):
+    """Return the full A and B documents for one modified entry (loaded lazily from the sources)."""
+    from app.tools.mongo_db_compare import load_collection, fetch_documents
+    try:
+        session, info = load_collection(session_id, coll)
+    except (FileNotFoundError, KeyError):
+        return jsonify({'ok': False, 'error': 'session not found'}), 404
+    entry = next((m for m in info.get('modified', []) if m.get('_id') == doc_id), None)
+    if entry is None:
+        return jsonify({'ok': False, 'error': 'document not found in session'}), 404
+    try:
+        docs = fetch_documents(session_id, session, coll, entry['id_ext'])
+    except KeyError:
+        return jsonify({'ok': False, 'error': 'Sources for this session are no longer available; re-run the compare'}), 410
+    except Exception as e:
+        return jsonify({'ok': False, 'error': str(e)}), 200
+    return jsonify({'ok': True, 'a': docs['a'], 'b': docs['b']}), 200
+
+
+def _mongo_plan_batches(session_id):
+    """Load a session and build its sync plan batch iterator from the request args.
+
+    Returns (session, batches). Raises LookupError with a user-facing message when the session or
+    its sources are gone, and ValueError when the compare did not see every document.
+    """
+    from app.tools.mongo_db_compare import (load_session, get_sources, connect, iter_plan, incomplete_collections,
+                                            PLAN_BATCH_SIZE)
+    try:
+        session = load_session(session_id)
+    except FileNotFoundError:
+        raise LookupError('session not found')
+    if session.get('mode') == 'sample':
+        raise LookupError('Sampling sessions only hold estimates; run an exhaustive compare to build a plan')
+    try:
+        uri_a, uri_b = get_sources(session_id)
+    except KeyError:
+        raise LookupError('Sources for this session are no longer available; re-run the compare')
+    args = request.values
+    coll = args.get('coll')
+    infos = session['collections'] if not coll else {coll: session['collections'].get(coll, {})}
+    incomplete = incomplete_collections(session, infos)
+    if incomplete:
+        # added/removed sets from a capped or failed scan would insert and delete the wrong documents
+        raise ValueError('The compare did not scan every document of {}; re-run it with document limit 0 '
+                         'to build a sync plan'.format(', '.join(incomplete)))
+    try:
+        batch_size = max(1, int(args.get('batch_size', PLAN_BATCH_SIZE)))
+    except ValueError:
+        batch_size = PLAN_BATCH_SIZE
+    ordered = args.get('ordered') in ('1', 'true', 'on')
+    update_mode = 'set' if args.get('update') == 'set' else 'replace'
+
+    def batches():
+        # the clients live as long as the plan is being consumed and are closed when it ends or is abandoned
+        with connect(uri_a) as client_a, connect(uri_b) as client_b:
+            yield from iter_plan(client_a, client_b, session, infos,
+                                 batch_size=batch_size, ordered=ordered, update_mode=update_mode)
+    return session, batches()
+
+
+@bp.route('/mongo-db-compare/plan/<session_id>')
+@login_required
+def mongo_db_compare_plan(session_id):
+    """Stream a bulk_write sync plan (B := A) as NDJSON or as a runnable pymongo script."""
+    from app.tools.mongo_db_compare import render_plan_ndjson, render_plan_script
+    try:
+        session, batches = _mongo_plan_batches(session_id)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    if request.args.get('format') == 'py':
+        body = render_plan_script(batches, session)
+        mimetype, ext = 'text/x-python', 'py'
+    else:
+        body = render_plan_ndjson(batches)
+        mimetype, ext = 'application/x-ndjson', 'ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=mongo_plan_{session_id}.{ext}'})
+
+
+@bp.route('/mongo-db-compare/plan/<session_id>/execute', methods=['POST'])
+@login_required
+def mongo_db_compare_plan_execute(session_id):
+    """Apply the sync plan to a target (dry run unless confirm is set) and report throughput."""
+    from app.tools.mongo_db_compare import connect, execute_plan
+    target_uri = request.form.get('target_uri', '').strip()
+    target_db = request.form.get('target_db', '').strip()
+    if not target_uri or not target_db:
+        return jsonify({'ok': False, 'error': 'Missing target_uri or target_db'}), 400
+    dry_run = request.form.get('confirm') not in ('1', 'true', 'on')
+    try:
+        session, batches = _mongo_plan_batches(session_id)
+    except LookupError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 409
+    try:
+        with connect(target_uri) as client:
+            stats = execute_plan(client, target_db, batches, dry_run=dry_run)
+    except Exception as e:
+        return jsonify({'ok': False, 'error': str(e)}), 200
+    finally:
+        batches.close()
+    return jsonify({'ok': True, 'stats': stats}), 200
@@ -1,6 +1,7 @@
 import re
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 import html
+import json
 
 # Simple parser and formatter for rule card entries.
 # Input is free-form lines; we attempt to detect sections, bullets, and IDs (hex hashes at end).
@@ -8,28 +9,187 @@ import html
 ID_RE = re.compile(r"\b[0-9a-f]{6,40}\b", re.IGNORECASE)
 
 
-def parse_lines(text: str) -> List[str]:
-    # Normalize line endings and split; remove empty lines at ends
-    raw_lines = [ln.rstrip() for ln in text.replace('\r', '').split('\n')]
-    lines = []
-    for ln in raw_lines:
-        # preserve leading tabs (used for explicit hierarchy input)
-        mtabs = re.match(r'^(\t*)', ln)
-        tabs = mtabs.group(1) if mtabs else ''
-        body = ln[len(tabs):]
-        # remove common bullet markers and list prefixes (•, -, *, ·, digits.) from body
-        body = re.sub(r"^([\u2022\u00B7\-\*]|\d+\.)\s+", "", body)
-        # also remove leading bullet characters with no space
-        body = re.sub(r"^[\u2022\u00B7\-\*]+", "", body).strip()
-        # collapse multiple spaces in body
-        body = re.sub(r"\s+", " ", body)
-        lines.append(tabs + body.rstrip())
+class Rule:
+    __slots__ = ('text', 'id')
+
+    def __init__(self, text: str, id: str = ''):
+        self.text = text
+        self.id = id
+
+
+class Card:
+    __slots__ = ('title', 'rules')
+
+    def __init__(self, title: Optional[str]):
+        self.title = title
+        self.rules: List[Rule] = []
+
+
+class Category:
+    __slots__ = ('title', 'cards')
+
+    def __init__(self, title: Optional[str]):
+        self.title = title
+        self.cards = NodeIndex(Card)
+
+
+class Board:
+    __slots__ = ('title', 'categories')
+
+    def __init__(self, title: Optional[str]):
+        self.title = title
+        self.categories = NodeIndex(Category)
+
+
+class NodeIndex:
+    """One level of the board -> category -> card tree: nodes in insertion order plus a title index.
+
+    find_or_create() returns the first node with a title, as scanning the list would, in O(1).
+    """
+    __slots__ = ('nodes', 'by_title', 'counts', 'factory')
+
+    def __init__(self, factory):
+        self.nodes = []
+        self.by_title = {}
+        # titles can repeat after retitle(); the counts tell when a rename needs a rescan
+        self.counts: Dict[Optional[str], int] = {}
+        self.factory = factory
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def last(self):
+        return self.nodes[-1] if self.nodes else None
+
+    def find_or_create(self, title: Optional[str]):
+        node = self.by_title.get(title)
+        if node is None:
+            node = self.factory(title)
+            self.nodes.append(node)
+            self.by_title[title] = node
+            self.counts[title] = self.counts.get(title, 0) + 1
+        return node
+
+    def retitle(self, node, title: Optional[str]) -> None:
+        """Rename a node, keeping the index pointing at the first node of each title."""
+        old = node.title
+        node.title = title
+        self.counts[old] -= 1
+        self.counts[title] = self.counts.get(title, 0) + 1
+        if self.by_title.get(old) is node:
+            del self.by_title[old]
+            if self.counts[old]:
+                self.by_title[old] = next(n for n in self.nodes if n.title == old)
+        current = self.by_title.get(title)
+        if current is None or (current is not node and self.nodes.index(node) < self.nodes.index(current)):
+            self.by_title[title] = node
+
+
+# One pass over each input line: leading tabs, an optional list marker ('- ', '1. ', '•', ...),
+# then the body. Matched against the right-stripped line.
+_LINE_RE = re.compile(r'(\t*)((?:(?:[\u2022\u00B7\-\*]|\d+\.)\s+)?[\u2022\u00B7\-\*]*)(.*)', re.DOTALL)
+# a line that is only an ID, optionally after an arrow ('f65ef7e8', '-> f65ef7e8')
+_ID_ONLY_RE = re.compile(r'(?:->\s*)?([0-9a-fA-F]{6,40})\s*$')
+# '-> id' at the end of a line
+_ARROW_ID_RE = re.compile(r'->\s*([0-9a-f]{6,40})$', re.IGNORECASE)
+_BOARD_BRACKET_RE = re.compile(r'\[.+\]')
+_BOARD_WORD_RE = re.compile(r'Screen|Panel|Dashboard|Menu', re.IGNORECASE)
+
+
+class Token:
+    """One normalized input line.
+
+    depth is the number of leading tabs, bullet the list marker that was removed and text the
+    body with whitespace collapsed. segments holds the '->'-separated parts (None when the line
+    has no arrow). id is a trailing '-> id' (or the whole line when id_only), and label is text
+    without it.
+    """
+    __slots__ = ('depth', 'bullet', 'text', 'segments', 'id', 'id_only', 'label', '_path')
+
+    def __init__(self, depth: int, text: str, bullet: str = ''):
+        self.depth = depth
+        self.bullet = bullet
+        self.text = text
+        self.segments = [p.strip() for p in text.split('->') if p.strip()] if '->' in text else None
+        self.id = ''
+        self.id_only = False
+        self.label = text
+        self._path = None
+        m = _ID_ONLY_RE.match(text)
+        if m:
+            self.id = m.group(1)
+            self.id_only = True
+            self.label = ''
+        elif self.segments is not None:
+            m = _ARROW_ID_RE.search(text)
+            if m:
+                self.id = m.group(1)
+                self.label = text[:m.start()].strip()
+
+    @property
+    def line(self) -> str:
+        return '\t' * self.depth + self.text
+
+    def path(self) -> Tuple[List[str], str, Optional[int]]:
+        """For an arrow line in path layout: (parts, trailing ID, index of the board part or None).
+
+        A last part that is only an ID is removed from parts. A line made only of arrows gives
+        ([], '', None).
+        """
+        if self._path is None:
+            parts = self.segments
+            if not parts:
+                # a line of nothing but arrows
+                self._path = ([], '', None)
+                return self._path
+            # try to extract ID from the last part if present
+            m = ID_RE.search(parts[-1])
+            rule_id = m.group(0) if m else ''
+            # If the last part is just an ID token (flat path like 'A -> B -> C -> id'),
+            # remove that token from parts so it can be attached to the preceding element
+            if rule_id and ID_RE.fullmatch(parts[-1]):
+                parts = parts[:-1]
+            # Find a board part if present (prefer part that contains brackets)
+            board_index = next((idx for idx, p in enumerate(parts) if _BOARD_BRACKET_RE.search(p)), None)
+            # otherwise a first part naming a Screen, Panel, ... is the board
+            if board_index is None and parts and _BOARD_WORD_RE.search(parts[0]):
+                board_index = 0
+            self._path = (parts, rule_id, board_index)
+        return self._path
+
+
+def lex_line(line: str) -> Token:
+    tabs, bullet, body = _LINE_RE.match(line.rstrip()).groups()
+    return Token(len(tabs), ' '.join(body.split()), bullet.strip())
+
+
+def tokenize(text: str) -> List[Token]:
+    """Split raw input into tokens, removing list markers and leading/trailing blank lines."""
+    tokens = [lex_line(ln) for ln in text.replace('\r', '').split('\n')]
     # drop leading/trailing empty lines
-    while lines and lines[0].strip() == '':
-        lines.pop(0)
-    while lines and lines[-1].strip() == '':
-        lines.pop()
-    return lines
+    start, stop = 0, len(tokens)
+    while start < stop and not tokens[start].text:
+        start += 1
+    while stop > start and not tokens[stop - 1].text:
+        stop -= 1
+    return tokens[start:stop]
+
+
+def tokens_from_lines(lines: List[str]) -> List[Token]:
+    """Tokens for lines that are already normalized (the output of parse_lines)."""
+    tokens = []
+    for ln in lines:
+        body = ln.lstrip('\t')
+        tokens.append(Token(len(ln) - len(body), body.strip()))
+    return tokens
+
+
+def parse_lines(text: str) -> List[str]:
+    # Normalized lines: leading tabs kept, list markers removed, whitespace collapsed
+    return [tok.line for tok in tokenize(text)]
 
 
 def format_bulleted(lines: List[str]) -> str:
@@ -43,178 +203,113 @@ def format_bulleted(lines: List[str]) -> str:
     return '\n'.join(out)
 
 
-def format_indented(lines: List[str]) -> str:
-    # kept for backward compatibility, alias to hierarchical
-    return format_hierarchical(lines)
-
-
-def format_hierarchical(lines: List[str]) -> str:
-    """Parse lines into boards -> categories -> cards -> rules and render with tabs.
+def build_tree(tokens: List[Token], indented: Optional[bool] = None) -> NodeIndex:
+    """Parse tokens into boards -> categories -> cards -> rules.
 
     Improved logic:
-    - For each input line, split on '->' into parts.
+    - For each input line, take its '->' parts (Token.segments).
     - Map left-to-right: if a part contains [brackets], treat it as a board title.
       Otherwise, map parts to board/category/card/rule depending on availability.
     - Reuse existing boards/categories/cards when titles match (merge nodes) so multiple lines populate the same hierarchy.
     """
 
-    def find_or_create_board(boards, title):
-        for b in boards:
-            if b.get('title') == title:
-                return b
-        nb = {'title': title, 'categories': []}
-        boards.append(nb)
-        return nb
-
-    def find_or_create_category(board, title):
-        for c in board['categories']:
-            if c.get('title') == title:
-                return c
-        nc = {'title': title, 'cards': []}
-        board['categories'].append(nc)
-        return nc
-
-    def find_or_create_card(category, title):
-        for c in category['cards']:
-            if c.get('title') == title:
-                return c
-        nc = {'title': title, 'rules': []}
-        category['cards'].append(nc)
-        return nc
-
-    boards = []
+    boards = NodeIndex(Board)
     # detect if input uses explicit tabs
-    uses_tabs = any(l.startswith('\t') for l in lines)
+    uses_tabs = any(tok.depth for tok in tokens) if indented is None else indented
     if uses_tabs:
         # indentation-based parsing
         current_board = None
         current_cat = None
         current_card = None
         last_rule = None
-        for ln in lines:
-            if not ln.strip():
+        for tok in tokens:
+            if not tok.text:
                 continue
-            tabs = len(re.match(r'^(\t*)', ln).group(1))
-            text = ln.lstrip('\t').strip()
+            tabs = tok.depth
 
-            # detect lines that are only an ID or an arrow + ID (e.g. '-> f65ef7e8' or 'f65ef7e8')
-            id_only_match = re.match(r'^(?:->\s*)?([0-9a-fA-F]{6,40})\s*$', text)
-            if id_only_match:
-                id_val = id_only_match.group(1)
+            # lines that are only an ID or an arrow + ID (e.g. '-> f65ef7e8' or 'f65ef7e8')
+            if tok.id_only:
                 # attach to the last parsed rule if present
                 if last_rule is not None:
-                    last_rule['id'] = id_val
+                    last_rule.id = tok.id
                 elif current_card is not None:
                     # otherwise attach to the current card title
-                    current_card['title'] = (current_card.get('title') or '') + ' -> ' + id_val
+                    current_cat.cards.retitle(current_card, (current_card.title or '') + ' -> ' + tok.id)
                 # consumed this line
                 continue
 
-            # Extract inline ID at end of line if present
-            inline_m = re.search(r'->\s*([0-9a-f]{6,40})$', text, re.IGNORECASE)
-            inline_id = ''
-            if inline_m:
-                inline_id = inline_m.group(1)
-                # remove trailing '-> id' from text
-                text = re.sub(r'->\s*' + re.escape(inline_id) + r'\s*$', '', text).strip()
+            # text without its trailing '-> id'
+            text = tok.label
+            inline_id = tok.id
 
             if tabs == 0:
-                current_board = find_or_create_board(boards, text)
+                current_board = boards.find_or_create(text)
                 current_cat = None
                 current_card = None
                 last_rule = None
                 continue
 
             if current_board is None:
-                current_board = find_or_create_board(boards, None)
+                current_board = boards.find_or_create(None)
 
             if tabs == 1:
-                current_cat = find_or_create_category(current_board, text)
+                current_cat = current_board.categories.find_or_create(text)
                 current_card = None
                 last_rule = None
                 continue
 
             if tabs == 2:
                 # If the line contains '->', treat it as a rule under the current category/card.
-                if '->' in ln:
+                if tok.segments is not None:
                     if current_cat is None:
-                        current_cat = find_or_create_category(current_board, None)
+                        current_cat = current_board.categories.find_or_create(None)
                     if current_card is None:
-                        current_card = find_or_create_card(current_cat, None)
+                        current_card = current_cat.cards.find_or_create(None)
                     # text already has inline id removed; use it as rule text
-                    current_card['rules'].append({'text': text, 'id': inline_id})
-                    last_rule = current_card['rules'][-1]
+                    last_rule = Rule(text, inline_id)
+                    current_card.rules.append(last_rule)
                 else:
                     # card title; if inline_id present, attach to title
                     if current_cat is None:
-                        current_cat = find_or_create_category(current_board, None)
-                    current_card = find_or_create_card(current_cat, text)
+                        current_cat = current_board.categories.find_or_create(None)
+                    current_card = current_cat.cards.find_or_create(text)
                     if inline_id:
-                        current_card['title'] = (current_card.get('title') or '') + ' -> ' + inline_id
+                        current_cat.cards.retitle(current_card, (current_card.title or '') + ' -> ' + inline_id)
                     last_rule = None
                 continue
 
             # tabs >= 3: treat as rule under current card
             if tabs >= 3:
                 if current_cat is None:
-                    current_cat = find_or_create_category(current_board, None)
+                    current_cat = current_board.categories.find_or_create(None)
                 if current_card is None:
-                    current_card = find_or_create_card(current_cat, None)
-                current_card['rules'].append({'text': text, 'id': inline_id})
-                last_rule = current_card['rules'][-1]
+                    current_card = current_cat.cards.find_or_create(None)
+                last_rule = Rule(text, inline_id)
+                current_card.rules.append(last_rule)
                 continue
 
         # rendering below will use boards list
         pass
     else:
         # path-based parsing (existing logic)
-        i = 0
-        L = len(lines)
-
-        # First, pre-process to remove empty lines already done by parse_lines
-        while i < L:
-            s = lines[i].strip()
-            i += 1
+        for tok in tokens:
+            s = tok.text
             if not s:
                 continue
 
             # If the line contains '->', treat as path that may include board/category/card/rule
-            if '->' in s:
-                parts = [p.strip() for p in s.split('->') if p.strip()]
-                # try to extract ID from the last part if present
-                last_part = parts[-1]
-                m = ID_RE.search(last_part)
-                rule_id = m.group(0) if m else ''
-                # If the last part is just an ID token (flat path like 'A -> B -> C -> id'),
-                # remove that token from parts so it can be attached to the preceding element
-                if rule_id and ID_RE.fullmatch(last_part):
-                    parts = parts[:-1]
-                     
-                # Find a board part if present (prefer part that contains brackets)
-                board_title = None
-                board_index = None
-                for idx, p in enumerate(parts):
-                    if re.search(r"\[.+\]", p):
-                        board_title = p
-                        board_index = idx
-                        break
-                # If the first part looks like a board (starts with capital words and contains bracket), prefer it
-                if board_title is None and parts:
-                    # If the first part contains the word 'Screen' or 'Panel' or contains brackets, treat as board
-                    if re.search(r"Screen|Panel|Dashboard|Menu", parts[0], re.IGNORECASE) or re.search(r"\[.+\]", parts[0]):
-                        board_title = parts[0]
-                        board_index = 0
-
-                if board_title is None:
+            if tok.segments is not None:
+                parts, rule_id, board_index = tok.path()
+                if board_index is None:
                     # fallback: use existing last board or create an unnamed board
                     if boards:
-                        board = boards[-1]
+                        board = boards.last()
                     else:
-                        board = find_or_create_board(boards, None)
+                        board = boards.find_or_create(None)
                     start_idx = 0
                 else:
-                    board = find_or_create_board(boards, board_title)
-                    start_idx = board_index + 1 if board_index is not None else 1
+                    board = boards.find_or_create(parts[board_index])
+                    start_idx = board_index + 1
 
                 # Map remaining parts to category, card, and rule text
                 remaining = parts[start_idx:]
@@ -225,12 +320,12 @@ def format_hierarchical(lines: List[str]) -> str:
 
                 # category = remaining[0] (if exists)
                 cat_title = remaining[0] if len(remaining) >= 1 else None
-                category = find_or_create_category(board, cat_title)
+                category = board.categories.find_or_create(cat_title)
 
                 # card = remaining[1] if exists
                 if len(remaining) >= 2:
                     card_title = remaining[1]
-                    card = find_or_create_card(category, card_title)
+                    card = category.cards.find_or_create(card_title)
                     # rule text is remaining[2:] joined
                     if len(remaining) >= 3:
                         rule_text = ' -> '.join(remaining[2:])
@@ -238,119 +333,323 @@ def format_hierarchical(lines: List[str]) -> str:
                         rule_text = ''
                 else:
                     # no explicit card; create anonymous card to hold rule
-                    card = find_or_create_card(category, None)
+                    card = category.cards.find_or_create(None)
                     rule_text = remaining[1] if len(remaining) >= 2 else ''
 
                 # attach rule
                 if rule_text == '':
                     # if rule_text is empty but we detected a trailing id, attach the id to the card title
                     if rule_id:
-                        card['title'] = (card.get('title') or '') + ' -> ' + rule_id
+                        category.cards.retitle(card, (card.title or '') + ' -> ' + rule_id)
                     else:
                         # fallback: try to derive a sensible rule_text from the last part
                         rt = parts[-1]
                         if not ID_RE.fullmatch(rt):
-                            card['rules'].append({'text': rt, 'id': ''})
+                            card.rules.append(Rule(rt))
                 else:
                     # strip any trailing id from rule_text
                     if rule_id and rule_text.endswith(rule_id):
                         rule_text = rule_text[: -len(rule_id)].rstrip(' -')
-                    card['rules'].append({'text': rule_text, 'id': rule_id})
+                    card.rules.append(Rule(rule_text, rule_id))
                 continue
 
             # If line does not contain '->', it is likely a board or category/card title
-            if re.search(r"\[.+\]", s):
+            if _BOARD_BRACKET_RE.search(s):
                 # board line
-                find_or_create_board(boards, s)
+                boards.find_or_create(s)
                 continue
 
             # Non-arrow, non-board lines: try to attach to last board as category or card
             if not boards:
-                board = find_or_create_board(boards, None)
+                board = boards.find_or_create(None)
             else:
-                board = boards[-1]
+                board = boards.last()
 
             # If last category missing or last category already has cards, create new category
-            if not board['categories'] or (board['categories'] and board['categories'][-1].get('cards')):
-                cat = find_or_create_category(board, s)
+            if not board.categories or board.categories.last().cards:
+                cat = board.categories.find_or_create(s)
             else:
                 # otherwise treat as card title under last category
-                cat = board['categories'][-1]
-                find_or_create_card(cat, s)
+                cat = board.categories.last()
+                cat.cards.find_or_create(s)
 
-    # Render with tabs: Board\n\tCategory\n\t\tCard\n\t\t\tRule -> ID
-    out = []
-    for b in boards:
-        if b.get('title'):
-            out.append(b['title'])
-        for cat in b.get('categories', []):
-            if cat.get('title'):
-                out.append('\t' + cat['title'])
-            for card in cat.get('cards', []):
-                if card.get('title'):
-                    out.append('\t\t' + card['title'])
-                for rule in card.get('rules', []):
-                    if rule.get('id'):
-                        out.append('\t\t\t' + rule['text'] + ' -> ' + rule['id'])
-                    else:
-                        out.append('\t\t\t' + rule['text'])
-        out.append('')
+    return boards
 
-    while out and out[-1].strip() == '':
-        out.pop()
-    return '\n'.join(out)
 
+def board_groups(tokens: List[Token], indented: Optional[bool] = None) -> Dict[Optional[str], List[Token]]:
+    """Tokens split by the board build_tree() puts them in, in board order.
+
+    Lines only ever change their own board, so build_tree(group, indented) for one group gives
+    the same board as building the whole input; indented must be that of the whole input.
+    """
+    if indented is None:
+        indented = any(tok.depth for tok in tokens)
+    groups: Dict[Optional[str], List[Token]] = {}
+    key = None
+    last = None  # path layout: the board created most recently
+    for tok in tokens:
+        if not tok.text:
+            continue
+        if indented:
+            if tok.depth == 0 and not tok.id_only:
+                key = tok.label
+            elif tok.id_only and key not in groups:
+                # an ID with nothing before it to attach to
+                continue
+        elif tok.segments is not None:
+            parts, _, board_index = tok.path()
+            key = parts[board_index] if board_index is not None else last
+        elif _BOARD_BRACKET_RE.search(tok.text):
+            key = tok.text
+        else:
+            key = last
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = []
+            last = key
+        group.append(tok)
+    return groups
 
-def format_jira_html(lines: List[str]) -> str:
-    """Return HTML suitable for pasting into Jira (IDs wrapped in <strong>), preserving indentation.
 
-    Converts the hierarchical plain-text output into HTML by replacing leading tabs with
-    visual indentation and wrapping detected IDs with <strong> tags. Uses block-level
-    elements and CSS-based padding for responsive wrapping rather than non-breaking spaces.
+class RuleCardDoc:
+    """A rule card parsed once: the input tokens and the board tree built from them.
+
+    Every output format is a renderer over this object (see RENDERERS), so producing several
+    formats of the same input costs one parse. The tree is built on first use; the bulleted
+    format only needs the lines.
     """
-    # helper: insert <wbr> into long uninterrupted tokens so browsers and Jira can wrap
-    def insert_wbr(s: str, maxlen: int = 80) -> str:
-        parts = s.split(' ')
-        outp = []
-        for p in parts:
-            if len(p) > maxlen:
-                # chunk the token inserting <wbr>
-                chunks = [p[i:i+maxlen] for i in range(0, len(p), maxlen)]
-                outp.append('<wbr>'.join(chunks))
-            else:
-                outp.append(p)
-        return ' '.join(outp)
-
-    # Produce hierarchical plain text first (reuses existing logic)
-    hier = format_hierarchical(lines)
-    out_lines = []
-    for ln in hier.splitlines():
-        # count leading tabs to compute indentation
-        mt = re.match(r'^(\t*)', ln)
-        tabs = len(mt.group(1)) if mt else 0
-        content = ln.lstrip('\t')
-        # escape HTML special chars in content
-        esc = html.escape(content)
-        # wrap trailing IDs with <strong>
-        esc = re.sub(r'->\s*([0-9a-f]{6,40})', r'-> <strong>\1</strong>', esc, flags=re.IGNORECASE)
-        # insert <wbr> into very long tokens so Jira/editor can wrap long lines
-        esc = insert_wbr(esc, maxlen=60)
-        # Use CSS padding for indentation so lines can wrap responsively
-        indent_rem = tabs * 1.25
-        out_lines.append(f'<div style="padding-left:{indent_rem}rem;white-space:normal;word-break:break-word;overflow-wrap:break-word;">{esc}</div>')
+    __slots__ = ('tokens', '_boards')
+
+    def __init__(self, tokens: List[Token], boards: Optional[NodeIndex] = None):
+        self.tokens = tokens
+        self._boards = boards
+
+    @property
+    def boards(self) -> NodeIndex:
+        if self._boards is None:
+            self._boards = build_tree(self.tokens)
+        return self._boards
+
+    @property
+    def lines(self) -> List[str]:
+        return [tok.line for tok in self.tokens]
 
+    def outline(self) -> List[Tuple[int, str]]:
+        """(depth, text) for each line of the tab-indented layout; ('', depth 0) separates boards."""
+        out = []
+        for b in self.boards:
+            out += board_outline(b)
+            out.append((0, ''))
+        while out and out[-1][1].strip() == '':
+            out.pop()
+        return out
+
+    def to_dict(self) -> Dict:
+        return {'boards': [board_dict(b) for b in self.boards]}
+
+
+def board_outline(board: Board) -> List[Tuple[int, str]]:
+    out = []
+    if board.title:
+        out.append((0, board.title))
+    for cat in board.categories:
+        if cat.title:
+            out.append((1, cat.title))
+        for card in cat.cards:
+            if card.title:
+                out.append((2, card.title))
+            for rule in card.rules:
+                out.append((3, rule.text + ' -> ' + rule.id if rule.id else rule.text))
+    return out
+
+
+def board_dict(board: Board) -> Dict:
+    return {'title': board.title, 'categories': [
+        {'title': cat.title, 'cards': [
+            {'title': card.title, 'rules': [{'text': r.text, 'id': r.id} for r in card.rules]}
+            for card in cat.cards]}
+        for cat in board.categories]}
+
+
+def parse_rulecard(text: str) -> RuleCardDoc:
+    return RuleCardDoc(tokenize(text))
+
+
+# Tree formats render each board to a block and then join the blocks, so a caller that kept the
+# blocks of unchanged boards (the live preview) only renders the boards that changed. A block of
+# a line-based format is a list of (blank, line) pairs; blank lines at the end of the output are
+# dropped, as in RuleCardDoc.outline().
+
+Block = List[Tuple[bool, str]]
+
+
+def _join_blocks(blocks: List[Block], sep: str) -> str:
+    lines = [line for block in blocks for line in block]
+    while lines and lines[-1][0]:
+        lines.pop()
+    return sep.join(line for _, line in lines)
+
+
+def render_bulleted(doc: RuleCardDoc) -> str:
+    return format_bulleted(doc.lines)
+
+
+def hierarchical_block(board: Board) -> Block:
+    # Board\n\tCategory\n\t\tCard\n\t\t\tRule -> ID
+    block = [(not text.strip(), '\t' * depth + text) for depth, text in board_outline(board)]
+    block.append((True, ''))
+    return block
+
+
+def join_hierarchical(blocks: List[Block]) -> str:
+    return _join_blocks(blocks, '\n')
+
+
+def render_hierarchical(doc: RuleCardDoc) -> str:
+    return join_hierarchical([hierarchical_block(b) for b in doc.boards])
+
+
+# '-> id' after html.escape()
+_ESCAPED_ARROW_ID_RE = re.compile(r'-&gt;\s*([0-9a-f]{6,40})\b', re.IGNORECASE)
+
+
+def _insert_wbr(s: str, maxlen: int = 80) -> str:
+    # insert <wbr> into long uninterrupted tokens so browsers and Jira can wrap
+    parts = s.split(' ')
+    outp = []
+    for p in parts:
+        if len(p) > maxlen:
+            # chunk the token inserting <wbr>
+            chunks = [p[i:i+maxlen] for i in range(0, len(p), maxlen)]
+            outp.append('<wbr>'.join(chunks))
+        else:
+            outp.append(p)
+    return ' '.join(outp)
+
+
+def _jira_line(depth: int, content: str) -> str:
+    # escape HTML special chars in content, then wrap trailing IDs with <strong>
+    esc = _ESCAPED_ARROW_ID_RE.sub(r'-&gt; <strong>\1</strong>', html.escape(content))
+    # insert <wbr> into very long tokens so Jira/editor can wrap long lines
+    esc = _insert_wbr(esc, maxlen=60)
+    # Use CSS padding for indentation so lines can wrap responsively
+    indent_rem = depth * 1.25
+    return f'<div style="padding-left:{indent_rem}rem;white-space:normal;word-break:break-word;overflow-wrap:break-word;">{esc}</div>'
+
+
+def jira_html_block(board: Board) -> Block:
+    block = [(not content.strip(), _jira_line(depth, content)) for depth, content in board_outline(board)]
+    block.append((True, _jira_line(0, '')))
+    return block
+
+
+def join_jira_html(blocks: List[Block]) -> str:
     # Container: full width and allow wrapping
     container_style = 'width:100%;white-space:normal;word-break:break-word;overflow-wrap:break-word;'
-    return f'<div style="{container_style}">' + ''.join(out_lines) + '</div>'
+    return f'<div style="{container_style}">' + _join_blocks(blocks, '') + '</div>'
+
+
+def render_jira_html(doc: RuleCardDoc) -> str:
+    """Return HTML suitable for pasting into Jira (IDs wrapped in <strong>), preserving indentation.
+
+    Each line of the outline becomes a block element indented with CSS padding, so lines can
+    wrap responsively rather than relying on non-breaking spaces.
+    """
+    return join_jira_html([jira_html_block(b) for b in doc.boards])
+
+
+_TRAILING_ID_RE = re.compile(r'\s*->\s*([0-9a-f]{6,40})$', re.IGNORECASE)
+
+
+def markdown_block(board: Board) -> Block:
+    """Boards and categories as headings, cards as bold list items with their rules nested below."""
+    out = []
+    if board.title:
+        out += ['## ' + board.title, '']
+    for cat in board.categories:
+        if cat.title:
+            out += ['### ' + cat.title, '']
+        for card in cat.cards:
+            indent = ''
+            if card.title:
+                # a card title may end in ' -> id' when the ID was given on the card line
+                m = _TRAILING_ID_RE.search(card.title)
+                name = card.title[:m.start()].strip() if m else card.title
+                item = f'**{name}**' if name else ''
+                if m:
+                    item = f'{item} `{m.group(1)}`'.strip()
+                out.append('- ' + item)
+                indent = '  '
+            for rule in card.rules:
+                out.append(f'{indent}- {rule.text}' + (f' `{rule.id}`' if rule.id else ''))
+        if out and out[-1]:
+            out.append('')
+    return [(not line, line) for line in out]
+
+
+def join_markdown(blocks: List[Block]) -> str:
+    return _join_blocks(blocks, '\n')
+
+
+def render_markdown(doc: RuleCardDoc) -> str:
+    return join_markdown([markdown_block(b) for b in doc.boards])
+
+
+def json_block(board: Board) -> str:
+    # the board as it appears inside render_json's indented boards list
+    return '\n'.join('    ' + line for line in json.dumps(board_dict(board), indent=2, ensure_ascii=False).split('\n'))
+
+
+def join_json(blocks: List[str]) -> str:
+    if not blocks:
+        return '{\n  "boards": []\n}'
+    return '{\n  "boards": [\n' + ',\n'.join(blocks) + '\n  ]\n}'
+
+
+def render_json(doc: RuleCardDoc) -> str:
+    return json.dumps(doc.to_dict(), indent=2, ensure_ascii=False)
+
+
+RENDERERS: Dict[str, Callable[[RuleCardDoc], str]] = {
+    'bulleted': render_bulleted,
+    'hierarchical': render_hierarchical,
+    'indented': render_hierarchical,
+    'jira_html': render_jira_html,
+    'markdown': render_markdown,
+    'json': render_json,
+}
+
+# (board -> block, blocks -> output) for every format rendered from the board tree
+BOARD_RENDERERS: Dict[str, Tuple[Callable[[Board], object], Callable[[list], str]]] = {
+    'hierarchical': (hierarchical_block, join_hierarchical),
+    'indented': (hierarchical_block, join_hierarchical),
+    'jira_html': (jira_html_block, join_jira_html),
+    'markdown': (markdown_block, join_markdown),
+    'json': (json_block, join_json),
+}
+
+
+# Line-list entry points, kept for existing callers
+
+def format_hierarchical(lines: List[str]) -> str:
+    return render_hierarchical(RuleCardDoc(tokens_from_lines(lines)))
+
+
+def format_indented(lines: List[str]) -> str:
+    # kept for backward compatibility, alias to hierarchical
+    return format_hierarchical(lines)
+
+
+def format_jira_html(lines: List[str]) -> str:
+    return render_jira_html(RuleCardDoc(tokens_from_lines(lines)))
 
 
 def format_rulecard(text: str, fmt: str) -> str:
-    lines = parse_lines(text)
-    if fmt == 'bulleted':
-        return format_bulleted(lines)
-    elif fmt in ('indented', 'hierarchical'):
-        return format_hierarchical(lines)
-    elif fmt == 'jira_html':
-        return format_jira_html(lines)
-    else:
-        return text
+    renderer = RENDERERS.get(fmt)
+    return renderer(parse_rulecard(text)) if renderer else text
+
+
+def format_rulecard_all(text: str) -> Dict[str, str]:
+    """Every output format from a single parse ('indented' is left out as an alias of 'hierarchical')."""
+    doc = parse_rulecard(text)
+    return {fmt: render(doc) for fmt, render in RENDERERS.items() if fmt != 'indented'}
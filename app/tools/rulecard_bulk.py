@@ -0,0 +1,215 @@
+"""Format many rule cards at once, one card per file.
+
+Used by the `flask tools format-rulecards` command and the bulk upload endpoint
+(app.tools.routes.rule_card_bulk). Cards are read one at a time from files, directories and
+zip/tar archives, formatted in chunks by a process pool with a bounded number of chunks in
+flight (so memory does not grow with the input), and written in input order either as a zip
+with one output file per card or as NDJSON lines.
+"""
+import json
+import multiprocessing
+import os
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.tools.archive_diff import iter_members
+from app.tools.diff_files import BINARY_SNIFF_BYTES, spool_upload
+from app.tools.process_pool import POOL_MAX_WORKERS, get_process_pool
+from app.tools.rulecard import RENDERERS, format_rulecard, format_rulecard_all
+
+BULK_CHUNK_CARDS = 50
+# Fewer cards than this are formatted in-process: starting worker processes costs more than it saves
+BULK_POOL_MIN_CARDS = 200
+BULK_MAX_CARD_BYTES = 1 << 20
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tgz', '.tar.gz', '.tar.bz2', '.tar.xz')
+OUTPUT_SUFFIXES = {'bulleted': '.txt', 'hierarchical': '.txt', 'indented': '.txt', 'jira_html': '.html',
+                   'markdown': '.md', 'json': '.json', 'all': '.json'}
+FORMATS = list(RENDERERS) + ['all']
+
+# (name, text, error): text is None when the card could not be read
+Card = Tuple[str, Optional[str], Optional[str]]
+
+
+class BulkStats:
+    def __init__(self):
+        self.cards = 0
+        self.errors = 0
+        self.input_chars = 0
+        self.output_chars = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def add(self, size: int, output: Optional[str]) -> None:
+        self.cards += 1
+        if output is None:
+            self.errors += 1
+        else:
+            self.input_chars += size
+            self.output_chars += len(output)
+        self.seconds = time.perf_counter() - self.started
+
+    @property
+    def cards_per_second(self) -> float:
+        return self.cards / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'cards': self.cards, 'errors': self.errors, 'input_chars': self.input_chars,
+                'output_chars': self.output_chars, 'seconds': round(self.seconds, 3),
+                'cards_per_second': round(self.cards_per_second, 1)}
+
+
+def is_archive(name: str) -> bool:
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _skip(name: str) -> bool:
+    # hidden files and the resource forks macOS adds to zips
+    return name.startswith('__MACOSX/') or any(part.startswith('.') for part in name.split('/'))
+
+
+def _read_card(name: str, f) -> Card:
+    data = f.read(BULK_MAX_CARD_BYTES + 1)
+    if len(data) > BULK_MAX_CARD_BYTES:
+        return name, None, f'larger than {BULK_MAX_CARD_BYTES >> 10} KB'
+    if b'\0' in data[:BINARY_SNIFF_BYTES]:
+        return name, None, 'binary file'
+    return name, data.decode('utf-8', errors='replace'), None
+
+
+def _archive_cards(path: str, prefix: str = '') -> Iterator[Card]:
+    try:
+        for name, _, f in iter_members(path):
+            if not _skip(name):
+                yield _read_card(prefix + name, f)
+    except (ValueError, OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+        yield prefix.rstrip('/') or os.path.basename(path), None, f'could not read archive: {e}'
+
+
+def iter_path_cards(paths: Iterable[str]) -> Iterator[Card]:
+    """Cards from files, directories (walked recursively, in name order) and archives."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file_name in sorted(files):
+                    full = os.path.join(root, file_name)
+                    rel = os.path.relpath(full, path).replace(os.sep, '/')
+                    if _skip(rel):
+                        continue
+                    if is_archive(file_name):
+                        yield from _archive_cards(full, rel + '/')
+                    else:
+                        with open(full, 'rb') as f:
+                            yield _read_card(rel, f)
+        elif is_archive(path):
+            yield from _archive_cards(path)
+        else:
+            with open(path, 'rb') as f:
+                yield _read_card(os.path.basename(path), f)
+
+
+def iter_upload_cards(uploads) -> Iterator[Card]:
+    """Cards from uploaded werkzeug FileStorage objects; archives are spooled to disk and expanded."""
+    for upload in uploads:
+        name = os.path.basename(upload.filename or '') or 'card.txt'
+        if not is_archive(name):
+            yield _read_card(name, upload.stream)
+            continue
+        try:
+            spooled = spool_upload(upload, name)
+        except ValueError as e:
+            yield name, None, str(e)
+            continue
+        try:
+            yield from _archive_cards(spooled.path, name + '/' if len(uploads) > 1 else '')
+        finally:
+            spooled.remove()
+
+
+def _format_chunk(fmt: str, cards: List[Card]) -> List[Tuple[str, int, Optional[str], Optional[str]]]:
+    """(name, input size, output, error) per card; runs in pool workers."""
+    out = []
+    for name, text, error in cards:
+        output = None
+        if error is None:
+            try:
+                if fmt == 'all':
+                    output = json.dumps(format_rulecard_all(text), indent=2, ensure_ascii=False)
+                else:
+                    output = format_rulecard(text, fmt)
+            except Exception as e:
+                error = f'could not format: {e}'
+        out.append((name, len(text or ''), output, error))
+    return out
+
+
+def format_cards(cards: Iterable[Card], fmt: str, workers: Optional[int] = None):
+    """Yield (name, input size, output, error) for each card, in input order.
+
+    Large inputs go to the shared process pool (app.tools.process_pool), or with `workers` to a
+    spawn pool of that size owned by this call, as the CLI asks for.
+    """
+    cards = iter(cards)
+    head = list(islice(cards, BULK_POOL_MIN_CARDS))
+    chunks = iter(lambda: list(islice(cards, BULK_CHUNK_CARDS)), [])
+    if workers == 1 or len(head) < BULK_POOL_MIN_CARDS:
+        for chunk in chain([head], chunks):
+            yield from _format_chunk(fmt, chunk)
+        return
+    head_chunks = [head[i:i + BULK_CHUNK_CARDS] for i in range(0, len(head), BULK_CHUNK_CARDS)]
+    if workers is None:
+        yield from _format_on_pool(get_process_pool(), POOL_MAX_WORKERS, fmt, chain(head_chunks, chunks))
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        yield from _format_on_pool(pool, workers, fmt, chain(head_chunks, chunks))
+
+
+def _format_on_pool(pool, workers: int, fmt: str, chunks):
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.submit(_format_chunk, fmt, chunk))
+        # keep a couple of chunks per worker queued, not the whole input
+        if len(pending) >= workers * 2:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def output_name(name: str, fmt: str) -> str:
+    return os.path.splitext(name)[0] + OUTPUT_SUFFIXES[fmt]
+
+
+def write_zip(results, fileobj, fmt: str, stats: BulkStats) -> None:
+    """One output file per card; cards that failed are listed in errors.txt."""
+    errors = []
+    used = set()
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, size, output, error in results:
+            stats.add(size, output)
+            if output is None:
+                errors.append(f'{name}: {error}')
+                continue
+            arcname = output_name(name, fmt)
+            base, suffix = os.path.splitext(arcname)
+            n = 1
+            while arcname in used:
+                n += 1
+                arcname = f'{base} ({n}){suffix}'
+            used.add(arcname)
+            zf.writestr(arcname, output)
+        if errors:
+            zf.writestr('errors.txt', '\n'.join(errors) + '\n')
+
+
+def iter_ndjson(results, fmt: str, stats: BulkStats) -> Iterator[str]:
+    """One JSON line per card ({name, output} or {name, error}), then a {summary} line."""
+    for name, size, output, error in results:
+        stats.add(size, output)
+        line = {'name': name, 'output': output} if output is not None else {'name': name, 'error': error}
+        yield json.dumps(line, ensure_ascii=False) + '\n'
+    yield json.dumps({'summary': dict(stats.as_dict(), format=fmt)}) + '\n'
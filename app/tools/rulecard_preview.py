@@ -0,0 +1,136 @@
+"""Live preview for the Rule Card Formatter.
+
+A PreviewSession holds the lines of the card being edited. An edit replaces a range of lines;
+only the new lines are lexed, and only the boards whose lines changed are built and rendered
+again, the others keep their blocks from the previous preview (see rulecard.BOARD_RENDERERS).
+
+Sessions live in this process's memory and nothing is written to the database. A request for a
+session the process does not have (another worker, a restart, eviction) is answered with
+resync, and the client starts a new session with its full text.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.tools.rulecard import BOARD_RENDERERS, board_groups, build_tree, format_bulleted, lex_line
+
+PREVIEW_MAX_SESSIONS = 64
+PREVIEW_SESSION_TTL = 30 * 60
+PREVIEW_MAX_LINES = 50000
+
+
+class _BoardState:
+    __slots__ = ('tokens', 'board', 'blocks')
+
+    def __init__(self, tokens, board):
+        self.tokens = tokens
+        self.board = board
+        self.blocks: Dict[str, Any] = {}
+
+
+class PreviewSession:
+    def __init__(self, user_id: int, text: str):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.version = 0
+        self.touched = time.monotonic()
+        self.lock = threading.Lock()
+        self.lines: List[str] = []
+        self.tokens = []
+        self.indented = None
+        self.boards: Dict[Optional[str], _BoardState] = {}
+        self.reset(text)
+
+    def reset(self, text: str) -> None:
+        self._replace(0, len(self.lines), text.replace('\r', '').split('\n'))
+        self.version += 1
+
+    def apply(self, edits: List[Dict[str, Any]]) -> None:
+        """Apply {start, end, lines} edits in order; each replaces lines[start:end] with lines.
+
+        The version changes even when an edit is rejected, so a client whose edits were only
+        partly applied has to resync.
+        """
+        try:
+            for edit in edits:
+                if not isinstance(edit, dict):
+                    raise ValueError('each edit must be an object')
+                start, end, lines = edit.get('start'), edit.get('end', edit.get('start')), edit.get('lines', [])
+                if not isinstance(start, int) or not isinstance(end, int) or not 0 <= start <= end <= len(self.lines):
+                    raise ValueError(f'edit range {start}..{end} is outside 0..{len(self.lines)}')
+                if not isinstance(lines, list) or not all(isinstance(ln, str) for ln in lines):
+                    raise ValueError('edit lines must be a list of strings')
+                self._replace(start, end, [part for ln in lines for part in ln.replace('\r', '').split('\n')])
+        finally:
+            self.version += 1
+
+    def _replace(self, start: int, end: int, lines: List[str]) -> None:
+        if len(self.lines) - (end - start) + len(lines) > PREVIEW_MAX_LINES:
+            raise ValueError(f'Live preview is limited to {PREVIEW_MAX_LINES} lines')
+        self.lines[start:end] = lines
+        self.tokens[start:end] = [lex_line(ln) for ln in lines]
+
+    def render(self, fmt: str) -> Dict[str, Any]:
+        """The formatted output and the indexes of the boards that were rebuilt for it."""
+        tokens = self.tokens
+        # blank lines at either end are dropped, as tokenize() does
+        start, stop = 0, len(tokens)
+        while start < stop and not tokens[start].text:
+            start += 1
+        while stop > start and not tokens[stop - 1].text:
+            stop -= 1
+        tokens = tokens[start:stop]
+        if fmt == 'bulleted':
+            return {'output': format_bulleted([tok.line for tok in tokens]), 'changed': [], 'boards': None}
+
+        indented = any(tok.depth for tok in tokens)
+        if indented != self.indented:
+            # the layout decides how every line is read, so nothing can be kept
+            self.indented = indented
+            self.boards = {}
+        render_block, join = BOARD_RENDERERS[fmt]
+        boards = {}
+        blocks = []
+        changed = []
+        for i, (title, group) in enumerate(board_groups(tokens, indented).items()):
+            state = self.boards.get(title)
+            # unchanged lines keep their Token objects, so an identity check finds untouched boards
+            if state is None or len(state.tokens) != len(group) or \
+                    any(a is not b for a, b in zip(state.tokens, group)):
+                state = _BoardState(group, build_tree(group, indented).last())
+                changed.append(i)
+            boards[title] = state
+            block = state.blocks.get(fmt)
+            if block is None:
+                block = state.blocks[fmt] = render_block(state.board)
+            blocks.append(block)
+        self.boards = boards
+        return {'output': join(blocks), 'changed': changed, 'boards': len(blocks)}
+
+
+_sessions: 'OrderedDict[str, PreviewSession]' = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def new_session(user_id: int, text: str) -> PreviewSession:
+    session = PreviewSession(user_id, text)
+    now = time.monotonic()
+    with _sessions_lock:
+        for sid in [sid for sid, s in _sessions.items() if now - s.touched > PREVIEW_SESSION_TTL]:
+            del _sessions[sid]
+        _sessions[session.id] = session
+        while len(_sessions) > PREVIEW_MAX_SESSIONS:
+            _sessions.popitem(last=False)
+    return session
+
+
+def get_session(session_id: str, user_id: int) -> Optional[PreviewSession]:
+    with _sessions_lock:
+        session = _sessions.get(session_id)
+        if session is None or session.user_id != user_id:
+            return None
+        _sessions.move_to_end(session_id)
+        session.touched = time.monotonic()
+        return session
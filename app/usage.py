@@ -0,0 +1,264 @@
+"""Tool usage recording off the request path.
+
+record_tool_usage() looks the tool id up in a cached name -> id map and puts the event on an
+in-memory queue. A background thread inserts the queued ToolUsage rows in one transaction when
+USAGE_BATCH_SIZE events are waiting or the oldest has waited USAGE_FLUSH_INTERVAL seconds, and
+what is left is flushed when the process exits. Requests no longer take SQLite's write lock to
+count a use.
+
+Each write also adds the events to the daily per-tool and per-user rollup tables (ToolUsageDaily,
+UserUsageDaily) in the same transaction, so the analytics never aggregate tool_usage itself;
+rebuild_rollups() recomputes them from tool_usage (`flask main rollup-usage`).
+
+When the queue is full (the database cannot keep up) events are dropped and counted; see
+UsageRecorder.stats(). Set USAGE_RECORDER_ASYNC = False to write each event immediately instead,
+as tests and one-off scripts usually want. Every write uses its own connection and transaction,
+never the caller's session; on SQLite, record a use after committing the request's own changes,
+as a synchronous write waits for the write lock a flushed session holds.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import current_app, has_app_context
+from flask_login import current_user
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+
+# Unknown tool names trigger a reload of the name -> id map at most this often
+TOOL_MAP_REFRESH_SECONDS = 60
+
+# (user_id, tool_id, timestamp)
+UsageEvent = Tuple[int, int, datetime]
+
+
+def _upsert_counts(conn, model, key: str, counts: Counter) -> None:
+    rows = [{'day': day, key: k, 'count': n} for (day, k), n in counts.items()]
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        stmt = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(model)
+        stmt = stmt.on_conflict_do_update(index_elements=['day', key],
+                                          set_={'count': model.count + stmt.excluded['count']})
+        conn.execute(stmt, rows)
+        return
+    column = getattr(model, key)
+    for row in rows:
+        updated = conn.execute(db.update(model).where(model.day == row['day'], column == row[key])
+                               .values(count=model.count + row['count'])).rowcount
+        if not updated:
+            conn.execute(db.insert(model).values(**row))
+
+
+def add_to_rollups(conn, events: List[UsageEvent]) -> None:
+    """Add events to the daily rollups in conn's current transaction."""
+    from app.models import ToolUsageDaily, UserUsageDaily
+    _upsert_counts(conn, ToolUsageDaily, 'tool_id', Counter((ts.date(), tool_id) for _, tool_id, ts in events))
+    _upsert_counts(conn, UserUsageDaily, 'user_id', Counter((ts.date(), user_id) for user_id, _, ts in events))
+
+
+def rebuild_rollups(since: Optional[date] = None) -> int:
+    """Recompute the daily rollups from tool_usage, for days from `since` on (default: all days).
+
+    Returns the number of tool_usage rows counted.
+    """
+    from app.models import ToolUsage, ToolUsageDaily, UserUsageDaily
+    day = db.func.date(ToolUsage.timestamp)
+    counted = db.session.query(db.func.count(ToolUsage.id))
+    if since is not None:
+        counted = counted.filter(ToolUsage.timestamp >= datetime.combine(since, datetime.min.time()))
+    for model, key in ((ToolUsageDaily, ToolUsage.tool_id), (UserUsageDaily, ToolUsage.user_id)):
+        delete = db.delete(model)
+        select = db.select(day, key, db.func.count(ToolUsage.id)).group_by(day, key)
+        if since is not None:
+            delete = delete.where(model.day >= since)
+            select = select.where(ToolUsage.timestamp >= datetime.combine(since, datetime.min.time()))
+        db.session.execute(delete)
+        db.session.execute(db.insert(model).from_select(['day', key.key, 'count'], select))
+    total = counted.scalar()
+    db.session.commit()
+    return total
+
+
+class UsageRecorder:
+    def __init__(self, app, max_queue: int = 10000, batch_size: int = 500, flush_interval: float = 2.0,
+                 asynchronous: bool = True):
+        self.app = app
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.asynchronous = asynchronous
+        self._tool_ids: Dict[str, int] = {}
+        self._tool_ids_loaded = 0.0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.counters = {'recorded': 0, 'written': 0, 'dropped_queue_full': 0, 'dropped_write_failed': 0,
+                         'unknown_tool': 0, 'flushes': 0}
+        self._flush_seconds = 0.0
+        self._last_flush_ms = None
+        self._max_flush_ms = 0.0
+        atexit.register(self.close)
+
+    def tool_id(self, name: str) -> Optional[int]:
+        tool_id = self._tool_ids.get(name)
+        if tool_id is None and time.monotonic() - self._tool_ids_loaded > TOOL_MAP_REFRESH_SECONDS:
+            from app.models import Tool
+            # no autoflush: the caller's pending rows would take the write lock a synchronous write needs
+            with db.session.no_autoflush:
+                self._tool_ids = dict(db.session.query(Tool.name, Tool.id).all())
+            self._tool_ids_loaded = time.monotonic()
+            tool_id = self._tool_ids.get(name)
+        return tool_id
+
+    def record(self, tool_name: str, user_id: int) -> None:
+        tool_id = self.tool_id(tool_name)
+        with self._lock:
+            if tool_id is None:
+                self.counters['unknown_tool'] += 1
+                return
+            self.counters['recorded'] += 1
+        event = (user_id, tool_id, datetime.utcnow())
+        if not self.asynchronous:
+            self._write([event])
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.counters['dropped_queue_full'] += 1
+
+    def _ensure_thread(self) -> None:
+        # the queue and thread belong to one process: a forked worker starts its own
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                if self._pid != os.getpid() or self._queue is None:
+                    self._queue = queue.Queue(self.max_queue)
+                self._pid = os.getpid()
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='usage-recorder', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        q = self._queue
+        while not self._stop.is_set():
+            try:
+                event = q.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            batch = [] if event is None else [event]
+            deadline = time.monotonic() + self.flush_interval
+            while event is not None and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if event is not None:
+                    batch.append(event)
+            self._write(batch)
+
+    def _drain(self) -> List[UsageEvent]:
+        events = []
+        if self._queue is None or self._pid != os.getpid():
+            return events
+        while True:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                return events
+            if event is not None:
+                events.append(event)
+
+    def _write(self, events: List[UsageEvent]) -> None:
+        if not events:
+            return
+        from app.models import ToolUsage
+        started = time.perf_counter()
+        # the flusher thread and atexit need an app context. Writes go through their own connection
+        # and transaction, so a synchronous write never commits or rolls back the caller's session.
+        in_app = has_app_context() and current_app._get_current_object() is self.app
+        with self._write_lock, (nullcontext() if in_app else self.app.app_context()):
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(db.insert(ToolUsage), [
+                        {'user_id': user_id, 'tool_id': tool_id, 'timestamp': ts} for user_id, tool_id, ts in events])
+                    add_to_rollups(conn, events)
+                written, failed = len(events), 0
+            except Exception:
+                self.app.logger.exception('Could not write %d tool usage event(s)', len(events))
+                written, failed = 0, len(events)
+        ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.counters['written'] += written
+            self.counters['dropped_write_failed'] += failed
+            self.counters['flushes'] += 1
+            self._flush_seconds += ms / 1000
+            self._last_flush_ms = ms
+            self._max_flush_ms = max(self._max_flush_ms, ms)
+
+    def flush(self) -> None:
+        """Write everything queued so far, in this thread."""
+        events = self._drain()
+        for i in range(0, len(events), self.batch_size):
+            self._write(events[i:i + self.batch_size])
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            try:
+                # None wakes the thread so it writes what it holds without waiting out the interval
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            flushes = self.counters['flushes']
+            return dict(self.counters,
+                        queued=self._queue.qsize() if self._queue is not None else 0,
+                        max_queue=self.max_queue,
+                        last_flush_ms=round(self._last_flush_ms, 2) if self._last_flush_ms is not None else None,
+                        max_flush_ms=round(self._max_flush_ms, 2),
+                        avg_flush_ms=round(self._flush_seconds * 1000 / flushes, 2) if flushes else None,
+                        asynchronous=self.asynchronous)
+
+
+def get_usage_recorder() -> UsageRecorder:
+    """The app's UsageRecorder, created from USAGE_* config on first use."""
+    recorder = current_app.extensions.get('usage_recorder')
+    if recorder is None:
+        config = current_app.config
+        recorder = current_app.extensions.setdefault('usage_recorder', UsageRecorder(
+            current_app._get_current_object(),
+            config.get('USAGE_QUEUE_MAX', 10000),
+            config.get('USAGE_BATCH_SIZE', 500),
+            config.get('USAGE_FLUSH_INTERVAL', 2.0),
+            config.get('USAGE_RECORDER_ASYNC', True)))
+    return recorder
+
+
+def record_tool_usage(tool_name: str, user_id: Optional[int] = None) -> None:
+    """Record that a tool was used (by the current user unless user_id is given)."""
+    try:
+        get_usage_recorder().record(tool_name, user_id if user_id is not None else current_user.id)
+    except Exception:
+        # counting a use must never fail the request that made it
+        current_app.logger.exception('Could not record usage of %s', tool_name)
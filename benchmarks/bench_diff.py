@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Compare diff engine run times on large, repetitive inputs.
+
+Usage: python benchmarks/bench_diff.py [--lines 50000] [--engines difflib,patience]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.tools.diff_engine import ENGINES, unified_diff  # noqa: E402
+
+
+def log_lines(n, rng):
+    # few distinct messages repeated many times, as in application logs
+    messages = ['INFO request handled', 'DEBUG cache hit', 'DEBUG cache miss', 'WARN slow query', '}', '{', '']
+    return [rng.choice(messages) if rng.random() < 0.9 else f'INFO request id={rng.randrange(10**6)}' for _ in range(n)]
+
+
+def config_lines(n, rng):
+    return [f'  {rng.choice(["enabled", "timeout", "retries", "host"])}: {rng.choice(["true", "false", "30", "3"])}'
+            for _ in range(n)]
+
+
+def mutate(lines, rng, edits):
+    out = list(lines)
+    for _ in range(edits):
+        p = rng.randrange(len(out))
+        r = rng.random()
+        if r < 0.4:
+            out.insert(p, f'inserted line {rng.randrange(10**6)}')
+        elif r < 0.7:
+            del out[p]
+        else:
+            out[p] = out[p] + ' (changed)'
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=50000)
+    parser.add_argument('--edits', type=int, default=200)
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    inputs = {'log': log_lines(args.lines, rng), 'config': config_lines(args.lines, rng)}
+    print(f'{"input":<8} {"engine":<10} {"seconds":>9} {"diff lines":>11}')
+    for name, a in inputs.items():
+        b = mutate(a, rng, args.edits)
+        for engine in args.engines.split(','):
+            started = time.perf_counter()
+            count = sum(1 for _ in unified_diff(a, b, 'a', 'b', engine=engine))
+            elapsed = time.perf_counter() - started
+            print(f'{name:<8} {engine:<10} {elapsed:>9.3f} {count:>11}')
+
+
+if __name__ == '__main__':
+    main()
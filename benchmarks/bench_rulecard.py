@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Time hierarchical rule card formatting as the input grows; per-line cost should stay flat.
+
+Usage: python benchmarks/bench_rulecard.py [--sizes 1000,2000,5000,10000,20000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.tools.rulecard import format_hierarchical, parse_lines  # noqa: E402
+
+
+def path_export(n, rng):
+    # 'Board -> Category -> Card -> rule -> id' lines; categories hold thousands of cards
+    boards = max(1, n // 2000)
+    lines = []
+    for i in range(n):
+        board = f'[Board {rng.randrange(boards)}]'
+        lines.append(f'{board} -> Category {rng.randrange(10)} -> Card {i // 3} -> '
+                     f'rule {i} -> {rng.getrandbits(32):08x}')
+    return '\n'.join(lines)
+
+
+def tabbed_export(n, rng):
+    lines = []
+    for i in range(n):
+        if i % 5000 == 0:
+            lines.append(f'Board {i // 5000}')
+        elif i % 1000 == 0:
+            lines.append(f'\tCategory {i // 1000}')
+        elif i % 5 == 0:
+            lines.append(f'\t\tCard {i // 5}')
+        else:
+            lines.append(f'\t\t\trule {i} -> {rng.getrandbits(32):08x}')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,2000,5000,10000,20000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f'{"input":<8} {"lines":>7} {"seconds":>9} {"us/line":>9}')
+    for name, make in (('path', path_export), ('tabbed', tabbed_export)):
+        for n in map(int, args.sizes.split(',')):
+            lines = parse_lines(make(n, rng))
+            best = float('inf')
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                format_hierarchical(lines)
+                best = min(best, time.perf_counter() - started)
+            print(f'{name:<8} {n:>7} {best:>9.4f} {best / n * 1e6:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
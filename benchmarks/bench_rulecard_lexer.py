@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Compare the rule card lexer with the regex-per-step line normalizer it replaced.
+
+Usage: python benchmarks/bench_rulecard_lexer.py [--lines 20000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.tools.rulecard import format_rulecard, parse_lines, tokenize  # noqa: E402
+
+
+def legacy_parse_lines(text):
+    # parse_lines before the lexer: four regex calls per line
+    raw_lines = [ln.rstrip() for ln in text.replace('\r', '').split('\n')]
+    lines = []
+    for ln in raw_lines:
+        mtabs = re.match(r'^(\t*)', ln)
+        tabs = mtabs.group(1) if mtabs else ''
+        body = ln[len(tabs):]
+        body = re.sub(r"^([•·\-\*]|\d+\.)\s+", "", body)
+        body = re.sub(r"^[•·\-\*]+", "", body).strip()
+        body = re.sub(r"\s+", " ", body)
+        lines.append(tabs + body.rstrip())
+    while lines and lines[0].strip() == '':
+        lines.pop(0)
+    while lines and lines[-1].strip() == '':
+        lines.pop()
+    return lines
+
+
+def pasted_export(n, rng):
+    # what users paste: bullets, numbered items, stray spaces, tab hierarchy and arrow paths
+    lines = []
+    for i in range(n):
+        r = rng.random()
+        if r < 0.05:
+            lines.append(f'[Board {i}]  ')
+        elif r < 0.15:
+            lines.append(f'\t• Category   {i}')
+        elif r < 0.35:
+            lines.append(f'\t\t{rng.randrange(1, 20)}. Card {i}')
+        elif r < 0.85:
+            lines.append(f'\t\t\t-  rule  {i} text ->  {rng.getrandbits(32):08x}')
+        else:
+            lines.append(f'Screen -> Category {i % 7} -> Card {i} -> rule {i} -> {rng.getrandbits(32):08x}')
+    return '\r\n'.join(lines)
+
+
+def best_of(repeat, fn, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    text = pasted_export(args.lines, random.Random(args.seed))
+    if legacy_parse_lines(text) != parse_lines(text):
+        sys.exit('parse_lines output differs from the legacy normalizer')
+    print(f'{"step":<28} {"seconds":>9} {"us/line":>9}')
+    for name, fn in (('legacy parse_lines', legacy_parse_lines),
+                     ('parse_lines', parse_lines),
+                     ('tokenize', tokenize),
+                     ('format_rulecard hierarchical', lambda t: format_rulecard(t, 'hierarchical'))):
+        best = best_of(args.repeat, fn, text)
+        print(f'{name:<28} {best:>9.4f} {best / args.lines * 1e6:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
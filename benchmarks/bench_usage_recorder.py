@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Compare recording tool usage with a lookup and commit per event against the buffered recorder.
+
+Runs against a throwaway SQLite database, with several threads recording at once as request
+handlers would.
+
+Usage: python benchmarks/bench_usage_recorder.py [--events 2000] [--threads 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+
+
+def make_app(path):
+    from app import create_app, db
+    from app.models import Tool, User
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.session.add(User(username='bench', email='bench@example.com'))
+        db.session.add(Tool(name='diff_checker', display_name='Diff Checker', route='/tools/diff'))
+        db.session.commit()
+    return app
+
+
+def legacy_record(app, n):
+    # record_tool_usage before the recorder: a Tool query and a commit per event
+    from app import db
+    from app.models import Tool, ToolUsage
+    with app.app_context():
+        for _ in range(n):
+            tool = Tool.query.filter_by(name='diff_checker').first()
+            db.session.add(ToolUsage(user_id=1, tool_id=tool.id))
+            db.session.commit()
+
+
+def buffered_record(app, n):
+    from app.usage import get_usage_recorder
+    with app.app_context():
+        recorder = get_usage_recorder()
+        for _ in range(n):
+            recorder.record('diff_checker', 1)
+
+
+def timed(app, fn, events, threads):
+    per_thread = events // threads
+    workers = [threading.Thread(target=fn, args=(app, per_thread)) for _ in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - started, per_thread * threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    from app.models import ToolUsage
+    from app.usage import get_usage_recorder
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        print(f'{"recorder":<22} {"events":>7} {"seconds":>9} {"us/event":>9}')
+        seconds, n = timed(app, legacy_record, args.events, args.threads)
+        print(f'{"lookup + commit":<22} {n:>7} {seconds:>9.3f} {seconds / n * 1e6:>9.1f}')
+        seconds, n = timed(app, buffered_record, args.events, args.threads)
+        print(f'{"buffered (enqueue)":<22} {n:>7} {seconds:>9.3f} {seconds / n * 1e6:>9.1f}')
+        with app.app_context():
+            recorder = get_usage_recorder()
+            started = time.perf_counter()
+            recorder.close()
+            drained = time.perf_counter() - started
+            print(f'{"buffered (drain)":<22} {"":>7} {drained:>9.3f}')
+            stats = recorder.stats()
+            print(f'written {ToolUsage.query.count()} rows in total; recorder flushes {stats["flushes"]}, '
+                  f'avg {stats["avg_flush_ms"]} ms, max {stats["max_flush_ms"]} ms, '
+                  f'dropped {stats["dropped_queue_full"] + stats["dropped_write_failed"]}')
+
+
+if __name__ == '__main__':
+    main()
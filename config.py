@@ -9,3 +9,14 @@ class Config:
         'sqlite:///' + os.path.join(basedir, 'instance', 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
+    # Tool result cache (app/tools/result_cache.py); set RESULT_CACHE_DIR to add the shared on-disk tier
+    RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES') or 32 * 1024 * 1024)
+    RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR')
+    RESULT_CACHE_DISK_MAX_BYTES = int(os.environ.get('RESULT_CACHE_DISK_MAX_BYTES') or 512 * 1024 * 1024)
+    # Render the navigation Tools menu once per category/tool change instead of on every page (app/nav_cache.py)
+    NAV_FRAGMENT_CACHE = os.environ.get('NAV_FRAGMENT_CACHE', '1') != '0'
+    # Tool usage recorder (app/usage.py): events are queued and inserted in batches by a background thread
+    USAGE_RECORDER_ASYNC = os.environ.get('USAGE_RECORDER_ASYNC', '1') != '0'
+    USAGE_QUEUE_MAX = int(os.environ.get('USAGE_QUEUE_MAX') or 10000)
+    USAGE_BATCH_SIZE = int(os.environ.get('USAGE_BATCH_SIZE') or 500)
+    USAGE_FLUSH_INTERVAL = float(os.environ.get('USAGE_FLUSH_INTERVAL') or 2.0)
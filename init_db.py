@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """Initialize the database and seed initial data"""
 from app import create_app, db
-from app.models import Tool, Category
+from app.models import Tool, Category, migrate_diff_history_blobs
 
 def init_db():
     app = create_app()
@@ -24,6 +24,54 @@ def init_db():
             print('Compatibility step skipped or failed:', e)
             # continue — create_all will still have ensured Category table exists if possible
 
+        # Move diff history contents into the deduplicated blob store
+        try:
+            from sqlalchemy import inspect, text
+            inspector = inspect(db.engine)
+            cols = [c['name'] for c in inspector.get_columns('diff_history')]
+            with db.engine.begin() as conn:
+                for col in ('text1_blob_id', 'text2_blob_id'):
+                    if col not in cols:
+                        conn.execute(text(f'ALTER TABLE diff_history ADD COLUMN {col} VARCHAR(64)'))
+                        print(f"Added {col} column to 'diff_history' table.")
+            migrated = migrate_diff_history_blobs()
+            if migrated:
+                print(f'Moved {migrated} diff history row(s) to blob storage.')
+        except Exception as e:
+            print('Diff history blob migration skipped or failed:', e)
+
+        # Composite indexes backing the paginated history listings
+        try:
+            from sqlalchemy import text
+            with db.engine.begin() as conn:
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_diff_history_user_timestamp '
+                                  'ON diff_history (user_id, timestamp)'))
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_rule_card_history_user_timestamp '
+                                  'ON rule_card_history (user_id, timestamp)'))
+        except Exception as e:
+            print('History index step skipped or failed:', e)
+
+        # Daily usage rollups for usage recorded before they existed. Compare totals rather than
+        # checking for an empty table: uses recorded before this step would otherwise skip it for good.
+        try:
+            from app.models import ToolUsage, ToolUsageDaily
+            from app.usage import rebuild_rollups
+            rolled_up = db.session.query(db.func.coalesce(db.func.sum(ToolUsageDaily.count), 0)).scalar()
+            if rolled_up != ToolUsage.query.count():
+                print(f'Rolled up {rebuild_rollups()} tool usage row(s) into daily totals.')
+        except Exception as e:
+            print('Usage rollup step skipped or failed:', e)
+
+        # Full-text search index over histories saved before it existed
+        try:
+            from app.history_search import backfill_search_index, init_search_index
+            if init_search_index():
+                indexed = backfill_search_index()
+                if indexed:
+                    print(f'Added {indexed} history row(s) to the search index.')
+        except Exception as e:
+            print('History search index step skipped or failed:', e)
+
         # Check if tools already exist
         if Tool.query.count() == 0:
             # Seed initial tools
@@ -110,5 +158,9 @@ def init_db():
         else:
             print('Categories already exist in database.')
 
+        # Running servers rebuild their navigation menu for any tools or categories seeded above
+        from app.nav_cache import bump_nav_version
+        bump_nav_version()
+
 if __name__ == '__main__':
     init_db()
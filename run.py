@@ -1,12 +1,12 @@
 from app import create_app, db
-from app.models import User, Tool, ToolUsage, DiffHistory
+from app.models import User, Tool, ToolUsage, DiffHistory, ContentBlob
 
 app = create_app()
 
 @app.shell_context_processor
 def make_shell_context():
     return {'db': db, 'User': User, 'Tool': Tool, 
-            'ToolUsage': ToolUsage, 'DiffHistory': DiffHistory}
+            'ToolUsage': ToolUsage, 'DiffHistory': DiffHistory, 'ContentBlob': ContentBlob}
 
 if __name__ == '__main__':
     app.run(debug=True)
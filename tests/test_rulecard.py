@@ -0,0 +1,27 @@
+import json
+
+import pytest
+
+from app.tools.rulecard import RENDERERS, format_rulecard, format_rulecard_all, parse_rulecard
+
+
+@pytest.mark.parametrize('fmt', list(RENDERERS))
+def test_arrow_only_line_formats(fmt):
+    # a line made only of an arrow used to raise IndexError while building the tree
+    assert isinstance(format_rulecard('a\n  ->', fmt), str)
+
+
+def test_arrow_only_line_bulleted_keeps_line():
+    assert format_rulecard('a\n  ->', 'bulleted') == '- a\n->'
+
+
+def test_arrow_only_line_all_formats():
+    results = format_rulecard_all('a\n  ->')
+    assert results['bulleted'] == '- a\n->'
+    json.loads(results['json'])
+
+
+def test_bulleted_does_not_build_tree():
+    doc = parse_rulecard('a\n  ->')
+    RENDERERS['bulleted'](doc)
+    assert doc._boards is None